@@ -4,31 +4,108 @@ Monitor & Cull idle single-user servers and users
 """
 
 import asyncio
+import heapq
+import itertools
 import json
 import logging
 import os
-import ssl
 import sys
-from datetime import datetime, timezone
-from functools import partial
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
 from textwrap import dedent
 from urllib.parse import quote
 
 import dateutil.parser
 from packaging.version import Version as V
-from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.httpclient import HTTPClientError, HTTPRequest
 from tornado.httputil import url_concat
-from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.ioloop import IOLoop
 from tornado.log import LogFormatter
-from traitlets import Bool, Callable, Int, Unicode, default
+from traitlets import (
+    Bool,
+    Callable,
+    CaselessStrEnum,
+    Dict,
+    Float,
+    Int,
+    List,
+    Unicode,
+    default,
+)
 from traitlets.config import Application
 
-from .utils import maybe_future
+from . import metrics
+from .audit import AuditLog
+from .client import HTTPClientCache, make_http_client, make_ssl_context  # noqa: F401
+from .concurrency import AdaptiveLimiter
+from .cycles import CycleRunner
+from .decode import UserDecoder
+from .policy import CullPolicy, Limits
+from .ratelimit import CULL_KINDS, TokenBucket
+from .recording import ApiRecorder, ApiReplay
+from .records import (
+    ServerRecord,
+    UserRecord,
+    batch_candidates,
+    cull_priority,
+    decide_server,
+    decide_user,
+    server_times,
+)
+from .resume import ResumePoint
+from .rolling import RollingCursor
+from .scheduler import DeadlineScheduler
+from .sharding import acquire_shard_lock, shard_of
+from .tracing import JsonLinesExporter, OtlpHttpExporter, Tracer
+from .utils import is_async_callable, maybe_future, url_replace_params
 
 __version__ = "2.0.0"
 
 STATE_FILTER_MIN_VERSION = V("1.3.0")
 
+PARSE_DATE_CACHE_SIZE = 2**16
+
+# backoff (in seconds) polling servers that are slow to stop
+SLOW_STOP_POLL_MIN_INTERVAL = 1
+SLOW_STOP_POLL_MAX_INTERVAL = 30
+
+
+def _parse_date(date_string):
+    """Parse a timestamp, without caching"""
+    # fast path for the ISO 8601 timestamps JupyterHub sends,
+    # e.g. 2024-01-01T00:00:00.000000Z.
+    # fromisoformat doesn't accept the 'Z' suffix before Python 3.11
+    if date_string.endswith("Z"):
+        iso_string = date_string[:-1] + "+00:00"
+    else:
+        iso_string = date_string
+    try:
+        dt = datetime.fromisoformat(iso_string)
+    except ValueError:
+        dt = dateutil.parser.parse(date_string)
+    if not dt.tzinfo:
+        # assume naive timestamps are UTC
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+_parse_date_cached = lru_cache(maxsize=PARSE_DATE_CACHE_SIZE)(_parse_date)
+
+
+def set_parse_date_cache_size(maxsize):
+    """Set how many parsed timestamps parse_date remembers
+
+    0 disables the cache.
+    """
+    global _parse_date_cached
+    if maxsize:
+        _parse_date_cached = lru_cache(maxsize=maxsize)(_parse_date)
+    else:
+        _parse_date_cached = _parse_date
+
 
 def parse_date(date_string):
     """Parse a timestamp
@@ -36,12 +113,11 @@ def parse_date(date_string):
     If it doesn't have a timezone, assume utc
 
     Returned datetime object will always be timezone-aware
+
+    Results are cached across cull cycles,
+    since most timestamps (e.g. 'created', 'started') don't change between them.
     """
-    dt = dateutil.parser.parse(date_string)
-    if not dt.tzinfo:
-        # assume naive timestamps are UTC
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt
+    return _parse_date_cached(date_string)
 
 
 def format_td(td):
@@ -62,24 +138,76 @@ def format_td(td):
     return f"{h:02}:{m:02}:{seconds:02}"
 
 
-def make_ssl_context(keyfile, certfile, cafile=None, verify=True, check_hostname=True):
-    """Setup context for starting an https server or making requests over ssl."""
-    if not keyfile or not certfile:
-        return None
-    purpose = ssl.Purpose.SERVER_AUTH if verify else ssl.Purpose.CLIENT_AUTH
-    ssl_context = ssl.create_default_context(purpose, cafile=cafile)
-    ssl_context.load_default_certs(purpose)
-    ssl_context.load_cert_chain(certfile, keyfile)
-    ssl_context.check_hostname = check_hostname
-    return ssl_context
-
-
 def utcnow():
     """Return timezone-aware datetime for right now"""
     # Only a standalone function for mocking purposes
     return datetime.now(timezone.utc)
 
 
+def server_record(name, server, keep_model=False):
+    """Convert a server model from the API to a ServerRecord
+
+    If keep_model, the model is kept in the record, e.g. for cull arbiters.
+    """
+    # jupyterhub < 0.9 defined 'server.url' once the server was ready
+    # as an *implicit* signal that the server was ready.
+    # 0.9 adds a dedicated, explicit 'ready' field.
+    started = server.get("started")
+    last_activity = server.get("last_activity")
+    # KubeSpawner's profile, if the model includes state or user_options
+    profile = (server.get("state") or {}).get("profile_name") or (
+        server.get("user_options") or {}
+    ).get("profile")
+    return ServerRecord(
+        name,
+        pending=server.get("pending"),
+        ready=server.get("ready", bool(server.get("url"))),
+        stopped=server.get("stopped", False),
+        started=parse_date(started) if started else None,
+        last_activity=parse_date(last_activity) if last_activity else None,
+        profile=profile,
+        model=server if keep_model else None,
+    )
+
+
+def user_record(user, keep_model=False):
+    """Convert a user model from the API to a UserRecord, with its running servers
+
+    If keep_model, the user and server models are kept in the records,
+    e.g. for cull arbiters.
+    """
+    # jupyterhub 0.9 always provides a 'servers' model.
+    # 0.8 only does this when named servers are enabled.
+    if "servers" in user:
+        servers = user["servers"]
+    else:
+        # jupyterhub < 0.9 without named servers enabled.
+        # create servers dict with one entry for the default server
+        # from the user model.
+        # only if the server is running.
+        servers = {}
+        if user["server"]:
+            servers[""] = {
+                "last_activity": user["last_activity"],
+                "pending": user["pending"],
+                "url": user["server"],
+            }
+    created = user.get("created")
+    last_activity = user.get("last_activity")
+    return UserRecord(
+        user["name"],
+        admin=user.get("admin", False),
+        created=parse_date(created) if created else None,
+        last_activity=parse_date(last_activity) if last_activity else None,
+        servers={
+            name: server_record(name, server, keep_model)
+            for name, server in servers.items()
+        },
+        groups=tuple(user.get("groups") or ()),
+        model=user if keep_model else None,
+    )
+
+
 def default_cull_arbiter(*, inactive, inactive_limit, server, **kwargs):
     """Return True if time inactive exceeds limit, the classic cull check."""
     return inactive.total_seconds() >= inactive_limit
@@ -101,78 +229,314 @@ async def cull_idle(
     cull_default_servers=True,
     cull_named_servers=True,
     cull_arbiter=default_cull_arbiter,
+    workers=0,
+    scheduler=None,
+    user_names=None,
+    limiter=None,
+    api_page_concurrency=1,
+    slow_stop_timeout=0,
+    cull_arbiter_batch=None,
+    arbiter_executor=None,
+    arbiter_timeout=0,
+    arbiter_timeout_cull=False,
+    client=None,
+    decoder=None,
+    shard_count=1,
+    shard_index=0,
+    rate_limits=None,
+    cycle_budgets=None,
+    cull_priority_by="none",
+    now=None,
+    tracer=None,
+    audit=None,
+    policy=None,
+    cursor=None,
+    time_budget=0,
+    resume=None,
 ):
     """Shutdown idle single-user servers
 
     If cull_users, inactive *users* will be deleted as well.
+
+    If workers is non-zero, users are handled by that many concurrent
+    workers while the user list is still being fetched,
+    instead of after the whole list has been fetched.
+
+    If scheduler is given (a DeadlineScheduler), the earliest time each user
+    not culled could need culling is recorded in it.
+
+    If user_names is given, only those users are checked,
+    each fetched individually instead of listing all users.
+
+    If limiter is given (an AdaptiveLimiter), it limits concurrent requests
+    instead of concurrency.
+
+    api_page_concurrency is the number of user list pages requested at once,
+    with paginated user lists.
+
+    If slow_stop_timeout is non-zero, users with servers that are slow to stop
+    are polled for up to that many seconds until they have stopped,
+    so that culling the user can be finished in the same cycle.
+
+    If cull_arbiter_batch is given, it is called once per page of users
+    with the servers that may be culled on that page,
+    see IdleCuller.cull_arbiter_batch_hook.
+    Servers it returns no decision for are passed to cull_arbiter.
+
+    If arbiter_executor is given (a concurrent.futures Executor),
+    synchronous arbiters are called in it instead of on the event loop.
+    If arbiter_timeout is non-zero, arbiters taking longer than that many seconds
+    are given up on: the server is culled if arbiter_timeout_cull,
+    and batch decisions are left to cull_arbiter.
+
+    If client is given (see make_http_client), it is used for requests
+    to the Hub, so that its connections can be reused across cycles.
+    Otherwise, a client is created for this cycle and closed at the end.
+
+    If decoder is given (a UserDecoder), it decodes responses,
+    e.g. keeping only the fields of user models the culler needs.
+    Otherwise, complete user models are decoded with the json module.
+
+    If shard_count is more than 1, only users in shard shard_index
+    (see sharding.shard_of) are checked; other users are skipped
+    as soon as they are listed.
+
+    rate_limits and cycle_budgets limit how many server stops ('stop'),
+    named server removals ('remove') and user deletions ('delete') happen:
+    rate_limits maps each kind to a TokenBucket, shared across cycles,
+    cycle_budgets to the maximum number of culls of that kind this cycle.
+    Culls beyond a budget are deferred to the next cycle.
+
+    If cull_priority_by is not 'none', all servers are checked first,
+    and those to cull are then stopped most urgent first:
+    longest 'inactive', oldest ('age'),
+    or with the highest 'score' returned by the cull arbiter.
+
+    If now is given (a timezone-aware datetime), culling is decided
+    as if it were that time, e.g. to replay a recorded cycle.
+
+    If tracer is given (a tracing.Tracer), the cycle is traced:
+    requests to the Hub, handling each user, cull arbiters and stopping servers
+    are recorded as spans within a span of the whole cycle.
+
+    If audit is given (an audit.AuditLog), every decision about a server
+    or user and every request to stop or delete one is recorded in it.
+
+    If policy is given (a policy.CullPolicy), it gives the timeout and max age
+    of each server and user, or exempts them from culling,
+    instead of inactive_limit and max_age.
+
+    If cursor is given (a rolling.RollingCursor), only the next slice
+    of the user list is checked, starting where the previous cycle left off,
+    and the cursor is moved past it.
+
+    If time_budget is non-zero, no more users are listed once the cycle
+    has run for that many seconds (users already listed are still handled).
+    If resume is given (a resume.ResumePoint), where the listing stopped
+    is saved in it, and the next cycle starts listing from there.
     """
-    defaults = {
-        # GET /users may be slow if there are thousands of users and we
-        # don't do any server side filtering so default request timeouts
-        # to 60 seconds rather than tornado's 20 second default.
-        "request_timeout": int(os.environ.get("JUPYTERHUB_REQUEST_TIMEOUT") or 60)
-    }
-    if ssl_enabled:
-        ssl_context = make_ssl_context(
-            f"{internal_certs_location}/hub-internal/hub-internal.key",
-            f"{internal_certs_location}/hub-internal/hub-internal.crt",
-            f"{internal_certs_location}/hub-ca/hub-ca.crt",
-        )
+    cycle_start = time.perf_counter()
+    if decoder is None:
+        decoder = UserDecoder(backend="json", compact=False)
+    if tracer is None:
+        tracer = Tracer()
+    if audit is not None:
+        record_audit = audit.record
+    else:
 
-        logger.debug("ssl_enabled is Enabled: %s", ssl_enabled)
-        logger.debug("internal_certs_location is %s", internal_certs_location)
-        defaults["ssl_options"] = ssl_context
+        def record_audit(*args, **kwargs):
+            pass
 
-    AsyncHTTPClient.configure(None, defaults=defaults)
-    client = AsyncHTTPClient()
+    if client is None:
+        if ssl_enabled:
+            logger.debug("ssl_enabled is Enabled: %s", ssl_enabled)
+            logger.debug("internal_certs_location is %s", internal_certs_location)
+        client = make_http_client(
+            max_clients=max(concurrency, 10),
+            ssl_enabled=ssl_enabled,
+            internal_certs_location=internal_certs_location,
+            curl=False,
+            log=logger,
+        )
+        own_client = True
+    else:
+        own_client = False
 
-    if concurrency:
+    if limiter is None and concurrency:
         semaphore = asyncio.Semaphore(concurrency)
+    else:
+        semaphore = None
 
-        async def fetch(req):
-            """client.fetch wrapped in a semaphore to limit concurrency"""
+    async def fetch(req, endpoint):
+        """client.fetch wrapped in a semaphore to limit concurrency
+
+        endpoint is the API route template, e.g. "/users/:name",
+        used to label request metrics.
+        """
+        wait_start = time.perf_counter()
+        if limiter is not None:
+            await limiter.acquire()
+        elif semaphore is not None:
             await semaphore.acquire()
-            try:
-                return await client.fetch(req)
-            finally:
+        request_start = time.perf_counter()
+        # started once the slot is acquired,
+        # so a request cancelled while waiting doesn't leave it open
+        span = tracer.span(
+            f"{req.method} {endpoint}",
+            {
+                "http.request.method": req.method,
+                "http.route": endpoint,
+                "url.full": req.url,
+            },
+            kind="client",
+        ).start()
+        metrics.HUB_REQUEST_WAIT_SECONDS.observe(request_start - wait_start)
+        span.set_attribute("culler.wait_seconds", request_start - wait_start)
+        code = 599
+        try:
+            resp = await client.fetch(req)
+            code = resp.code
+            return resp
+        except Exception as e:
+            if isinstance(e, HTTPClientError):
+                code = e.code
+            span.record_error(e)
+            raise
+        finally:
+            span.set_attribute("http.response.status_code", code)
+            span.end()
+            duration = time.perf_counter() - request_start
+            metrics.HUB_REQUEST_DURATION_SECONDS.labels(
+                method=req.method, endpoint=endpoint, code=str(code)
+            ).observe(duration)
+            if limiter is not None:
+                # 599 is a timeout or connection error
+                overloaded = code >= 500 or code == 429
+                limiter.release(request_start, duration, overloaded=overloaded)
+            elif semaphore is not None:
                 semaphore.release()
 
-    else:
-        fetch = client.fetch
+    def out_of_time():
+        """Whether the cycle has run for time_budget"""
+        return time_budget and time.perf_counter() - cycle_start >= time_budget
 
-    async def fetch_paginated(req):
+    # (start, end) offsets of the pages fetch_pages didn't request,
+    # out of time_budget. end is None for the end of the listing.
+    pages_stopped_at = None
+
+    async def fetch_pages(req, endpoint, from_end=False, end=None):
         """Make a paginated API request
 
-        async generator, yields all items from a list endpoint
+        async generator, yields the lists of items on each page of a list endpoint
+
+        Once the first page tells us how many items there are,
+        up to api_page_concurrency further pages are requested at once.
+        No more pages are requested once the cycle is out of time_budget;
+        the range of offsets not requested is then left in pages_stopped_at.
+        If end is given, no pages starting at or after it are requested.
+
+        If from_end, the pages after the first are fetched from the last one
+        backwards and the first page is yielded last.
+        This way, items that disappear from the listing after being yielded
+        (e.g. users whose servers have been culled meanwhile)
+        don't shift the offsets of the pages still to be fetched.
         """
+        nonlocal pages_stopped_at
+        pages_stopped_at = None
         req.headers["Accept"] = "application/jupyterhub-pagination+json"
         url = req.url
-        resp_future = asyncio.ensure_future(fetch(req))
+        resp_future = asyncio.ensure_future(fetch(req, endpoint))
         page_no = 1
         item_count = 0
-        while resp_future is not None:
-            response = await resp_future
-            resp_future = None
-            resp_model = json.loads(response.body.decode("utf8", "replace"))
-
-            if isinstance(resp_model, list):
-                # handle pre-2.0 response, no pagination
-                items = resp_model
-            else:
-                # paginated response
-                items = resp_model["items"]
-
-                next_info = resp_model["_pagination"]["next"]
-                if next_info:
-                    page_no += 1
-                    logger.info(f"Fetching page {page_no} {next_info['url']}")
-                    # submit next request
-                    req.url = next_info["url"]
-                    resp_future = asyncio.ensure_future(fetch(req))
-
-            for item in items:
-                item_count += 1
-                yield item
+        first_items = []
+        # offsets of the pages still to request, last to request first,
+        # when they are known in advance
+        offsets = None
+        # pending page requests, in the order they are yielded
+        page_futures = deque()
+        try:
+            while resp_future is not None:
+                response = await resp_future
+                resp_future = None
+                resp_model = decoder.decode_users(response.body)
+
+                if isinstance(resp_model, list):
+                    # handle pre-2.0 response, no pagination
+                    items = resp_model
+                else:
+                    # paginated response
+                    items = resp_model["items"]
+
+                    next_info = resp_model["_pagination"]["next"]
+                    if (
+                        next_info
+                        and offsets is None
+                        and (from_end or api_page_concurrency > 1)
+                    ):
+                        total = resp_model["_pagination"]["total"]
+                        page_limit = next_info["limit"]
+                        offsets = list(
+                            range(
+                                next_info["offset"],
+                                total if end is None else min(total, end),
+                                page_limit,
+                            )
+                        )
+                        if from_end:
+                            first_items = items
+                            items = []
+                        else:
+                            offsets.reverse()
+                        next_url = next_info["url"]
+
+                    if offsets is not None:
+                        # submit requests for the next pages
+                        while offsets and len(page_futures) < max(
+                            api_page_concurrency, 1
+                        ):
+                            if out_of_time():
+                                if from_end:
+                                    # the pages left are in the middle
+                                    pages_stopped_at = (
+                                        offsets[0],
+                                        offsets[-1] + page_limit,
+                                    )
+                                else:
+                                    pages_stopped_at = (offsets[-1], end)
+                                offsets.clear()
+                                break
+                            page_no += 1
+                            page_url = url_replace_params(
+                                next_url, offset=offsets.pop()
+                            )
+                            logger.info(f"Fetching page {page_no} {page_url}")
+                            page_req = HTTPRequest(url=page_url, headers=req.headers)
+                            page_futures.append(
+                                asyncio.ensure_future(fetch(page_req, endpoint))
+                            )
+                        if page_futures:
+                            resp_future = page_futures.popleft()
+                    elif next_info and end is not None and next_info["offset"] >= end:
+                        pass
+                    elif next_info and out_of_time():
+                        pages_stopped_at = (next_info["offset"], end)
+                    elif next_info:
+                        page_no += 1
+                        logger.info(f"Fetching page {page_no} {next_info['url']}")
+                        # submit next request
+                        req.url = next_info["url"]
+                        resp_future = asyncio.ensure_future(fetch(req, endpoint))
+
+                if items:
+                    item_count += len(items)
+                    yield items
+        finally:
+            for f in page_futures:
+                f.cancel()
+
+        if first_items:
+            item_count += len(first_items)
+            yield first_items
 
         logger.debug(f"Fetched {item_count} items from {url} in {page_no} pages")
 
@@ -180,137 +544,436 @@ async def cull_idle(
     # using the `state` filter parameter. "ready" means all users who have any
     # ready servers (running, not pending).
     auth_header = {"Authorization": f"token {api_token}"}
-    resp = await fetch(HTTPRequest(url=f"{url}/", headers=auth_header))
-
-    resp_model = json.loads(resp.body.decode("utf8", "replace"))
+    cycle_span = tracer.span("cull_cycle").start()
+    try:
+        resp = await fetch(HTTPRequest(url=f"{url}/", headers=auth_header), "/")
+    except Exception as e:
+        cycle_span.record_error(e)
+        cycle_span.end()
+        if own_client:
+            client.close()
+        raise
+
+    resp_model = decoder.loads(resp.body)
     state_filter = V(resp_model["version"]) >= STATE_FILTER_MIN_VERSION
 
-    now = utcnow()
+    if now is None:
+        now = utcnow()
 
-    async def handle_server(user, server_name, server, max_age, inactive_limit):
-        """Handle (maybe) culling a single server
+    default_limits = Limits(inactive_limit, max_age, False)
 
-        "server" is the entire server model from the API.
+    def server_limits(user, server):
+        """The limits for a server, from the cull policy if there is one"""
+        if policy is None:
+            return default_limits
+        return policy.for_server(user, server)
 
-        Returns True if server is now stopped (user removable),
-        False otherwise.
+    def user_limits(user):
+        """The limits for a user, from the cull policy if there is one"""
+        if policy is None:
+            return default_limits
+        return policy.for_user(user)
+
+    def in_shard(name):
+        return shard_count <= 1 or shard_of(name, shard_count) == shard_index
+
+    # kind of cull: culls left this cycle
+    budgets_left = dict(cycle_budgets or {})
+
+    async def take_cull_slot(kind, log_name):
+        """Wait until the rate limit allows a kind of cull
+
+        Returns False if this cycle's budget for it is used up,
+        in which case the cull is deferred to the next cycle.
         """
-        log_name = user["name"]
-        if server_name:
-            log_name = f"{user['name']}/{server_name}"
-        if server.get("pending"):
+        left = budgets_left.get(kind)
+        if left is not None:
+            if left <= 0:
+                metrics.CULLS_DEFERRED.labels(kind=kind).inc()
+                logger.debug("Deferring culling %s to the next cycle", log_name)
+                return False
+            budgets_left[kind] = left - 1
+            if left == 1:
+                logger.info(
+                    f"Reached the limit of {cycle_budgets[kind]} {CULL_KINDS[kind]}"
+                    " per cycle, deferring the rest to the next cycle"
+                )
+        bucket = (rate_limits or {}).get(kind)
+        if bucket is not None:
+            await bucket.acquire()
+        return True
+
+    # the default arbiter doesn't look at models, custom ones may
+    keep_models = (
+        cull_arbiter is not default_cull_arbiter or cull_arbiter_batch is not None
+    )
+
+    def schedule_recheck(user, seconds):
+        """Record when a user may next need culling
+
+        seconds is the number of seconds from now until a limit is reached,
+        or None if no limit applies.
+        """
+        if scheduler is None or seconds is None:
+            # nothing to go on, wait for the next full scan
+            return
+        scheduler.schedule(user.name, now + timedelta(seconds=seconds))
+
+    async def call_arbiter(arbiter, timeout_result, *args, **kwargs):
+        """Call a cull arbiter, in arbiter_executor if it's synchronous
+
+        Returns timeout_result if it takes longer than arbiter_timeout.
+        """
+        if arbiter_executor is not None and not is_async_callable(arbiter):
+
+            async def run_in_executor():
+                result = await asyncio.get_running_loop().run_in_executor(
+                    arbiter_executor, partial(arbiter, *args, **kwargs)
+                )
+                # an arbiter may return an awaitable without looking async,
+                # await it here rather than take it for a decision
+                return await maybe_future(result)
+
+            result = run_in_executor()
+        else:
+            result = maybe_future(arbiter(*args, **kwargs))
+        if not arbiter_timeout:
+            return await result
+        try:
+            return await asyncio.wait_for(result, arbiter_timeout)
+        except asyncio.TimeoutError:
+            metrics.ARBITER_TIMEOUTS.inc()
+            logger.warning(f"Cull arbiter {arbiter} timed out after {arbiter_timeout}s")
+            return timeout_result
+
+    # (user name, server name): decision from cull_arbiter_batch
+    arbiter_decisions = {}
+
+    async def decide_batch(users):
+        """Ask cull_arbiter_batch about the servers of a page of users
+
+        Decisions are recorded in arbiter_decisions,
+        for handle_server to use instead of calling cull_arbiter.
+        If cull_arbiter_batch fails, cull_arbiter is used for every server.
+        """
+        candidates = batch_candidates(
+            users,
+            now,
+            server_limits,
+            cull_default_servers=cull_default_servers,
+            cull_named_servers=cull_named_servers,
+        )
+        if not candidates:
+            return
+        try:
+            with tracer.span(
+                "cull_arbiter_batch", {"culler.candidates": len(candidates)}
+            ):
+                decisions = await call_arbiter(cull_arbiter_batch, None, candidates)
+        except Exception:
+            logger.exception(
+                f"Error in cull arbiter batch hook for {len(candidates)} servers,"
+                " using cull arbiter hook instead"
+            )
+            return
+        if decisions:
+            arbiter_decisions.update(decisions)
+
+    # listing (state filter): names of users handled this cycle no longer in it,
+    # so that offsets in it can be moved back by as many
+    users_gone = {"inactive": set(), "ready": set(), None: set()}
+
+    # user name: names of servers that were slow to stop (202)
+    slow_stops = {}
+    # (user name, future) following up on servers that were slow to stop
+    follow_ups = []
+
+    async def follow_up_slow_stops(user, server_names, cull_user_after):
+        """Poll a user until servers that were slow to stop have stopped
+
+        Polls with exponential backoff, for up to slow_stop_timeout seconds.
+        Once they have all stopped and if cull_user_after,
+        finish culling the user.
+
+        Returns True if the user has been deleted, False otherwise.
+        """
+        name = user.name
+        stopping = set(server_names)
+        deadline = time.monotonic() + slow_stop_timeout
+        delay = SLOW_STOP_POLL_MIN_INTERVAL
+        while stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, SLOW_STOP_POLL_MAX_INTERVAL)
+            polled_user = await fetch_user(name)
+            if polled_user is None:
+                # user is gone
+                return False
+            for server_name in list(stopping):
+                server = polled_user.servers.get(server_name)
+                if not server or server.stopped:
+                    stopping.discard(server_name)
+                    metrics.SERVERS_CULLED.labels(
+                        server_type="named" if server_name else "default"
+                    ).inc()
+                    logger.info(
+                        f"Server {name}/{server_name} has stopped"
+                        if server_name
+                        else f"Server {name} has stopped"
+                    )
+
+        if stopping:
             logger.warning(
-                f"Not culling server {log_name} with pending {server['pending']}"
+                f"Servers of {name} still stopping after {slow_stop_timeout}s: "
+                + ", ".join(repr(server_name) for server_name in sorted(stopping))
             )
+            schedule_recheck(user, 0)
             return False
 
-        # jupyterhub < 0.9 defined 'server.url' once the server was ready
-        # as an *implicit* signal that the server was ready.
-        # 0.9 adds a dedicated, explicit 'ready' field.
+        if cull_user_after:
+            return await maybe_cull_user(user)
+        return False
+
+    async def check_server(user, server):
+        """Decide whether to cull a single server
+
+        "server" is the server's ServerRecord.
+
+        Returns (decision, cull_result) with the arbiter's cull_result,
+        or (None, None) if the server can't be culled now.
+        """
+        server_name = server.name
+        log_name = user.name
+        if server_name:
+            log_name = f"{user.name}/{server_name}"
+        if server.pending:
+            logger.warning(
+                f"Not culling server {log_name} with pending {server.pending}"
+            )
+            record_audit("skip", user.name, server_name)
+            schedule_recheck(user, 0)
+            return None, None
+
         # By current (0.9) definitions, servers that have no pending
         # events and are not ready shouldn't be in the model,
         # but let's check just to be safe.
 
-        if not server.get("ready", bool(server["url"])):
+        if not server.ready:
             logger.warning(
                 f"Not culling not-ready not-pending server {log_name}: {server}"
             )
-            return False
-
-        if server.get("started"):
-            age = now - parse_date(server["started"])
-        else:
-            # started may be undefined on jupyterhub < 0.9
-            age = None
+            record_audit("skip", user.name, server_name)
+            schedule_recheck(user, 0)
+            return None, None
 
-        # check last activity
-        # last_activity can be None in 0.9
-        if server["last_activity"]:
-            inactive = now - parse_date(server["last_activity"])
-        else:
-            # no activity yet, use start date
-            # last_activity may be None with jupyterhub 0.9,
-            # which introduces the 'started' field which is never None
-            # for running servers
-            inactive = age
+        limits = server_limits(user, server)
+        if limits.exempt:
+            logger.debug("Not culling server %s, exempt by the cull policy", log_name)
+            record_audit("keep", user.name, server_name, rule="exempt")
+            return None, None
 
         is_default_server = server_name == ""
         is_named_server = server_name != ""
 
-        cull_result = await maybe_future(
-            cull_arbiter(
-                inactive=inactive, inactive_limit=inactive_limit, server=server
-            )
-        )
+        cull_result = arbiter_decisions.pop((user.name, server_name), None)
+        if cull_result is None:
+            age, inactive = server_times(server, now)
+            with tracer.span(
+                "cull_arbiter", {"culler.user": user.name, "culler.server": server_name}
+            ):
+                cull_result = await call_arbiter(
+                    cull_arbiter,
+                    arbiter_timeout_cull,
+                    inactive=inactive,
+                    inactive_limit=limits.timeout,
+                    server=server.model,
+                )
 
-        should_cull = (
-            inactive is not None
-            and cull_result
-            and (
-                (cull_default_servers and is_default_server)
-                or (cull_named_servers and is_named_server)
-            )
+        decision = decide_server(
+            server,
+            now,
+            inactive_limit=limits.timeout,
+            max_age=limits.max_age,
+            cull_result=cull_result,
+            cull_enabled=(cull_default_servers and is_default_server)
+            or (cull_named_servers and is_named_server),
+        )
+        record_audit(
+            "cull" if decision.cull else "keep",
+            user.name,
+            server_name,
+            rule=decision.reason,
+            inactive=decision.inactive,
+            age=decision.age,
         )
-        if should_cull:
+        if decision.reason == "inactive":
             logger.info(
-                f"Culling server {log_name} (inactive for {format_td(inactive)})"
+                f"Culling server {log_name} (inactive for {format_td(decision.inactive)})"
             )
-
-        if max_age and not should_cull:
-            # only check started if max_age is specified
-            # so that we can still be compatible with jupyterhub 0.8
-            # which doesn't define the 'started' field
-            if age is not None and age.total_seconds() >= max_age:
-                logger.info(
-                    "Culling server %s (age: %s, inactive for %s)",
+        elif decision.reason == "age":
+            logger.info(
+                "Culling server %s (age: %s, inactive for %s)",
+                log_name,
+                format_td(decision.age),
+                format_td(decision.inactive),
+            )
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Not culling server %s (age: %s, inactive for %s)",
                     log_name,
-                    format_td(age),
-                    format_td(inactive),
+                    format_td(decision.age),
+                    format_td(decision.inactive),
                 )
-                should_cull = True
+            schedule_recheck(user, decision.recheck)
+        return decision, cull_result
 
-        if not should_cull:
-            logger.debug(
-                "Not culling server %s (age: %s, inactive for %s)",
-                log_name,
-                format_td(age),
-                format_td(inactive),
+    async def stop_server(user, server):
+        """Stop (or remove) a server that should be culled
+
+        Returns True if server is now stopped (user removable),
+        False otherwise.
+        """
+        with tracer.span(
+            "stop_server", {"culler.user": user.name, "culler.server": server.name}
+        ):
+            server_name = server.name
+            log_name = f"{user.name}/{server_name}" if server_name else user.name
+            kind = "remove" if server_name and remove_named_servers else "stop"
+            if not await take_cull_slot(kind, log_name):
+                record_audit("defer", user.name, server_name)
+                schedule_recheck(user, 0)
+                return False
+
+            body = None
+            if server_name:
+                # culling a named server
+                # A named server can be stopped and kept available to the user
+                # for starting again or stopped and removed. To remove the named
+                # server we have to pass an additional option in the body of our
+                # DELETE request.
+                delete_url = "{}/users/{}/servers/{}".format(
+                    url,
+                    quote(user.name),
+                    quote(server_name),
+                )
+                if remove_named_servers:
+                    body = json.dumps({"remove": True})
+            else:
+                delete_url = "{}/users/{}/server".format(
+                    url,
+                    quote(user.name),
+                )
+
+            req = HTTPRequest(
+                url=delete_url,
+                method="DELETE",
+                headers=auth_header,
+                body=body,
+                allow_nonstandard_methods=True,
             )
+            try:
+                if server_name:
+                    resp = await fetch(req, "/users/:name/servers/:server_name")
+                else:
+                    resp = await fetch(req, "/users/:name/server")
+            except HTTPClientError as e:
+                record_audit(kind, user.name, server_name, status=e.code)
+                raise
+            record_audit(kind, user.name, server_name, status=resp.code)
+            if resp.code == 202:
+                logger.warning(f"Server {log_name} is slow to stop")
+                metrics.SERVERS_SLOW_TO_STOP.inc()
+                if slow_stop_timeout:
+                    # handle_user will follow up until it has stopped
+                    slow_stops.setdefault(user.name, []).append(server_name)
+                else:
+                    schedule_recheck(user, 0)
+                # return False to prevent culling user with pending shutdowns
+                return False
+            metrics.SERVERS_CULLED.labels(
+                server_type="named" if server_name else "default"
+            ).inc()
+            return True
+
+    async def handle_server(user, server):
+        """Handle (maybe) culling a single server
+
+        Returns True if server is now stopped (user removable),
+        False otherwise.
+        """
+        decision, cull_result = await check_server(user, server)
+        if decision is None or not decision.cull:
             return False
+        return await stop_server(user, server)
 
-        body = None
-        if server_name:
-            # culling a named server
-            # A named server can be stopped and kept available to the user
-            # for starting again or stopped and removed. To remove the named
-            # server we have to pass an additional option in the body of our
-            # DELETE request.
-            delete_url = "{}/users/{}/servers/{}".format(
-                url,
-                quote(user["name"]),
-                quote(server["name"]),
-            )
-            if remove_named_servers:
-                body = json.dumps({"remove": True})
-        else:
-            delete_url = "{}/users/{}/server".format(
-                url,
-                quote(user["name"]),
-            )
+    # heap of (priority, n, user, server) for servers to cull, with cull_priority
+    cull_heap = []
+    cull_heap_counter = itertools.count()
+    # user name: [user, servers to cull, servers still alive]
+    prioritized_users = {}
 
-        req = HTTPRequest(
-            url=delete_url,
-            method="DELETE",
-            headers=auth_header,
-            body=body,
-            allow_nonstandard_methods=True,
+    async def check_user_servers(user):
+        """Decide about all of a user's servers, with cull_priority
+
+        Servers to cull are pushed on cull_heap, to be stopped most urgent first
+        once all users have been checked.
+
+        Returns True if the user has servers to cull.
+        """
+        decisions = await asyncio.gather(
+            *(check_server(user, server) for server in user.servers.values())
+        )
+        to_cull = 0
+        for server, (decision, cull_result) in zip(user.servers.values(), decisions):
+            if decision is not None and decision.cull:
+                to_cull += 1
+                heapq.heappush(
+                    cull_heap,
+                    (
+                        cull_priority(decision, cull_priority_by, cull_result),
+                        next(cull_heap_counter),
+                        user,
+                        server,
+                    ),
+                )
+        if to_cull:
+            prioritized_users[user.name] = [user, to_cull, len(decisions) - to_cull]
+        return bool(to_cull)
+
+    async def cull_prioritized():
+        """Stop the servers on cull_heap, most urgent first
+
+        Users are finished (e.g. culled) once all their servers have been handled.
+        """
+        if not cull_heap:
+            return
+        logger.info(f"Culling {len(cull_heap)} servers by {cull_priority_by}")
+
+        async def stop_next():
+            _, _, user, server = heapq.heappop(cull_heap)
+            stopped = await stop_server(user, server)
+            entry = prioritized_users[user.name]
+            entry[1] -= 1
+            if not stopped:
+                entry[2] += 1
+            if entry[1] == 0:
+                del prioritized_users[user.name]
+                return await finish_user(user, still_alive=entry[2])
+
+        async def worker():
+            while cull_heap:
+                name = cull_heap[0][2].name
+                await process_user(name, stop_next())
+
+        await asyncio.gather(
+            *(
+                worker()
+                for _ in range(min(workers or concurrency or 10, len(cull_heap)))
+            )
         )
-        resp = await fetch(req)
-        if resp.code == 202:
-            logger.warning(f"Server {log_name} is slow to stop")
-            # return False to prevent culling user with pending shutdowns
-            return False
-        return True
 
     async def handle_user(user):
         """Handle one user.
@@ -319,145 +982,476 @@ async def cull_idle(
         that to be done, and if all servers are stopped, possibly cull
         the user.
         """
-        # shutdown servers first.
-        # Hub doesn't allow deleting users with running servers.
-        # jupyterhub 0.9 always provides a 'servers' model.
-        # 0.8 only does this when named servers are enabled.
-        if "servers" in user:
-            servers = user["servers"]
-        else:
-            # jupyterhub < 0.9 without named servers enabled.
-            # create servers dict with one entry for the default server
-            # from the user model.
-            # only if the server is running.
-            servers = {}
-            if user["server"]:
-                servers[""] = {
-                    "last_activity": user["last_activity"],
-                    "pending": user["pending"],
-                    "url": user["server"],
-                }
-        server_futures = [
-            handle_server(user, server_name, server, max_age, inactive_limit)
-            for server_name, server in servers.items()
-        ]
-        if server_futures:
-            results = await asyncio.gather(*server_futures)
-        else:
-            results = []
+        with tracer.span(
+            "handle_user",
+            {"culler.user": user.name, "culler.servers": len(user.servers)},
+        ):
+            # shutdown servers first.
+            # Hub doesn't allow deleting users with running servers.
+            metrics.SERVERS_SCANNED.inc(len(user.servers))
+            if cull_priority_by != "none":
+                if await check_user_servers(user):
+                    # finished by cull_prioritized
+                    return False
+                # nothing to cull now, only servers still running
+                return await finish_user(user, still_alive=len(user.servers))
+
+            server_futures = [
+                handle_server(user, server) for server in user.servers.values()
+            ]
+            if server_futures:
+                results = await asyncio.gather(*server_futures)
+            else:
+                results = []
+
+            # some servers are still running, cannot cull users
+            still_alive = len(results) - sum(results)
+            return await finish_user(user, still_alive)
+
+    async def finish_user(user, still_alive):
+        """Finish handling a user whose servers have been handled
+
+        still_alive is the number of servers that have not stopped.
+        Follows up on servers that are slow to stop,
+        and culls the user if they have no servers left.
+        """
+        if still_alive == 0 and user.servers:
+            # no longer listed with ready servers
+            users_gone["ready"].add(user.name)
+        slow_servers = slow_stops.pop(user.name, None)
+        if slow_servers:
+            # the user may be culled once their slow servers have stopped
+            cull_user_after = cull_users and still_alive == len(slow_servers)
+            follow_ups.append(
+                (
+                    user.name,
+                    asyncio.ensure_future(
+                        follow_up_slow_stops(user, slow_servers, cull_user_after)
+                    ),
+                )
+            )
 
         if not cull_users:
             return
-        # some servers are still running, cannot cull users
-        still_alive = len(results) - sum(results)
         if still_alive:
             logger.debug(
                 "Not culling user %s with %i servers still alive",
-                user["name"],
+                user.name,
                 still_alive,
             )
             return False
 
-        should_cull = False
-        if user.get("created"):
-            age = now - parse_date(user["created"])
-        else:
-            # created may be undefined on jupyterhub < 0.9
-            age = None
-
-        # check last activity
-        # last_activity can be None in 0.9
-        if user["last_activity"]:
-            inactive = now - parse_date(user["last_activity"])
-        else:
-            # no activity yet, use start date
-            # last_activity may be None with jupyterhub 0.9,
-            # which introduces the 'created' field which is never None
-            inactive = age
-
-        user_is_admin = user["admin"]
+        return await maybe_cull_user(user)
 
-        should_cull = (
-            inactive is not None and inactive.total_seconds() >= inactive_limit
-        ) and (cull_admin_users or not user_is_admin)
+    async def maybe_cull_user(user):
+        """Cull a user with no running servers, if they are idle
 
-        if should_cull:
-            logger.info(f"Culling user {user['name']} " f"(inactive for {inactive})")
-
-        if max_age and not should_cull:
-            # only check created if max_age is specified
-            # so that we can still be compatible with jupyterhub 0.8
-            # which doesn't define the 'started' field
-            if age is not None and age.total_seconds() >= max_age:
-                logger.info(
-                    f"Culling user {user['name']} "
-                    f"(age: {format_td(age)}, inactive for {format_td(inactive)})"
+        Returns True if the user has been deleted, False otherwise.
+        """
+        limits = user_limits(user)
+        if limits.exempt:
+            logger.debug("Not culling user %s, exempt by the cull policy", user.name)
+            record_audit("keep", user.name, rule="exempt")
+            return False
+        decision = decide_user(
+            user,
+            now,
+            inactive_limit=limits.timeout,
+            max_age=limits.max_age,
+            cull_admin_users=cull_admin_users,
+        )
+        record_audit(
+            "cull" if decision.cull else "keep",
+            user.name,
+            rule=decision.reason,
+            inactive=decision.inactive,
+            age=decision.age,
+        )
+        if decision.reason == "inactive":
+            logger.info(f"Culling user {user.name} (inactive for {decision.inactive})")
+        elif decision.reason == "age":
+            logger.info(
+                f"Culling user {user.name} "
+                f"(age: {format_td(decision.age)}, "
+                f"inactive for {format_td(decision.inactive)})"
+            )
+        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Not culling user %s (created: %s, last active: %s)",
+                    user.name,
+                    format_td(decision.age),
+                    format_td(decision.inactive),
                 )
-                should_cull = True
+            schedule_recheck(user, decision.recheck)
+            return False
 
-        if not should_cull:
-            logger.debug(
-                f"Not culling user {user['name']} "
-                f"(created: {format_td(age)}, last active: {format_td(inactive)})"
-            )
+        if not await take_cull_slot("delete", user.name):
+            record_audit("defer", user.name)
+            schedule_recheck(user, 0)
             return False
 
         req = HTTPRequest(
-            url=f"{url}/users/{user['name']}", method="DELETE", headers=auth_header
+            url=f"{url}/users/{user.name}", method="DELETE", headers=auth_header
         )
-        await fetch(req)
+        try:
+            resp = await fetch(req, "/users/:name")
+        except HTTPClientError as e:
+            record_audit("delete", user.name, status=e.code)
+            raise
+        record_audit("delete", user.name, status=resp.code)
+        # no longer listed at all
+        users_gone[None].add(user.name)
+        if not user.servers:
+            users_gone["inactive"].add(user.name)
+        metrics.USERS_CULLED.inc()
         return True
 
-    futures = []
-
     params = {}
     if api_page_size:
         params["limit"] = str(api_page_size)
 
+    def page_records(users):
+        """Convert the users on a page that are in our shard to UserRecords"""
+        users = [user for user in users if in_shard(user["name"])]
+        metrics.USERS_SCANNED.inc(len(users))
+        return [user_record(user, keep_models) for user in users]
+
     # If we filter users by state=ready then we do not get back any which
     # are inactive, so if we're also culling users get the set of users which
     # are inactive and see if they should be culled as well.
-    users_url = f"{url}/users"
+    # The listings to go through, in order: state filters, None for all users
+    listings = []
     if state_filter and cull_users:
-        inactive_params = {"state": "inactive"}
-        inactive_params.update(params)
-        req = HTTPRequest(url_concat(users_url, inactive_params), headers=auth_header)
-        n_idle = 0
-        async for user in fetch_paginated(req):
-            n_idle += 1
-            futures.append((user["name"], handle_user(user)))
-        logger.debug(f"Got {n_idle} users with inactive servers")
-
-    if state_filter:
-        params["state"] = "ready"
-
-    req = HTTPRequest(
-        url=url_concat(users_url, params),
-        headers=auth_header,
-    )
-
-    n_users = 0
-    async for user in fetch_paginated(req):
-        n_users += 1
-        futures.append((user["name"], handle_user(user)))
-
-    if state_filter:
-        logger.debug(f"Got {n_users} users with ready servers")
+        listings.append("inactive")
+    listings.append("ready" if state_filter else None)
+    listing_descriptions = {
+        "inactive": "users with inactive servers",
+        "ready": "users with ready servers",
+        None: "users",
+    }
+    # where listing users stopped, out of time_budget:
+    # (listing, start, end, shifting), start and end the offsets of the users
+    # not listed (end None for the end of the listing), shifting the names
+    # of the users listed before start, None if all the users listed are
+    resume_at = None
+
+    async def iter_user_pages(from_end=False):
+        """Iterate over all users that may need culling
+
+        async generator, yields lists of UserRecords, one per page
+        of the paginated user list API(s), as they arrive.
+        Starts where resume says the last cycle stopped, if it did.
+        """
+        nonlocal resume_at
+        cycle_listings = listings
+        offset = 0
+        end = None
+        resume_point = resume.get() if resume is not None else None
+        if resume_point is not None and resume_point[0] in listings:
+            state, offset, end = resume_point
+            cycle_listings = listings[listings.index(state) :]
+            logger.info(
+                f"Resuming from user {offset} of {listing_descriptions[state]}"
+                + ("" if end is None else f", up to user {end}")
+            )
+
+        for state in cycle_listings:
+            if state != cycle_listings[0] and out_of_time():
+                resume_at = (state, 0, None, set())
+            else:
+                query = dict(params)
+                if state:
+                    query["state"] = state
+                if offset:
+                    query["offset"] = str(offset)
+                req = HTTPRequest(
+                    url_concat(f"{url}/users", query), headers=auth_header
+                )
+                n_users = 0
+                records = []
+                async for users in fetch_pages(
+                    req, "/users", from_end=from_end, end=end
+                ):
+                    records = page_records(users)
+                    n_users += len(records)
+                    yield records
+                logger.debug(f"Got {n_users} {listing_descriptions[state]}")
+                if pages_stopped_at is not None:
+                    start, stop_end = pages_stopped_at
+                    # from the end, the first page is the last one yielded,
+                    # and the only one before start
+                    shifting = {user.name for user in records} if from_end else None
+                    resume_at = (state, start, stop_end, shifting)
+            if resume_at is not None:
+                state, start, stop_end, _ = resume_at
+                logger.warning(
+                    f"Cull cycle is out of its {time_budget}s budget, stopped"
+                    f" at user {start} of {listing_descriptions[state]}"
+                    + ("" if stop_end is None else f", up to user {stop_end}")
+                )
+                return
+            offset = 0
+            end = None
+
+    async def fetch_user(name):
+        """Fetch a single user, as a UserRecord
+
+        None if the user doesn't exist.
+        """
+        req = HTTPRequest(url=f"{url}/users/{quote(name)}", headers=auth_header)
+        try:
+            resp = await fetch(req, "/users/:name")
+        except HTTPClientError as e:
+            if e.code == 404:
+                logger.debug("User %s no longer exists", name)
+                return None
+            raise
+        return user_record(decoder.decode_user(resp.body), keep_models)
+
+    async def iter_named_user_pages(from_end=False):
+        """Iterate over the users in user_names
+
+        async generator, yields lists of UserRecords fetched concurrently
+        (limited by concurrency): each list has the next user to arrive
+        and those after it that have already arrived.
+        """
+        futures = deque(
+            asyncio.ensure_future(fetch_user(name))
+            for name in user_names
+            if in_shard(name)
+        )
+        try:
+            while futures:
+                results = [await futures.popleft()]
+                while futures and futures[0].done():
+                    results.append(futures.popleft().result())
+                users = [user for user in results if user is not None]
+                if users:
+                    metrics.USERS_SCANNED.inc(len(users))
+                    yield users
+        finally:
+            for f in futures:
+                f.cancel()
+        logger.debug(f"Checked {len(user_names)} users")
+
+    # the slice of a rolling scan listed this cycle
+    slice_listed = 0
+    slice_total = None
+    slice_end = False
+
+    async def iter_rolling_user_pages(from_end=False):
+        """Iterate over the next slice of users of a rolling scan
+
+        async generator, yields lists of UserRecords, one per page.
+        All the slice's pages are fetched before any user is handled,
+        so that users leaving the listing (e.g. culled)
+        don't shift the offsets of the pages still to be fetched.
+        """
+        nonlocal slice_listed, slice_total, slice_end
+        size = cursor.slice_size(listings)
+        query = dict(params)
+        if slice_state:
+            query["state"] = slice_state
+        pages = []
+        while True:
+            query["offset"] = str(slice_offset + slice_listed)
+            if size:
+                limit = size - slice_listed
+                if api_page_size:
+                    limit = min(limit, api_page_size)
+                query["limit"] = str(limit)
+            req = HTTPRequest(
+                url_concat(f"{url}/users", query),
+                headers=dict(
+                    auth_header, Accept="application/jupyterhub-pagination+json"
+                ),
+            )
+            resp = await fetch(req, "/users")
+            resp_model = decoder.decode_users(resp.body)
+            if isinstance(resp_model, list):
+                # pre-2.0, no pagination: slice the whole list
+                slice_total = len(resp_model)
+                if not size:
+                    # the whole list tells how many users there are
+                    cursor.totals[slice_state] = slice_total
+                    size = cursor.slice_size(listings)
+                pages.append(resp_model[slice_offset : slice_offset + size])
+                slice_listed = len(pages[-1])
+                slice_end = slice_offset + slice_listed >= slice_total
+                break
+            items = resp_model["items"]
+            pages.append(items)
+            slice_listed += len(items)
+            slice_total = resp_model["_pagination"]["total"]
+            if not items or not resp_model["_pagination"]["next"]:
+                slice_end = True
+                break
+            if not size or slice_listed >= size:
+                # a slice of unknown size is one page, until we know how many
+                # users there are
+                break
+        logger.info(
+            f"Checking users {slice_offset}-{slice_offset + slice_listed}"
+            f" of {slice_total} ({slice_state or 'all'})"
+        )
+        for users in pages:
+            yield page_records(users)
+
+    if cursor is not None:
+        slice_state, slice_offset = cursor.position(listings)
+    else:
+        slice_state = slice_offset = None
+
+    if user_names is not None:
+        iter_cycle_user_pages = iter_named_user_pages
+    elif cursor is not None:
+        iter_cycle_user_pages = iter_rolling_user_pages
     else:
-        logger.debug(f"Got {n_users} users")
+        iter_cycle_user_pages = iter_user_pages
+
+    async def iter_cycle_users(from_end=False):
+        """Iterate over the users to check this cycle
 
-    for name, f in futures:
+        async generator, yields UserRecords.
+        With cull_arbiter_batch, it is called for each page of users
+        before they are yielded.
+        """
+        async for users in iter_cycle_user_pages(from_end=from_end):
+            if cull_arbiter_batch is not None:
+                await decide_batch(users)
+            for user in users:
+                yield user
+
+    cycle_errors = 0
+
+    async def process_user(name, f):
+        """Await handle_user for one user, logging the outcome"""
+        nonlocal cycle_errors
         try:
             result = await f
         except Exception:
+            cycle_errors += 1
+            metrics.ERRORS.inc()
             logger.exception(f"Error processing {name}")
+            if scheduler is not None:
+                # don't wait for the next full scan to try again
+                scheduler.schedule(name, now)
         else:
             if result:
                 logger.debug("Finished culling %s", name)
 
+    async def handle_users():
+        """Handle all users in the user list"""
+        if not workers:
+            # collect every user before handling any of them
+            futures = []
+            async for user in iter_cycle_users():
+                futures.append((user.name, handle_user(user)))
+
+            for name, f in futures:
+                await process_user(name, f)
+            return
+
+        # streaming mode: a bounded queue between the user listing
+        # and a fixed pool of workers, so culling overlaps with fetching pages
+        # and at most `workers` users are waiting to be handled at any time.
+        # Users are culled while we are still paginating, which removes them
+        # from the state-filtered listings, so pages are fetched from the end
+        # to avoid skipping users.
+        queue = asyncio.Queue(maxsize=workers)
+
+        async def worker():
+            while True:
+                user = await queue.get()
+                if user is None:
+                    # end of the user list
+                    return
+                await process_user(user.name, handle_user(user))
+
+        worker_tasks = [asyncio.ensure_future(worker()) for _ in range(workers)]
+        try:
+            async for user in iter_cycle_users(from_end=True):
+                await queue.put(user)
+            for _ in worker_tasks:
+                await queue.put(None)
+            await asyncio.gather(*worker_tasks)
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+
+    async def finish_follow_ups():
+        """Wait for follow ups on servers that were slow to stop"""
+        if follow_ups:
+            logger.info(f"Waiting for {len(follow_ups)} users' servers to stop")
+        while follow_ups:
+            name, f = follow_ups.pop(0)
+            await process_user(name, f)
+
+    try:
+        await handle_users()
+        await cull_prioritized()
+        await finish_follow_ups()
+        if cursor is not None:
+            cursor.advance(
+                listings,
+                slice_listed,
+                len(users_gone[slice_state]),
+                slice_total,
+                slice_end,
+            )
+        if resume is not None and user_names is None and cursor is None:
+            if resume_at is None:
+                resume.clear()
+            else:
+                state, start, end, shifting = resume_at
+                gone = users_gone[state]
+                if shifting is not None:
+                    gone = gone & shifting
+                # users gone from the listing before start no longer shift it
+                resume.save(
+                    state,
+                    max(start - len(gone), 0),
+                    None if end is None else max(end - len(gone), 0),
+                )
+    except Exception as e:
+        cycle_errors += 1
+        metrics.ERRORS.inc()
+        cycle_span.record_error(e)
+        raise
+    finally:
+        cycle_span.set_attribute("culler.errors", cycle_errors)
+        cycle_span.end()
+        if audit is not None:
+            await audit.flush()
+        metrics.CYCLE_DURATION_SECONDS.observe(time.perf_counter() - cycle_start)
+        metrics.CYCLE_ERRORS.set(cycle_errors)
+        metrics.LAST_CYCLE_TIMESTAMP_SECONDS.set(time.time())
+        for name, f in follow_ups:
+            f.cancel()
+        if own_client:
+            client.close()
+        if limiter is not None:
+            logger.info(f"Concurrency limit is {limiter.limit}")
+
 
 class IdleCuller(Application):
 
+    api_page_concurrency = Int(
+        1,
+        help=dedent("""
+            Number of user list pages to request at the same time,
+            when using JupyterHub 2.0's paginated user list API.
+
+            By default, the next page is requested while the current one is handled.
+            With more, once the first page tells how many users there are,
+            up to this many of the following pages are requested at once,
+            still limited by --concurrency.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     api_page_size = Int(
         0,
         help=dedent("""
@@ -469,29 +1463,183 @@ class IdleCuller(Application):
         config=True,
     )
 
-    concurrency = Int(
-        10,
+    arbiter_executor = CaselessStrEnum(
+        ["none", "thread", "process"],
+        default_value="none",
         help=dedent("""
-            Limit the number of concurrent requests made to the Hub.
+            Where to call synchronous cull_arbiter_hook and cull_arbiter_batch_hook.
 
-            Deleting a lot of users at the same time can slow down the Hub,
-            so limit the number of API requests we have outstanding at any given time.
+            - none: on the event loop, pausing every other request meanwhile.
+            - thread: in a thread pool, for hooks doing blocking I/O.
+            - process: in a process pool, for CPU-heavy hooks.
+              The hooks and their return values must be picklable,
+              e.g. functions imported from a module rather than defined
+              in the config file.
+
+            Async hooks are always called on the event loop.
             """).strip(),
     ).tag(
         config=True,
     )
 
-    config_file = Unicode(
-        "idle_culler_config.py",
+    arbiter_executor_workers = Int(
+        0,
         help=dedent("""
-            Config file to load.
+            Number of threads or processes calling arbiter hooks
+            (only with --arbiter-executor).
+            Default: the concurrent.futures default for the executor.
             """).strip(),
     ).tag(
         config=True,
     )
 
-    cull_admin_users = Bool(
-        True,
+    arbiter_timeout = Float(
+        0,
+        help=dedent("""
+            Time (in seconds) to wait for an arbiter hook to decide.
+
+            If cull_arbiter_hook takes longer, the server is culled
+            only if --arbiter-timeout-cull.
+            If cull_arbiter_batch_hook takes longer,
+            cull_arbiter_hook is called for each server instead.
+            A hook running in an executor keeps running after the timeout,
+            its result is ignored.
+            Default: 0, wait as long as it takes.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    arbiter_timeout_cull = Bool(
+        False,
+        help=dedent("""
+            Whether to cull servers when cull_arbiter_hook times out
+            (only with --arbiter-timeout).
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    audit_log = Unicode(
+        "",
+        help=dedent("""
+            Path to a file to write an audit log of culling to,
+            one JSON record per line.
+
+            Each decision about a server or user (with the rule, inactive time
+            and age) and each request to stop a server or delete a user
+            (with its HTTP status) is recorded.
+            Records are buffered and written by a background thread,
+            at least every second.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    audit_log_backup_count = Int(
+        5,
+        help=dedent("""
+            Number of rotated audit logs to keep, with --audit-log-max-bytes.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    audit_log_max_bytes = Int(
+        0,
+        help=dedent("""
+            Size (in bytes) at which to rotate the audit log, to the same path
+            with a .1 suffix, the previous .1 to .2, etc.
+            Default: 0, never rotate.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    compact_user_models = Bool(
+        False,
+        help=dedent("""
+            Keep only the fields of user and server models that the culler needs,
+            instead of complete models (groups, roles, server state, ...).
+
+            With a custom cull_arbiter_hook or cull_arbiter_batch_hook,
+            servers' 'state' and 'user_options' are kept as well.
+            Only enable if your hooks need no other fields.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    concurrency = Int(
+        10,
+        help=dedent("""
+            Limit the number of concurrent requests made to the Hub.
+
+            Deleting a lot of users at the same time can slow down the Hub,
+            so limit the number of API requests we have outstanding at any given time.
+
+            Connections to the Hub are kept alive and reused across requests
+            and cull cycles only if pycurl is installed.
+            Without it, each request opens a new connection.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    adaptive_concurrency = Bool(
+        False,
+        help=dedent("""
+            Adapt the limit on concurrent requests to how the Hub copes.
+
+            Starting from --concurrency, the limit slowly increases while requests
+            succeed, and is halved when the Hub responds with errors (5xx, 429),
+            requests time out, or take longer than --concurrency-latency-target.
+            The limit stays between --concurrency-min and --concurrency-max.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    concurrency_latency_target = Float(
+        0,
+        help=dedent("""
+            With --adaptive-concurrency, requests taking longer than this many
+            seconds decrease the concurrency limit.
+            Default: 0, only errors decrease the limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    concurrency_max = Int(
+        100,
+        help=dedent("""
+            Maximum concurrent requests with --adaptive-concurrency.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    concurrency_min = Int(
+        1,
+        help=dedent("""
+            Minimum concurrent requests with --adaptive-concurrency.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    config_file = Unicode(
+        "idle_culler_config.py",
+        help=dedent("""
+            Config file to load.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    cull_admin_users = Bool(
+        True,
         help=dedent("""
             Whether admin users should be culled (only if --cull-users=true).
             """).strip(),
@@ -538,6 +1686,43 @@ class IdleCuller(Application):
         config=True,
     )
 
+    cull_arbiter_batch_hook = Callable(
+        None,
+        allow_none=True,
+        help=dedent("""
+            Enable custom culling logic deciding about many servers at once.
+
+            Like cull_arbiter_hook, but called once per page of users
+            with all the servers on that page that may be culled,
+            e.g. to look them up in an external database with a single query.
+            Define a callable taking a list of candidates and returning a dict:
+
+                def my_cull_arbiter_batch(candidates):
+                    keep = lookup_in_use({c['user']['name'] for c in candidates})
+                    return {
+                        (c['user']['name'], c['server_name']): c['user']['name'] not in keep
+                        and c['inactive'].total_seconds() >= c['inactive_limit']
+                        for c in candidates
+                    }
+                c.IdleCuller.cull_arbiter_batch_hook = my_cull_arbiter_batch
+
+            Each candidate is a dict with the keys:
+
+            - 'user', the user model
+            - 'server_name', the server's name ('' for the default server)
+            - 'server', the server model
+            - 'inactive', the server's time since last activity, a timedelta object
+            - 'inactive_limit', the idle timeout limit, in seconds
+
+            The returned dict maps (user name, server name) to True if the server
+            should be culled, and False if it should not.
+            Servers missing from it are passed to cull_arbiter_hook.
+            The callable may be async.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     cull_every = Int(
         0,
         help=dedent("""
@@ -560,6 +1745,88 @@ class IdleCuller(Application):
         config=True,
     )
 
+    cull_policy = List(
+        Dict(),
+        help=dedent("""
+            Rules giving the idle timeout and max age of users and servers,
+            by group, user name, server name or profile, instead of --timeout
+            and --max-age, or exempting them from culling.
+
+            A list of dicts, each matching by any of 'groups', 'users'
+            (lists of names), 'user_pattern' (a regular expression),
+            'servers' (server names, '' for default servers) and 'profiles'
+            (from the server's state['profile_name'] or user_options['profile'],
+            which need the admin:server_state scope or a similar one),
+            and giving any of 'timeout', 'max_age' (in seconds) and 'exempt'.
+            The first rule matching a user or server applies. For example:
+
+                c.IdleCuller.cull_policy = [
+                    {"groups": ["staff"], "exempt": True},
+                    {"profiles": ["gpu"], "timeout": 900},
+                ]
+
+            Rules are compiled once into lookup tables,
+            and need nothing but the user models from the user list.
+            Rules matching servers or profiles only apply to servers.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    cull_priority = CaselessStrEnum(
+        ["none", "inactive", "age", "score"],
+        default_value="none",
+        help=dedent("""
+            Which servers to cull first, when culls are limited
+            (e.g. by --server-stops-per-cycle or --server-stops-per-second).
+
+            - none: in the order users are listed.
+            - inactive: the servers inactive the longest.
+            - age: the oldest servers.
+            - score: the servers with the highest score,
+              a number cull_arbiter_hook (or cull_arbiter_batch_hook)
+              returns instead of True;
+              servers without a score are ordered by inactivity.
+
+            Except with none, all users are checked before any server is culled.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    cull_schedule = CaselessStrEnum(
+        ["periodic", "deadline", "rolling"],
+        default_value="periodic",
+        help=dedent("""
+            How to schedule checks for idle servers.
+
+            - periodic: check every user every --cull-every seconds.
+            - deadline: check every user every --full-scan-every seconds,
+              recording the earliest time each server could be culled
+              (e.g. when it will have been inactive for --timeout).
+              Every --cull-every seconds, only the users whose deadline has
+              passed are fetched and checked again.
+              This reduces the requests made to the Hub on large hubs,
+              but servers started after a full scan are only seen at the next one.
+            - rolling: check a slice of the users every
+              --cull-every / --rolling-slices seconds, picking up the user list
+              where the previous slice left off,
+              with a steady trickle of requests instead of a burst.
+              A pass over every user takes --rolling-slices slices,
+              or one more with --cull-users (users without servers are listed
+              separately, and a slice doesn't span both lists),
+              so every user is checked about once per --cull-every seconds.
+              The first pass, until the number of users is known,
+              may take up to about twice as long.
+              Requires JupyterHub 2.0's paginated user list to avoid listing
+              every user every time.
+              With --shard-count, users may occasionally be checked
+              a slice late, when other replicas cull users before them in the list.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     cull_users = Bool(
         False,
         help=dedent("""
@@ -571,6 +1838,74 @@ class IdleCuller(Application):
         config=True,
     )
 
+    cycle_overlap = CaselessStrEnum(
+        ["skip", "coalesce"],
+        default_value="skip",
+        help=dedent("""
+            What to do when a cull cycle is due while the previous one,
+            taking longer than --cull-every, is still running.
+            Cycles never run at the same time.
+
+            - skip: skip it, the next cycle runs at the next interval.
+            - coalesce: run it as soon as the previous one finishes.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    cycle_state_file = Unicode(
+        "",
+        help=dedent("""
+            File to save where a cull cycle out of --cycle-time-budget stopped in,
+            so that the next cycle resumes from there even after a restart.
+            Default: keep it in memory only.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    cycle_stretch_factor = Float(
+        0,
+        help=dedent("""
+            Stretch the interval between cull cycles to this many times
+            the duration of the last cycle, if that's longer than --cull-every.
+            E.g. with 2, at least as much time is left between cycles
+            as they take, on hubs where cycles are slow.
+            Default: 0, always use --cull-every.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    cycle_time_budget = Float(
+        0,
+        help=dedent("""
+            The time (in seconds) a cull cycle may spend listing users.
+            Once it's spent, the cycle lists no more users, handles those
+            already listed, and the next cycle resumes listing where it stopped,
+            so that on hubs with many users cycles stay short
+            and every user is still checked in turn.
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    full_scan_every = Int(
+        0,
+        help=dedent("""
+            The interval (in seconds) between full scans of all users
+            (only if --cull-schedule=deadline).
+            Default: --timeout.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    @default("full_scan_every")
+    def _default_full_scan_every(self):
+        return self.timeout
+
     generate_config = Bool(
         False,
         help=dedent("""
@@ -580,6 +1915,19 @@ class IdleCuller(Application):
         config=True,
     )
 
+    http2 = Bool(
+        False,
+        help=dedent("""
+            Use HTTP/2 for requests to the Hub over https (only with --ssl-enabled=true).
+
+            Requires pycurl, with a libcurl built with HTTP/2 support:
+            the culler won't start without them.
+            Many requests then share a single connection to the Hub.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     internal_certs_location = Unicode(
         "internal-ssl",
         help=dedent("""
@@ -605,6 +1953,21 @@ class IdleCuller(Application):
         """override default log format to include time"""
         return "%(color)s[%(levelname)1.1s %(asctime)s.%(msecs).03d %(name)s %(module)s:%(lineno)d]%(end_color)s %(message)s"
 
+    json_decoder = CaselessStrEnum(
+        ["auto", "msgspec", "orjson", "json"],
+        default_value="auto",
+        help=dedent("""
+            How to decode responses from the Hub.
+
+            msgspec (fastest, skipping unused fields while decoding)
+            and orjson are optional dependencies,
+            e.g. via `pip install jupyterhub-idle-culler[fast]`.
+            auto uses the fastest one installed, or the standard library json module.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     max_age = Int(
         0,
         help=dedent("""
@@ -614,6 +1977,59 @@ class IdleCuller(Application):
         config=True,
     )
 
+    metrics_ip = Unicode(
+        "0.0.0.0",
+        help=dedent("""
+            The IP address to serve prometheus metrics on (only if --metrics-port is set).
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    metrics_port = Int(
+        0,
+        help=dedent("""
+            The port to serve prometheus metrics on, at /metrics.
+
+            Metrics include cull cycle duration, users and servers scanned and
+            culled, and the latency of requests to the Hub API.
+            Requires the prometheus_client package.
+            Default: 0, metrics are not served.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    parse_date_cache_size = Int(
+        PARSE_DATE_CACHE_SIZE,
+        help=dedent("""
+            Number of parsed timestamps to remember between cull cycles.
+
+            Timestamps such as a server's 'started' and a user's 'created'
+            don't change between cycles, so they don't need to be parsed again.
+            For the cache to be effective, this should be larger than the
+            number of timestamps seen in a cycle, about twice the number of
+            running servers plus twice the number of users checked.
+            Set to 0 to disable the cache.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    record_api = Unicode(
+        "",
+        help=dedent("""
+            Path to a file to record requests to the Hub API in,
+            with their responses and timings, as JSON lines.
+
+            Recordings can be replayed with --replay-api,
+            e.g. to reproduce and profile a slow cull cycle without the Hub.
+            The API token is not recorded, but responses include user models.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     remove_named_servers = Bool(
         False,
         help=dedent("""
@@ -625,6 +2041,170 @@ class IdleCuller(Application):
         config=True,
     )
 
+    replay_api = Unicode(
+        "",
+        help=dedent("""
+            Path to a recording made with --record-api, to replay instead of
+            culling.
+
+            Each recorded cull cycle is run once, against the recorded
+            responses instead of the Hub, as of the time it was recorded,
+            and how long it took (wall and CPU time) is logged.
+            Nothing is sent to the Hub, and no API token is needed.
+            To profile the culler, run it under a profiler, e.g.
+            `python -m cProfile -m jupyterhub_idle_culler --replay-api=...`.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    replay_latency_scale = Float(
+        1,
+        help=dedent("""
+            Scale for the latencies of responses replayed with --replay-api,
+            e.g. 0 to replay without waiting, 2 to simulate a Hub twice as slow.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    rolling_slices = Int(
+        10,
+        help=dedent("""
+            Number of slices to check the users in each --cull-every seconds,
+            with --cull-schedule=rolling.
+
+            With --cull-users, a pass over every user takes one more slice
+            (see --cull-schedule).
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    server_removals_per_cycle = Int(
+        0,
+        help=dedent("""
+            Maximum named server removals per cull cycle.
+            Named servers removed with --remove-named-servers beyond this are deferred to the next cycle.
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    server_removals_per_second = Float(
+        0,
+        help=dedent("""
+            Maximum named server removals per second, on average across cycles
+            (up to this many, or at least one, may happen at once).
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    server_stops_per_cycle = Int(
+        0,
+        help=dedent("""
+            Maximum server stops per cull cycle.
+            Servers stopped (but not removed) beyond this are deferred to the next cycle.
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    server_stops_per_second = Float(
+        0,
+        help=dedent("""
+            Maximum server stops per second, on average across cycles
+            (up to this many, or at least one, may happen at once).
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    shard_count = Int(
+        1,
+        help=dedent("""
+            Number of culler replicas sharing the work of culling.
+
+            Each replica lists all users, but only checks and culls the users
+            in its own shard (--shard-index),
+            picked from a stable hash of the user name.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    shard_index = Int(
+        0,
+        help=dedent("""
+            The shard of users this replica culls, from 0 to --shard-count - 1
+            (only with --shard-count).
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    shard_lock_dir = Unicode(
+        "",
+        help=dedent("""
+            Directory for shard lock files, for replicas running on the same host
+            (only with --shard-count).
+
+            If set, --shard-index is ignored: each replica takes the first shard
+            whose lock file no other replica holds,
+            and holds it until it exits.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    simulate = Unicode(
+        "",
+        help=dedent("""
+            Path to a snapshot of the Hub's users, to simulate a cull cycle
+            offline instead of culling.
+
+            The snapshot is the output of `GET /users`: a JSON list of user
+            models or a page of them, or JSON lines of either.
+            What would be culled is reported by rule (timeout, max age,
+            cull arbiter, admin exemption), along with how long deciding took.
+            Nothing is sent to the Hub, and no API token is needed.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    simulate_now = Unicode(
+        "",
+        help=dedent("""
+            The time to simulate a cull cycle at (with --simulate),
+            as an ISO 8601 timestamp, e.g. when the snapshot was taken.
+            Default: the current time.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    slow_stop_timeout = Int(
+        0,
+        help=dedent("""
+            How long (in seconds) to keep following up on servers that are slow
+            to stop.
+
+            When the Hub responds to stopping a server with 202 (still stopping),
+            the user is polled, with exponential backoff, until the server has
+            stopped or this timeout is reached. With --cull-users, the user is
+            then culled in the same cycle instead of the next one.
+            Default: 0, servers that are slow to stop are checked again next cycle.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     ssl_enabled = Bool(
         False,
         help=dedent("""
@@ -643,6 +2223,31 @@ class IdleCuller(Application):
         config=True,
     )
 
+    trace_file = Unicode(
+        "",
+        help=dedent("""
+            Path to a file to write traces of each cull cycle to,
+            as OpenTelemetry (OTLP/JSON) lines.
+
+            Spans time the cycle, each request to the Hub (including how long
+            it waited for --concurrency), handling each user, cull arbiters
+            and stopping each server, to see where a slow cycle spends its time.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    trace_otlp_endpoint = Unicode(
+        "",
+        help=dedent("""
+            OTLP/HTTP endpoint of an OpenTelemetry collector to send traces
+            of each cull cycle to, e.g. http://localhost:4318/v1/traces.
+            See --trace-file for the spans recorded.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     url = Unicode(
         os.environ.get("JUPYTERHUB_API_URL"),
         allow_none=True,
@@ -653,21 +2258,104 @@ class IdleCuller(Application):
         config=True,
     )
 
+    user_deletions_per_cycle = Int(
+        0,
+        help=dedent("""
+            Maximum user deletions per cull cycle.
+            Users deleted with --cull-users beyond this are deferred to the next cycle.
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    user_deletions_per_second = Float(
+        0,
+        help=dedent("""
+            Maximum user deletions per second, on average across cycles
+            (up to this many, or at least one, may happen at once).
+            Default: 0, no limit.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
+    workers = Int(
+        0,
+        help=dedent("""
+            Number of workers handling users while the user list is being fetched.
+
+            By default (0), the complete user list is fetched before any user is
+            handled, which keeps every user model in memory until the end of the
+            cycle. With workers, users are passed from the paginated user list
+            through a bounded queue to this many concurrent workers, so culling
+            starts with the first page and memory use doesn't grow with the
+            number of users. Concurrent requests to the Hub are still limited by
+            --concurrency.
+            """).strip(),
+    ).tag(
+        config=True,
+    )
+
     aliases = {
+        "adaptive-concurrency": "IdleCuller.adaptive_concurrency",
+        "api-page-concurrency": "IdleCuller.api_page_concurrency",
         "api-page-size": "IdleCuller.api_page_size",
+        "arbiter-executor": "IdleCuller.arbiter_executor",
+        "arbiter-executor-workers": "IdleCuller.arbiter_executor_workers",
+        "arbiter-timeout": "IdleCuller.arbiter_timeout",
+        "arbiter-timeout-cull": "IdleCuller.arbiter_timeout_cull",
+        "audit-log": "IdleCuller.audit_log",
+        "audit-log-backup-count": "IdleCuller.audit_log_backup_count",
+        "audit-log-max-bytes": "IdleCuller.audit_log_max_bytes",
         "concurrency": "IdleCuller.concurrency",
+        "concurrency-latency-target": "IdleCuller.concurrency_latency_target",
+        "concurrency-max": "IdleCuller.concurrency_max",
+        "concurrency-min": "IdleCuller.concurrency_min",
         "config": "IdleCuller.config_file",
         "cull-admin-users": "IdleCuller.cull_admin_users",
         "cull-default-servers": "IdleCuller.cull_default_servers",
         "cull-every": "IdleCuller.cull_every",
         "cull-named-servers": "IdleCuller.cull_named_servers",
+        "cull-priority": "IdleCuller.cull_priority",
+        "cull-schedule": "IdleCuller.cull_schedule",
         "cull-users": "IdleCuller.cull_users",
+        "cycle-overlap": "IdleCuller.cycle_overlap",
+        "cycle-state-file": "IdleCuller.cycle_state_file",
+        "cycle-stretch-factor": "IdleCuller.cycle_stretch_factor",
+        "cycle-time-budget": "IdleCuller.cycle_time_budget",
+        "full-scan-every": "IdleCuller.full_scan_every",
+        "compact-user-models": "IdleCuller.compact_user_models",
+        "http2": "IdleCuller.http2",
         "internal-certs-location": "IdleCuller.internal_certs_location",
+        "json-decoder": "IdleCuller.json_decoder",
         "max-age": "IdleCuller.max_age",
+        "metrics-ip": "IdleCuller.metrics_ip",
+        "metrics-port": "IdleCuller.metrics_port",
+        "parse-date-cache-size": "IdleCuller.parse_date_cache_size",
+        "record-api": "IdleCuller.record_api",
         "remove-named-servers": "IdleCuller.remove_named_servers",
+        "replay-api": "IdleCuller.replay_api",
+        "replay-latency-scale": "IdleCuller.replay_latency_scale",
+        "rolling-slices": "IdleCuller.rolling_slices",
+        "server-removals-per-cycle": "IdleCuller.server_removals_per_cycle",
+        "server-removals-per-second": "IdleCuller.server_removals_per_second",
+        "server-stops-per-cycle": "IdleCuller.server_stops_per_cycle",
+        "server-stops-per-second": "IdleCuller.server_stops_per_second",
+        "shard-count": "IdleCuller.shard_count",
+        "shard-index": "IdleCuller.shard_index",
+        "shard-lock-dir": "IdleCuller.shard_lock_dir",
+        "simulate": "IdleCuller.simulate",
+        "simulate-now": "IdleCuller.simulate_now",
+        "slow-stop-timeout": "IdleCuller.slow_stop_timeout",
         "ssl-enabled": "IdleCuller.ssl_enabled",
         "timeout": "IdleCuller.timeout",
+        "trace-file": "IdleCuller.trace_file",
+        "trace-otlp-endpoint": "IdleCuller.trace_otlp_endpoint",
         "url": "IdleCuller.url",
+        "user-deletions-per-cycle": "IdleCuller.user_deletions_per_cycle",
+        "user-deletions-per-second": "IdleCuller.user_deletions_per_second",
+        "workers": "IdleCuller.workers",
     }
 
     flags = {
@@ -677,6 +2365,105 @@ class IdleCuller(Application):
         )
     }
 
+    def _make_deadline_cull(self, cull_idle):
+        """Wrap cull_idle to only recheck users whose deadlines have passed
+
+        A full scan of all users runs every full_scan_every seconds,
+        recording when each user could next need culling.
+        Other ticks only fetch and check the users that are due.
+        """
+        scheduler = DeadlineScheduler()
+        last_full_scan = None
+
+        async def cull():
+            nonlocal last_full_scan
+            now = utcnow()
+            if (
+                last_full_scan is None
+                or (now - last_full_scan).total_seconds() >= self.full_scan_every
+            ):
+                scheduler.clear()
+                await cull_idle(scheduler=scheduler)
+                last_full_scan = now
+                self.log.info(f"{len(scheduler)} users scheduled for a recheck")
+                return
+
+            due = scheduler.pop_due(now)
+            if not due:
+                self.log.debug("No users due for a recheck")
+                return
+            self.log.info(f"Rechecking {len(due)} users")
+            try:
+                await cull_idle(scheduler=scheduler, user_names=due)
+            except Exception:
+                # try again next time
+                for name in due:
+                    scheduler.schedule(name, now)
+                raise
+
+        return cull
+
+    def _make_cull_policy(self):
+        """Compile cull_policy, None if there is none"""
+        if not self.cull_policy:
+            return None
+        try:
+            return CullPolicy(
+                self.cull_policy, timeout=self.timeout, max_age=self.max_age
+            )
+        except ValueError as e:
+            self.log.critical(f"Invalid cull policy: {e}")
+            self.exit(1)
+
+    async def _simulate(self):
+        """Report what a cull cycle would do to the users in a snapshot"""
+        # imported here, since simulate uses this module
+        from .simulate import load_snapshot, simulate
+
+        if self.simulate_now:
+            now = parse_date(self.simulate_now)
+        else:
+            now = utcnow()
+        users = load_snapshot(self.simulate)
+        self.log.info(f"Simulating a cull cycle over {len(users)} users at {now}")
+        report = await simulate(
+            users,
+            now,
+            inactive_limit=self.timeout,
+            max_age=self.max_age,
+            cull_users=self.cull_users,
+            cull_admin_users=self.cull_admin_users,
+            cull_default_servers=self.cull_default_servers,
+            cull_named_servers=self.cull_named_servers,
+            cull_arbiter=self.cull_arbiter_hook,
+            cull_arbiter_batch=self.cull_arbiter_batch_hook,
+            policy=self._make_cull_policy(),
+            logger=self.log,
+        )
+        print(json.dumps(report, indent=2))
+
+    async def _replay(self, cull_cycle):
+        """Replay the cull cycles recorded in replay_api, timing each one"""
+        replay = ApiReplay(self.replay_api, latency_scale=self.replay_latency_scale)
+        url = replay.url or self.url
+        self.log.info(f"Replaying {len(replay)} cull cycles from {self.replay_api}")
+        for index in range(len(replay)):
+            client = replay.client(index)
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            await cull_cycle(client=client, url=url, now=replay.now(index))
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            self.log.info(
+                f"Replayed cull cycle {index + 1}/{len(replay)} in {wall:.3f}s"
+                f" ({cpu:.3f}s CPU), {sum(client.requests.values())} requests"
+            )
+            if client.unmatched:
+                self.log.warning(
+                    f"{client.unmatched} requests were not in the recording,"
+                    " the replayed cycle differs from the recorded one"
+                )
+
     def start(self):
 
         if self.generate_config:
@@ -686,20 +2473,172 @@ class IdleCuller(Application):
         if self.config_file:
             self.load_config_file(self.config_file)
 
-        api_token = os.environ["JUPYTERHUB_API_TOKEN"]
+        if self.simulate:
+            asyncio.run(self._simulate())
+            return
+
+        if self.replay_api:
+            # not talking to the Hub
+            api_token = os.environ.get("JUPYTERHUB_API_TOKEN", "")
+        else:
+            api_token = os.environ["JUPYTERHUB_API_TOKEN"]
 
         cull_arbiter = self.cull_arbiter_hook
 
+        policy = self._make_cull_policy()
+
+        if self.parse_date_cache_size != PARSE_DATE_CACHE_SIZE:
+            set_parse_date_cache_size(self.parse_date_cache_size)
+
+        shard_index = self.shard_index
+        if self.shard_count > 1 and self.shard_lock_dir:
+            try:
+                shard_index, self._shard_lock = acquire_shard_lock(
+                    self.shard_lock_dir, self.shard_count
+                )
+            except RuntimeError as e:
+                self.log.critical(f"Could not pick a shard: {e}")
+                self.exit(1)
+        if self.shard_count > 1:
+            if not 0 <= shard_index < self.shard_count:
+                self.log.critical(
+                    f"--shard-index={shard_index} must be less than"
+                    f" --shard-count={self.shard_count}"
+                )
+                self.exit(1)
+            self.log.info(f"Culling shard {shard_index} of {self.shard_count}")
+
+        if self.metrics_port:
+            try:
+                metrics_app = metrics.make_metrics_app()
+            except ImportError as e:
+                self.log.critical(f"Could not serve metrics: {e}")
+                self.exit(1)
+            metrics_app.listen(self.metrics_port, address=self.metrics_ip)
+            self.log.info(
+                f"Serving metrics on http://{self.metrics_ip}:{self.metrics_port}/metrics"
+            )
+
+        if self.adaptive_concurrency:
+            limiter = AdaptiveLimiter(
+                self.concurrency,
+                min_limit=self.concurrency_min,
+                max_limit=self.concurrency_max,
+                latency_target=self.concurrency_latency_target,
+                log=self.log,
+            )
+        else:
+            limiter = None
+
+        if self.ssl_enabled:
+            self.log.debug("ssl_enabled is Enabled: %s", self.ssl_enabled)
+            self.log.debug(
+                "internal_certs_location is %s", self.internal_certs_location
+            )
+        # one client for all cycles, to keep connections to the Hub alive,
+        # with room for as many requests as we may make at once
+        if limiter is not None:
+            max_clients = self.concurrency_max
+        else:
+            max_clients = self.concurrency
+        http_clients = HTTPClientCache(
+            max_clients=max(max_clients, 10),
+            ssl_enabled=self.ssl_enabled,
+            internal_certs_location=self.internal_certs_location,
+            http2=self.http2,
+            log=self.log,
+        )
         try:
-            AsyncHTTPClient.configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
+            http_clients.get()
         except ImportError as e:
-            self.log.warning(
-                f"Could not load pycurl: {e}\n"
-                "pycurl is recommended if you have a large number of users."
+            self.log.critical(f"Could not use HTTP/2: {e}")
+            self.exit(1)
+        except OSError as e:
+            # e.g. internal SSL certificates missing or being rotated,
+            # the client is created again for each cycle until they load
+            self.log.warning(f"Could not load internal SSL certificates: {e}")
+
+        if self.cull_arbiter_hook is not default_cull_arbiter or (
+            self.cull_arbiter_batch_hook is not None
+        ):
+            # custom arbiters commonly look at these
+            extra_server_fields = ("state", "user_options")
+        elif policy is not None and policy.uses_profiles:
+            extra_server_fields = ("state", "user_options")
+        else:
+            extra_server_fields = ()
+        if policy is not None and policy.uses_groups:
+            extra_user_fields = ("groups",)
+        else:
+            extra_user_fields = ()
+        try:
+            decoder = UserDecoder(
+                backend=None if self.json_decoder == "auto" else self.json_decoder,
+                compact=self.compact_user_models,
+                extra_user_fields=extra_user_fields,
+                extra_server_fields=extra_server_fields,
+            )
+        except ImportError as e:
+            self.log.critical(f"Could not use the {self.json_decoder} decoder: {e}")
+            self.exit(1)
+        self.log.debug(f"Decoding responses with {decoder.backend}")
+
+        if self.arbiter_executor == "thread":
+            arbiter_executor = ThreadPoolExecutor(
+                self.arbiter_executor_workers or None,
+                thread_name_prefix="cull-arbiter",
+            )
+        elif self.arbiter_executor == "process":
+            arbiter_executor = ProcessPoolExecutor(
+                self.arbiter_executor_workers or None
+            )
+        else:
+            arbiter_executor = None
+        # shut down with the rest in the teardown below
+        self._arbiter_executor = arbiter_executor
+
+        # token buckets are shared by all cycles
+        rate_limits = {}
+        cycle_budgets = {}
+        for kind, prefix in [
+            ("stop", "server_stops"),
+            ("remove", "server_removals"),
+            ("delete", "user_deletions"),
+        ]:
+            rate = getattr(self, f"{prefix}_per_second")
+            if rate:
+                rate_limits[kind] = TokenBucket(rate)
+            budget = getattr(self, f"{prefix}_per_cycle")
+            if budget:
+                cycle_budgets[kind] = budget
+
+        if self.trace_otlp_endpoint:
+            trace_exporter = OtlpHttpExporter(self.trace_otlp_endpoint)
+        elif self.trace_file:
+            trace_exporter = JsonLinesExporter(self.trace_file)
+        else:
+            trace_exporter = None
+        tracer = Tracer(trace_exporter, log=self.log)
+
+        if self.audit_log:
+            audit = AuditLog(
+                self.audit_log,
+                max_bytes=self.audit_log_max_bytes,
+                backup_count=self.audit_log_backup_count,
+                log=self.log,
             )
+            audit.start()
+        else:
+            audit = None
+
+        if self.cycle_time_budget:
+            # where the last cycle out of time stopped, shared by all cycles
+            resume = ResumePoint(self.cycle_state_file or None, log=self.log)
+        else:
+            resume = None
 
         loop = IOLoop.current()
-        cull = partial(
+        cull_cycle = partial(
             cull_idle,
             url=self.url,
             api_token=api_token,
@@ -713,20 +2652,89 @@ class IdleCuller(Application):
             internal_certs_location=self.internal_certs_location,
             cull_admin_users=self.cull_admin_users,
             api_page_size=self.api_page_size,
+            api_page_concurrency=self.api_page_concurrency,
+            slow_stop_timeout=self.slow_stop_timeout,
             cull_default_servers=self.cull_default_servers,
             cull_named_servers=self.cull_named_servers,
             cull_arbiter=cull_arbiter,
+            cull_arbiter_batch=self.cull_arbiter_batch_hook,
+            arbiter_executor=arbiter_executor,
+            arbiter_timeout=self.arbiter_timeout,
+            arbiter_timeout_cull=self.arbiter_timeout_cull,
+            workers=self.workers,
+            limiter=limiter,
+            decoder=decoder,
+            shard_count=self.shard_count,
+            shard_index=shard_index,
+            rate_limits=rate_limits,
+            cycle_budgets=cycle_budgets,
+            cull_priority_by=self.cull_priority,
+            tracer=tracer,
+            audit=audit,
+            policy=policy,
+            time_budget=self.cycle_time_budget,
+            resume=resume,
+        )
+
+        if self.replay_api:
+            try:
+                loop.run_sync(partial(self._replay, cull_cycle))
+            finally:
+                http_clients.close()
+                if arbiter_executor is not None:
+                    arbiter_executor.shutdown(wait=False)
+            return
+
+        if self.record_api:
+            recorder = ApiRecorder(self.record_api)
+            self.log.info(f"Recording requests to the Hub in {self.record_api}")
+        else:
+            recorder = None
+
+        async def cull(**kwargs):
+            # the client is recreated if internal SSL certificates have changed
+            client = http_clients.get()
+            if recorder is not None:
+                client = recorder.wrap(client)
+            try:
+                return await cull_cycle(client=client, **kwargs)
+            finally:
+                await tracer.export()
+
+        interval = self.cull_every
+        if self.cull_schedule == "deadline":
+            cull = self._make_deadline_cull(cull)
+        elif self.cull_schedule == "rolling":
+            if self.rolling_slices < 1:
+                self.log.critical(
+                    f"--rolling-slices={self.rolling_slices} must be at least 1"
+                )
+                self.exit(1)
+            cull = partial(
+                cull, cursor=RollingCursor(self.rolling_slices, log=self.log)
+            )
+            interval = self.cull_every / self.rolling_slices
+        runner = CycleRunner(
+            cull,
+            interval,
+            overlap=self.cycle_overlap,
+            stretch_factor=self.cycle_stretch_factor,
+            log=self.log,
         )
-        # schedule first cull immediately
-        # because PeriodicCallback doesn't start until the end of the first interval
-        loop.add_callback(cull)
-        # schedule periodic cull
-        pc = PeriodicCallback(cull, 1e3 * self.cull_every)
-        pc.start()
+        runner.start()
         try:
             loop.start()
         except KeyboardInterrupt:
             pass
+        finally:
+            http_clients.close()
+            tracer.close()
+            if recorder is not None:
+                recorder.close()
+            if audit is not None:
+                audit.close()
+            if arbiter_executor is not None:
+                arbiter_executor.shutdown(wait=False)
 
 
 def main():
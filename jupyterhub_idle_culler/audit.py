@@ -0,0 +1,180 @@
+"""Structured audit log of culling decisions and actions
+
+AuditLog writes one JSON record per line for each decision about a server
+or user, and each request to stop or delete one.
+Records are buffered in memory and written by a background thread,
+when enough have accumulated or after flush_interval seconds,
+so that recording tens of thousands of decisions per cycle
+doesn't block the event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from tornado.ioloop import PeriodicCallback
+
+
+def _seconds(td):
+    """A timedelta as seconds, for JSON"""
+    if td is None:
+        return None
+    return round(td.total_seconds(), 3)
+
+
+class AuditLog:
+    """Buffered JSON lines audit log, with size-based rotation
+
+    Each record has the time, user, server (None for records about users),
+    action, and what's known of rule, inactive and age (in seconds)
+    and the HTTP status of the request to the Hub.
+
+    Actions are:
+
+    - 'cull' or 'keep': a decision about a server or user,
+      with the rule deciding to cull ('inactive' or 'age')
+    - 'skip': a server that can't be culled now (pending or not ready)
+    - 'stop', 'remove' or 'delete': a request to stop a server,
+      remove a named server or delete a user, with its status
+    - 'defer': a cull deferred to the next cycle by a budget
+
+    When the file would grow over max_bytes (if non-zero), it's rotated
+    like logging's RotatingFileHandler: to path.1, path.1 to path.2, etc.,
+    keeping backup_count old files.
+    """
+
+    def __init__(
+        self,
+        path,
+        *,
+        max_bytes=0,
+        backup_count=5,
+        buffer_size=1000,
+        flush_interval=1,
+        log=None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.log = log or logging.getLogger(__name__)
+        self._buffer = []
+        self._file = open(path, "a", encoding="utf8")
+        self._size = self._file.tell()
+        # writes happen one at a time, in order, in this thread
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="audit-log")
+        self._pending_flush = None
+        self._periodic = None
+
+    def start(self):
+        """Start flushing every flush_interval seconds"""
+        self._periodic = PeriodicCallback(self.flush, 1e3 * self.flush_interval)
+        self._periodic.start()
+
+    def record(
+        self,
+        action,
+        user,
+        server=None,
+        *,
+        rule=None,
+        inactive=None,
+        age=None,
+        status=None,
+    ):
+        """Record a decision or action
+
+        inactive and age are timedeltas.
+        Cheap: the record is only serialized and written when flushed.
+        """
+        self._buffer.append(
+            (
+                datetime.now(timezone.utc),
+                action,
+                user,
+                server,
+                rule,
+                inactive,
+                age,
+                status,
+            )
+        )
+        if len(self._buffer) >= self.buffer_size and (
+            self._pending_flush is None or self._pending_flush.done()
+        ):
+            self._pending_flush = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Write the buffered records, in a thread"""
+        if not self._buffer:
+            return
+        records, self._buffer = self._buffer, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write, records
+            )
+        except Exception as e:
+            self.log.error(f"Failed to write {len(records)} audit records: {e}")
+
+    def _write(self, records):
+        lines = []
+        for time, action, user, server, rule, inactive, age, status in records:
+            lines.append(
+                json.dumps(
+                    {
+                        "time": time.isoformat(),
+                        "user": user,
+                        "server": server,
+                        "action": action,
+                        "rule": rule,
+                        "inactive": _seconds(inactive),
+                        "age": _seconds(age),
+                        "status": status,
+                    }
+                )
+            )
+        text = "\n".join(lines) + "\n"
+        size = len(text.encode("utf8"))
+        if self.max_bytes and self._size and self._size + size > self.max_bytes:
+            self._rotate()
+        self._file.write(text)
+        self._file.flush()
+        self._size += size
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf8")
+        self._size = 0
+
+    def close(self):
+        """Write what's left, and close the file
+
+        Waits for writes in progress, so that nothing is written after
+        the file is closed.
+        """
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+        records, self._buffer = self._buffer, []
+        last_write = None
+        if records:
+            last_write = self._executor.submit(self._write, records)
+        self._executor.shutdown(wait=True)
+        if last_write is not None:
+            try:
+                last_write.result()
+            except Exception as e:
+                self.log.error(f"Failed to write {len(records)} audit records: {e}")
+        self._file.close()
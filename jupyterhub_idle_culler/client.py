@@ -0,0 +1,190 @@
+"""HTTP client for requests to the Hub API
+
+The client is meant to be created once and reused by every cull cycle,
+so that connections to the Hub are kept alive between requests and cycles
+instead of paying for a new TCP (and TLS) handshake for every request.
+HTTPClientCache keeps such a client, recreating it when internal SSL
+certificates are rotated.
+"""
+
+import logging
+import os
+import ssl
+
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+try:
+    import pycurl
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError as e:
+    pycurl = None
+    _curl_import_error = e
+
+
+def make_ssl_context(keyfile, certfile, cafile=None, verify=True, check_hostname=True):
+    """Setup context for starting an https server or making requests over ssl."""
+    if not keyfile or not certfile:
+        return None
+    purpose = ssl.Purpose.SERVER_AUTH if verify else ssl.Purpose.CLIENT_AUTH
+    ssl_context = ssl.create_default_context(purpose, cafile=cafile)
+    ssl_context.load_default_certs(purpose)
+    ssl_context.load_cert_chain(certfile, keyfile)
+    ssl_context.check_hostname = check_hostname
+    return ssl_context
+
+
+def internal_cert_files(internal_certs_location):
+    """Return the key, certificate and CA files for internal SSL"""
+    return (
+        f"{internal_certs_location}/hub-internal/hub-internal.key",
+        f"{internal_certs_location}/hub-internal/hub-internal.crt",
+        f"{internal_certs_location}/hub-ca/hub-ca.crt",
+    )
+
+
+def _make_prepare_curl(http2=False):
+    """Return a prepare_curl_callback for requests to the Hub
+
+    Curl handles share a cache of TLS sessions (and DNS lookups),
+    so that new connections to the Hub can resume a previous TLS session
+    instead of doing a full handshake.
+    """
+    share = pycurl.CurlShare()
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+
+    def prepare_curl(curl):
+        # curl handles are reused for many requests, but can only be shared once
+        if not getattr(curl, "hub_share", None):
+            curl.setopt(pycurl.SHARE, share)
+            curl.hub_share = share
+        if http2:
+            # HTTP/2 for https, HTTP/1.1 for plain http
+            curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2TLS)
+
+    return prepare_curl
+
+
+def make_http_client(
+    max_clients=10,
+    request_timeout=None,
+    ssl_enabled=False,
+    internal_certs_location="",
+    curl=None,
+    http2=False,
+    log=None,
+):
+    """Return a new AsyncHTTPClient for requests to the Hub
+
+    max_clients is the number of requests that may be in flight at once,
+    which should be at least the concurrency limit.
+
+    request_timeout defaults to $JUPYTERHUB_REQUEST_TIMEOUT, or 60 seconds.
+
+    If curl, pycurl is required. If None, it's used if it is installed.
+    The curl client keeps connections to the Hub alive between requests
+    and resumes TLS sessions;
+    tornado's simple client opens a new connection for each request.
+
+    If http2, requests over https negotiate HTTP/2 (requires pycurl,
+    with a libcurl built with HTTP/2 support).
+
+    The caller owns the client, and should close it when done.
+    """
+    log = log or logging.getLogger(__name__)
+    if http2:
+        curl = True
+    if pycurl is None:
+        if curl:
+            raise ImportError(f"pycurl is required: {_curl_import_error}")
+        if curl is None:
+            log.warning(
+                f"Could not load pycurl: {_curl_import_error}\n"
+                "pycurl is recommended if you have a large number of users."
+            )
+            if max_clients > 10:
+                # more than the default concurrency
+                log.warning(
+                    f"Without pycurl, up to {max_clients} concurrent requests"
+                    " each open a new connection to the Hub."
+                    " Install pycurl to keep connections alive and reuse them."
+                )
+        curl = False
+    elif curl is None:
+        curl = True
+
+    if request_timeout is None:
+        # GET /users may be slow if there are thousands of users and we
+        # don't do any server side filtering so default request timeouts
+        # to 60 seconds rather than tornado's 20 second default.
+        request_timeout = int(os.environ.get("JUPYTERHUB_REQUEST_TIMEOUT") or 60)
+    defaults = {"request_timeout": request_timeout}
+
+    if ssl_enabled:
+        keyfile, certfile, cafile = internal_cert_files(internal_certs_location)
+        if curl:
+            # the curl client doesn't support ssl_options
+            defaults.update(client_key=keyfile, client_cert=certfile, ca_certs=cafile)
+        else:
+            defaults["ssl_options"] = make_ssl_context(keyfile, certfile, cafile)
+
+    if http2 and not pycurl.version_info()[4] & pycurl.VERSION_HTTP2:
+        raise ImportError("libcurl is not built with HTTP/2 support")
+    if curl:
+        defaults["prepare_curl_callback"] = _make_prepare_curl(http2)
+        client_class = CurlAsyncHTTPClient
+    else:
+        client_class = SimpleAsyncHTTPClient
+    log.debug(f"Using {client_class.__name__} with max_clients={max_clients}")
+    return client_class(force_instance=True, max_clients=max_clients, defaults=defaults)
+
+
+class HTTPClientCache:
+    """Keep an HTTP client for requests to the Hub across cull cycles
+
+    With internal SSL, the key, certificate and CA files are only read
+    when the client is created.
+    The client is recreated when any of their modification times change,
+    e.g. when certificates are rotated.
+
+    client_kwargs are passed to make_http_client.
+    """
+
+    def __init__(self, log=None, **client_kwargs):
+        self.log = log or logging.getLogger(__name__)
+        self.client_kwargs = client_kwargs
+        self.client_kwargs["log"] = self.log
+        if client_kwargs.get("ssl_enabled"):
+            self.cert_files = internal_cert_files(
+                client_kwargs.get("internal_certs_location", "")
+            )
+        else:
+            self.cert_files = ()
+        self._client = None
+        self._cert_mtimes = None
+
+    def _get_cert_mtimes(self):
+        mtimes = []
+        for path in self.cert_files:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return mtimes
+
+    def get(self):
+        """Return the client, recreating it if certificates have changed"""
+        cert_mtimes = self._get_cert_mtimes()
+        if self._client is not None and cert_mtimes != self._cert_mtimes:
+            self.log.info("Internal SSL certificates have changed, reloading")
+            self.close()
+        if self._client is None:
+            self._client = make_http_client(**self.client_kwargs)
+            self._cert_mtimes = cert_mtimes
+        return self._client
+
+    def close(self):
+        """Close the client, if any"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,101 @@
+"""Adaptive limit on concurrent requests to the Hub"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from . import metrics
+
+
+class AdaptiveLimiter:
+    """Limit concurrent requests, adapting the limit to how the Hub copes
+
+    Additive increase, multiplicative decrease (AIMD):
+
+    - every response that is neither an error nor slower than latency_target
+      raises the limit by 1/limit, i.e. by about one per round of requests
+      at full concurrency.
+    - an error (5xx, 429, timeout) or a response slower than latency_target
+      multiplies the limit by decrease_factor.
+      Only requests started after the last decrease can decrease it again,
+      so a burst of failures from requests in flight at the same time
+      only counts once.
+
+    The limit always stays between min_limit and max_limit.
+    Used like a semaphore: `await acquire()` before a request,
+    `release(...)` with its outcome after.
+    """
+
+    def __init__(
+        self,
+        initial,
+        min_limit=1,
+        max_limit=100,
+        latency_target=0,
+        decrease_factor=0.5,
+        log=None,
+    ):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.log = log or logging.getLogger(__name__)
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._last_decrease = float("-inf")
+        self._waiters = deque()
+        self.in_flight = 0
+        metrics.CONCURRENCY_LIMIT.set(self.limit)
+
+    @property
+    def limit(self):
+        """The current limit on concurrent requests"""
+        return int(self._limit)
+
+    def _set_limit(self, value):
+        old_limit = self.limit
+        self._limit = min(max(value, self.min_limit), self.max_limit)
+        if self.limit != old_limit:
+            self.log.debug(f"Concurrency limit {old_limit} -> {self.limit}")
+            metrics.CONCURRENCY_LIMIT.set(self.limit)
+            self._wake()
+
+    def _wake(self):
+        """Wake waiters for which there is room under the limit"""
+        room = self.limit - self.in_flight
+        while room > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                room -= 1
+
+    async def acquire(self):
+        """Wait until a request may be made"""
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # pass on a wakeup we may have received
+                self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self, start, latency, overloaded=False):
+        """Record the outcome of a request and release its slot
+
+        start: time.perf_counter() when the request was sent
+        latency: how long it took, in seconds
+        overloaded: whether the response indicates the Hub is overloaded
+        """
+        self.in_flight -= 1
+        if self.latency_target and latency > self.latency_target:
+            overloaded = True
+        if overloaded:
+            if start >= self._last_decrease:
+                self._last_decrease = time.perf_counter()
+                self._set_limit(self._limit * self.decrease_factor)
+        else:
+            self._set_limit(self._limit + 1 / self._limit)
+        self._wake()
@@ -0,0 +1,91 @@
+"""Run cull cycles periodically, one at a time"""
+
+import logging
+import time
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from . import metrics
+
+
+class CycleRunner:
+    """Run a cull cycle every interval seconds, never two at the same time
+
+    If a cycle is still running when the next one is due,
+    the next one is either skipped (overlap="skip"),
+    or run right after the current one finishes (overlap="coalesce"),
+    with any further ticks meanwhile coalesced into that one run.
+
+    If stretch_factor is non-zero, the interval grows to stretch_factor
+    times the duration of the last cycle, if that's longer than interval,
+    so that slow cycles on large hubs leave the Hub some breathing room.
+    """
+
+    def __init__(self, cull, interval, overlap="skip", stretch_factor=0, log=None):
+        self.cull = cull
+        self.interval = interval
+        self.overlap = overlap
+        self.stretch_factor = stretch_factor
+        self.log = log or logging.getLogger(__name__)
+        self.running = False
+        self._pending = False
+        self._periodic = None
+
+    def start(self):
+        """Start running cycles, the first one right away"""
+        # schedule first cull immediately
+        # because PeriodicCallback doesn't start until the end of the first interval
+        IOLoop.current().add_callback(self.run)
+        self._periodic = PeriodicCallback(self.run, 1e3 * self.interval)
+        self._periodic.start()
+
+    def stop(self):
+        """Stop scheduling cycles"""
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+
+    async def run(self):
+        """Run a cycle, unless one is already running"""
+        if self.running:
+            metrics.CYCLES_SKIPPED.inc()
+            if self.overlap == "coalesce":
+                if not self._pending:
+                    self.log.warning(
+                        "Previous cull cycle still running,"
+                        " starting the next one when it is done"
+                    )
+                self._pending = True
+            else:
+                self.log.warning("Previous cull cycle still running, skipping")
+            return
+
+        self.running = True
+        try:
+            while True:
+                self._pending = False
+                await self._run_once()
+                if not self._pending:
+                    break
+        finally:
+            self.running = False
+
+    async def _run_once(self):
+        start = time.perf_counter()
+        try:
+            await self.cull()
+        except Exception:
+            self.log.exception("Error in cull cycle")
+        duration = time.perf_counter() - start
+
+        if duration > self.interval:
+            metrics.CYCLE_OVERRUNS.inc()
+            self.log.warning(
+                f"Cull cycle took {duration:.1f}s, longer than the {self.interval}s interval"
+            )
+
+        if self.stretch_factor and self._periodic is not None:
+            next_interval = max(self.interval, self.stretch_factor * duration)
+            if abs(next_interval * 1e3 - self._periodic.callback_time) >= 1e3:
+                self.log.info(f"Next cull cycle in {next_interval:.0f}s")
+                self._periodic.callback_time = next_interval * 1e3
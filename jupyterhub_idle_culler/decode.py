@@ -0,0 +1,161 @@
+"""Decoding JSON responses from the Hub API
+
+User models include much more than the culler needs
+(groups, roles, server state, ...).
+UserDecoder keeps only the fields the culler reads,
+so that large user lists take less time and memory to decode,
+and fewer objects are kept alive while users are handled.
+
+msgspec and orjson are optional dependencies:
+with msgspec, unused fields are skipped while decoding;
+with orjson, responses are decoded faster and then trimmed.
+Without either, the standard library json module is used.
+"""
+
+import json
+from typing import Any, Dict, List, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# fields of user models read by the culler.
+# 'server' and 'pending' are only for jupyterhub < 0.9
+USER_FIELDS = (
+    "name",
+    "admin",
+    "created",
+    "last_activity",
+    "server",
+    "pending",
+    "servers",
+)
+
+# fields of server models read by the culler
+SERVER_FIELDS = (
+    "name",
+    "pending",
+    "ready",
+    "url",
+    "started",
+    "last_activity",
+    "stopped",
+)
+
+BACKENDS = ("msgspec", "orjson", "json")
+
+
+def available_backend():
+    """Return the fastest available decoder backend"""
+    if msgspec is not None:
+        return "msgspec"
+    if orjson is not None:
+        return "orjson"
+    return "json"
+
+
+class UserDecoder:
+    """Decode user models, and lists and pages of them
+
+    backend is one of BACKENDS, or None for the fastest available.
+    If compact, only USER_FIELDS and SERVER_FIELDS are kept,
+    plus the user fields in extra_user_fields (e.g. 'groups', for cull policies)
+    and the server fields in extra_server_fields
+    (e.g. 'state', for custom cull arbiters).
+    """
+
+    def __init__(
+        self, backend=None, compact=True, extra_user_fields=(), extra_server_fields=()
+    ):
+        if backend is None:
+            backend = available_backend()
+        if backend == "msgspec" and msgspec is None:
+            raise ImportError("msgspec is required for the msgspec decoder")
+        if backend == "orjson" and orjson is None:
+            raise ImportError("orjson is required for the orjson decoder")
+        self.backend = backend
+        self.compact = compact
+        self.user_fields = USER_FIELDS + tuple(
+            field for field in extra_user_fields if field not in USER_FIELDS
+        )
+        self.server_fields = SERVER_FIELDS + tuple(
+            field for field in extra_server_fields if field not in SERVER_FIELDS
+        )
+
+        if backend == "msgspec":
+            # not at the top: typing.TypedDict is new in Python 3.8,
+            # which msgspec requires anyway
+            from typing import TypedDict
+
+            if compact:
+                # decoding into TypedDicts skips all other fields
+                server_type = TypedDict(
+                    "Server", {field: Any for field in self.server_fields}, total=False
+                )
+                user_fields = {field: Any for field in self.user_fields}
+                user_fields["servers"] = Dict[str, server_type]
+                user_type = TypedDict("User", user_fields, total=False)
+            else:
+                user_type = Dict[str, Any]
+            page_type = TypedDict(
+                "Page", {"items": List[user_type], "_pagination": Any}, total=False
+            )
+            self._decode_user = msgspec.json.Decoder(user_type).decode
+            # pre-2.0 user lists aren't paginated
+            self._decode_users = msgspec.json.Decoder(
+                Union[List[user_type], page_type]
+            ).decode
+
+    def loads(self, body):
+        """Decode any JSON response body (bytes)"""
+        if self.backend == "msgspec":
+            return msgspec.json.decode(body)
+        if self.backend == "orjson":
+            return orjson.loads(body)
+        return json.loads(body.decode("utf8", "replace"))
+
+    def _project_user(self, user):
+        """Return a user model with only the fields the culler needs"""
+        compact_user = {
+            field: user[field] for field in self.user_fields if field in user
+        }
+        if compact_user.get("servers"):
+            compact_user["servers"] = {
+                server_name: {
+                    field: server[field]
+                    for field in self.server_fields
+                    if field in server
+                }
+                for server_name, server in compact_user["servers"].items()
+            }
+        return compact_user
+
+    def decode_user(self, body):
+        """Decode a single user model"""
+        if self.backend == "msgspec":
+            return self._decode_user(body)
+        user = self.loads(body)
+        if self.compact:
+            user = self._project_user(user)
+        return user
+
+    def decode_users(self, body):
+        """Decode a list of user models, or a page of them
+
+        A page is a dict with 'items' and '_pagination' (jupyterhub >= 2.0)
+        """
+        if self.backend == "msgspec":
+            return self._decode_users(body)
+        model = self.loads(body)
+        if self.compact:
+            if isinstance(model, list):
+                model = [self._project_user(user) for user in model]
+            else:
+                model["items"] = [self._project_user(user) for user in model["items"]]
+        return model
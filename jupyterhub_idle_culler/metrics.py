@@ -0,0 +1,168 @@
+"""
+Prometheus metrics exported by the idle culler
+
+Metric names follow https://prometheus.io/docs/practices/naming/
+and are prefixed with `jupyterhub_idle_culler_`.
+
+prometheus_client is an optional dependency.
+If it isn't installed, the metrics below are no-ops
+and the metrics endpoint can't be enabled.
+"""
+
+from tornado import web
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram
+except ImportError:
+    prometheus_client = None
+
+    class _NullMetric:
+        """Stand-in for prometheus metrics, doing nothing"""
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def labels(self, *args, **kwargs):
+            return self
+
+        def inc(self, amount=1):
+            pass
+
+        def dec(self, amount=1):
+            pass
+
+        def set(self, value):
+            pass
+
+        def observe(self, amount):
+            pass
+
+    Counter = Gauge = Histogram = _NullMetric
+
+
+metrics_prefix = "jupyterhub_idle_culler"
+
+# cycles can take from well under a second to many minutes on large hubs
+cycle_duration_buckets = [0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+CYCLE_DURATION_SECONDS = Histogram(
+    "cycle_duration_seconds",
+    "Time taken for a complete cull cycle",
+    buckets=cycle_duration_buckets,
+    namespace=metrics_prefix,
+)
+
+CYCLE_ERRORS = Gauge(
+    "cycle_errors",
+    "Number of errors in the last completed cull cycle",
+    namespace=metrics_prefix,
+)
+
+LAST_CYCLE_TIMESTAMP_SECONDS = Gauge(
+    "last_cycle_timestamp_seconds",
+    "Time when the last cull cycle completed, as a unix timestamp",
+    namespace=metrics_prefix,
+)
+
+CYCLES_SKIPPED = Counter(
+    "cycles_skipped",
+    "Cull cycles skipped or delayed because the previous one was still running",
+    namespace=metrics_prefix,
+)
+
+CYCLE_OVERRUNS = Counter(
+    "cycle_overruns",
+    "Cull cycles that took longer than the interval between cycles",
+    namespace=metrics_prefix,
+)
+
+ERRORS = Counter(
+    "errors",
+    "Errors handling users during cull cycles",
+    namespace=metrics_prefix,
+)
+
+USERS_SCANNED = Counter(
+    "users_scanned",
+    "Users checked for culling",
+    namespace=metrics_prefix,
+)
+
+SERVERS_SCANNED = Counter(
+    "servers_scanned",
+    "Servers checked for culling",
+    namespace=metrics_prefix,
+)
+
+SERVERS_CULLED = Counter(
+    "servers_culled",
+    "Servers stopped by the culler",
+    ["server_type"],
+    namespace=metrics_prefix,
+)
+
+SERVERS_SLOW_TO_STOP = Counter(
+    "servers_slow_to_stop",
+    "Servers whose stop request returned 202, meaning they are still stopping",
+    namespace=metrics_prefix,
+)
+
+CULLS_DEFERRED = Counter(
+    "culls_deferred",
+    "Culls deferred to the next cycle because of the per-cycle limit",
+    ["kind"],
+    namespace=metrics_prefix,
+)
+
+USERS_CULLED = Counter(
+    "users_culled",
+    "Users deleted by the culler",
+    namespace=metrics_prefix,
+)
+
+ARBITER_TIMEOUTS = Counter(
+    "arbiter_timeouts",
+    "Cull arbiter hook calls that timed out",
+    namespace=metrics_prefix,
+)
+
+HUB_REQUEST_DURATION_SECONDS = Histogram(
+    "hub_request_duration_seconds",
+    "Duration of requests to the JupyterHub API",
+    ["method", "endpoint", "code"],
+    namespace=metrics_prefix,
+)
+
+HUB_REQUEST_WAIT_SECONDS = Histogram(
+    "hub_request_wait_seconds",
+    "Time requests to the JupyterHub API waited for the concurrency limit",
+    namespace=metrics_prefix,
+)
+
+CONCURRENCY_LIMIT = Gauge(
+    "concurrency_limit",
+    "Current limit on concurrent requests to the JupyterHub API, with adaptive concurrency",
+    namespace=metrics_prefix,
+)
+
+for server_type in ("default", "named"):
+    SERVERS_CULLED.labels(server_type=server_type)
+
+for kind in ("stop", "remove", "delete"):
+    CULLS_DEFERRED.labels(kind=kind)
+
+
+class MetricsHandler(web.RequestHandler):
+    """Serve prometheus metrics"""
+
+    def get(self):
+        self.set_header("Content-Type", prometheus_client.CONTENT_TYPE_LATEST)
+        self.write(prometheus_client.generate_latest(prometheus_client.REGISTRY))
+
+
+def make_metrics_app():
+    """Return a tornado Application serving metrics on /metrics"""
+    if prometheus_client is None:
+        raise ImportError("prometheus_client is required to serve metrics")
+    return web.Application([(r"/metrics", MetricsHandler)])
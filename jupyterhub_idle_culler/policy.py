@@ -0,0 +1,165 @@
+"""Declarative culling policies
+
+A policy is a list of rules, each matching users and servers
+and giving the limits for those it matches, e.g.:
+
+    [
+        {"groups": ["staff"], "exempt": True},
+        {"profiles": ["gpu"], "timeout": 900, "max_age": 8 * 3600},
+        {"user_pattern": "student-.*", "timeout": 1800},
+    ]
+
+A rule matches by any of:
+
+- 'groups': a list of group names, matching members of any of them
+- 'users': a list of user names
+- 'user_pattern': a regular expression matching whole user names
+  (a user matches if they are in 'users' or match 'user_pattern')
+- 'servers': a list of server names, '' for default servers
+- 'profiles': a list of server profile names, from the server's
+  state['profile_name'] or user_options['profile']
+
+and all of the ones it has; a rule with none matches everything.
+Rules matching servers or profiles only apply to servers, not users.
+The first matching rule applies, giving:
+
+- 'timeout': the idle timeout, in seconds
+- 'max_age': the maximum age, in seconds
+- 'exempt': if true, never cull
+
+Limits not given by the rule are the culler's own (--timeout, --max-age),
+as for users and servers no rule matches.
+
+Rules are compiled once into lookup tables, from names to bitsets of
+the rules matching them, so that finding the first matching rule
+takes a few dict lookups and bitwise ands, however many rules there are.
+"""
+
+import re
+from collections import namedtuple
+
+# the limits applying to a user or server
+Limits = namedtuple("Limits", ["timeout", "max_age", "exempt"])
+
+# what rules can match on
+MATCH_KEYS = ("groups", "users", "user_pattern", "servers", "profiles")
+# what rules can set
+LIMIT_KEYS = ("timeout", "max_age", "exempt")
+
+
+def _lowest_bit(bits):
+    """Index of the lowest set bit"""
+    return (bits & -bits).bit_length() - 1
+
+
+class CullPolicy:
+    """Rules giving the limits for users and servers, compiled for fast lookup
+
+    timeout and max_age are the limits where no rule sets them.
+    Raises ValueError for invalid rules.
+    """
+
+    def __init__(self, rules, *, timeout, max_age=0):
+        self.rules = list(rules)
+        self.default = Limits(timeout, max_age, False)
+        self.limits = []
+        # name: bits of the rules matching it, per kind of name
+        self._groups = {}
+        self._users = {}
+        self._servers = {}
+        self._profiles = {}
+        # [(compiled pattern, bit)]
+        self._user_patterns = []
+        # per kind of name, bits of the rules not matching on it
+        self._any = dict.fromkeys(["groups", "users", "servers", "profiles"], 0)
+
+        for index, rule in enumerate(self.rules):
+            unknown = set(rule) - set(MATCH_KEYS) - set(LIMIT_KEYS)
+            if unknown:
+                raise ValueError(
+                    f"Unknown keys in cull policy rule {index}: {sorted(unknown)}"
+                )
+            bit = 1 << index
+            self.limits.append(
+                Limits(
+                    rule.get("timeout", timeout),
+                    rule.get("max_age", max_age),
+                    bool(rule.get("exempt", False)),
+                )
+            )
+            for key, table in [
+                ("groups", self._groups),
+                ("servers", self._servers),
+                ("profiles", self._profiles),
+            ]:
+                if key in rule:
+                    if isinstance(rule[key], str):
+                        raise ValueError(
+                            f"'{key}' in cull policy rule {index} must be a list"
+                        )
+                    for name in rule[key]:
+                        table[name] = table.get(name, 0) | bit
+                else:
+                    self._any[key] |= bit
+            if "users" in rule or "user_pattern" in rule:
+                if isinstance(rule.get("users"), str):
+                    raise ValueError(
+                        f"'users' in cull policy rule {index} must be a list"
+                    )
+                for name in rule.get("users", ()):
+                    self._users[name] = self._users.get(name, 0) | bit
+                if "user_pattern" in rule:
+                    if not isinstance(rule["user_pattern"], str):
+                        raise ValueError(
+                            f"Invalid user_pattern in cull policy rule {index}:"
+                            " must be a string"
+                        )
+                    try:
+                        pattern = re.compile(rule["user_pattern"])
+                    except re.error as e:
+                        raise ValueError(
+                            f"Invalid user_pattern in cull policy rule {index}: {e}"
+                        )
+                    self._user_patterns.append((pattern, bit))
+            else:
+                self._any["users"] |= bit
+
+    @property
+    def uses_groups(self):
+        """Whether the policy needs users' groups"""
+        return bool(self._groups)
+
+    @property
+    def uses_profiles(self):
+        """Whether the policy needs servers' profiles"""
+        return bool(self._profiles)
+
+    def _user_bits(self, user):
+        """Bits of the rules matching a user, regardless of servers"""
+        bits = self._any["users"] | self._users.get(user.name, 0)
+        for pattern, bit in self._user_patterns:
+            if pattern.fullmatch(user.name):
+                bits |= bit
+        group_bits = self._any["groups"]
+        for group in user.groups:
+            group_bits |= self._groups.get(group, 0)
+        return bits & group_bits
+
+    def _limits(self, bits):
+        if not bits:
+            return self.default
+        return self.limits[_lowest_bit(bits)]
+
+    def for_user(self, user):
+        """Limits for a user (a UserRecord)"""
+        return self._limits(
+            self._user_bits(user) & self._any["servers"] & self._any["profiles"]
+        )
+
+    def for_server(self, user, server):
+        """Limits for a server (a ServerRecord) of user (a UserRecord)"""
+        bits = self._user_bits(user)
+        bits &= self._any["servers"] | self._servers.get(server.name, 0)
+        if bits:
+            bits &= self._any["profiles"] | self._profiles.get(server.profile, 0)
+        return self._limits(bits)
@@ -0,0 +1,42 @@
+"""Limit how fast servers are stopped and users are deleted"""
+
+import asyncio
+import time
+
+# kinds of culls that are limited separately, and their descriptions
+CULL_KINDS = {
+    "stop": "server stops",
+    "remove": "named server removals",
+    "delete": "user deletions",
+}
+
+
+class TokenBucket:
+    """Allow at most rate actions per second, on average
+
+    Up to burst actions can happen at once after a quiet period.
+    Used across cull cycles, so that a cycle with a lot of work
+    (e.g. the first one after a Hub outage) can't flood the Hub.
+    """
+
+    def __init__(self, rate, burst=0):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until the next action is allowed"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
@@ -0,0 +1,199 @@
+"""Record the culler's requests to the Hub API, and replay them without a Hub
+
+ApiRecorder wraps the HTTP client of each cull cycle, appending every request,
+its response and how long it took to a JSON lines file.
+ApiReplay plays such a file back, one cull cycle at a time,
+with the recorded latencies (optionally scaled),
+so that a slow cycle can be reproduced and profiled locally.
+
+The Authorization header is never recorded.
+Responses to repeated requests (e.g. polling a user whose server is slow
+to stop) are replayed in the order they were recorded.
+"""
+
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from io import BytesIO
+
+from tornado.httpclient import HTTPClientError, HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+
+
+class _RecordingClient:
+    """An HTTP client recording each request it makes to an ApiRecorder"""
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+        self.cycle_start = time.perf_counter()
+
+    async def fetch(self, request, raise_error=True, **kwargs):
+        if not isinstance(request, HTTPRequest):
+            request = HTTPRequest(request, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = await self.client.fetch(request, raise_error=False)
+        except Exception:
+            self.recorder.record(request, None, start - self.cycle_start, 0)
+            raise
+        self.recorder.record(
+            request, response, start - self.cycle_start, time.perf_counter() - start
+        )
+        if raise_error and response.code >= 400:
+            raise HTTPClientError(response.code, response.reason, response)
+        return response
+
+    def close(self):
+        self.client.close()
+
+
+class ApiRecorder:
+    """Record requests to the Hub API to a JSON lines file
+
+    Each cull cycle starts with a line {"cycle": n, "time": <unix time>},
+    followed by a line per request, with its method and url,
+    't', the seconds from the start of the cycle,
+    'elapsed', the seconds it took,
+    and the response's 'code', 'headers' and 'body'.
+    Requests that failed without a response have code 599.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf8")
+        self.cycles = 0
+
+    def wrap(self, client):
+        """Start recording a cull cycle, returning a client to make its requests"""
+        self.cycles += 1
+        self._write({"cycle": self.cycles, "time": time.time()})
+        return _RecordingClient(client, self)
+
+    def record(self, request, response, t, elapsed):
+        entry = {
+            "method": request.method,
+            "url": request.url,
+            "t": round(t, 6),
+            "elapsed": round(elapsed, 6),
+        }
+        if response is None:
+            entry["code"] = 599
+        else:
+            entry["code"] = response.code
+            entry["headers"] = dict(response.headers.get_all())
+            entry["body"] = (response.body or b"").decode("utf8", "replace")
+        self._write(entry)
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayClient:
+    """An HTTP client answering requests from a recorded cull cycle
+
+    Requests are matched by method and url.
+    Requests not in the recording fail with code 599,
+    and are counted in `unmatched`.
+    """
+
+    def __init__(self, entries, latency_scale=1):
+        self.latency_scale = latency_scale
+        self.responses = defaultdict(deque)
+        for entry in entries:
+            self.responses[(entry["method"], entry["url"])].append(entry)
+        self.requests = defaultdict(int)
+        self.unmatched = 0
+
+    async def fetch(self, request, raise_error=True, **kwargs):
+        if not isinstance(request, HTTPRequest):
+            request = HTTPRequest(request, **kwargs)
+        key = (request.method, request.url)
+        self.requests[key] += 1
+        recorded = self.responses.get(key)
+        if not recorded:
+            self.unmatched += 1
+            raise HTTPClientError(
+                599, f"No recorded response for {request.method} {request.url}"
+            )
+        # the last response is repeated, for polling past the end of the recording
+        entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.latency_scale:
+            await asyncio.sleep(entry["elapsed"] * self.latency_scale)
+        if entry["code"] == 599:
+            raise HTTPClientError(599, "Recorded request failed")
+        response = HTTPResponse(
+            request,
+            entry["code"],
+            headers=HTTPHeaders(entry.get("headers", {})),
+            buffer=BytesIO(entry.get("body", "").encode("utf8")),
+            request_time=entry["elapsed"],
+        )
+        if raise_error and response.code >= 400:
+            raise HTTPClientError(response.code, response.reason, response)
+        return response
+
+    def close(self):
+        pass
+
+
+class ApiReplay:
+    """Cull cycles recorded by ApiRecorder, to replay
+
+    latency_scale multiplies the recorded latencies,
+    e.g. 0 to replay as fast as possible and profile only the culler.
+    """
+
+    def __init__(self, path, latency_scale=1):
+        self.latency_scale = latency_scale
+        # list of (start time, entries) per cycle
+        self.cycles = []
+        with open(path, encoding="utf8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "cycle" in entry:
+                    self.cycles.append((entry["time"], []))
+                elif self.cycles:
+                    self.cycles[-1][1].append(entry)
+                else:
+                    # no cycle marker, e.g. a hand-written recording
+                    self.cycles.append((None, [entry]))
+
+    def __len__(self):
+        return len(self.cycles)
+
+    @property
+    def url(self):
+        """The Hub API url requests were recorded from
+
+        The first request of each cycle is to the API's root.
+        """
+        for start, entries in self.cycles:
+            if entries:
+                return entries[0]["url"].rstrip("/")
+        return None
+
+    def now(self, index):
+        """When the recorded cycle decided what to cull, as a datetime
+
+        cull_idle takes the time right after its first request.
+        None if the recording doesn't tell.
+        """
+        start, entries = self.cycles[index]
+        if start is None:
+            return None
+        if entries:
+            start += entries[0]["t"] + entries[0]["elapsed"]
+        return datetime.fromtimestamp(start, timezone.utc)
+
+    def client(self, index):
+        """Return a client replaying cycle index"""
+        return ReplayClient(self.cycles[index][1], self.latency_scale)
@@ -0,0 +1,287 @@
+"""Compact records of users and servers, and culling decisions about them
+
+cull_idle converts each user model from the Hub API into a UserRecord once,
+with timestamps already parsed.
+Deciding whether to cull is done by pure functions of these records,
+which can be tested without a Hub.
+"""
+
+from collections import namedtuple
+
+
+class ServerRecord:
+    """A user's server
+
+    started and last_activity are timezone-aware datetimes, or None.
+    profile is the name of the server's profile, if known (for cull policies).
+    model is the server model from the API, if it's kept (for cull arbiters).
+    """
+
+    __slots__ = (
+        "name",
+        "pending",
+        "ready",
+        "stopped",
+        "started",
+        "last_activity",
+        "profile",
+        "model",
+    )
+
+    def __init__(
+        self,
+        name="",
+        *,
+        pending=None,
+        ready=True,
+        stopped=False,
+        started=None,
+        last_activity=None,
+        profile=None,
+        model=None,
+    ):
+        self.name = name
+        self.pending = pending
+        self.ready = ready
+        self.stopped = stopped
+        self.started = started
+        self.last_activity = last_activity
+        self.profile = profile
+        self.model = model
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__} {self.name!r}"
+            f" pending={self.pending!r} ready={self.ready!r}>"
+        )
+
+
+class UserRecord:
+    """A user, and their servers
+
+    created and last_activity are timezone-aware datetimes, or None.
+    servers is a dict of ServerRecords, keyed by server name.
+    groups is a tuple of the names of the user's groups, if known.
+    model is the user model from the API, if it's kept (for cull arbiters).
+    """
+
+    __slots__ = (
+        "name",
+        "admin",
+        "created",
+        "last_activity",
+        "servers",
+        "groups",
+        "model",
+    )
+
+    def __init__(
+        self,
+        name,
+        *,
+        admin=False,
+        created=None,
+        last_activity=None,
+        servers=None,
+        groups=(),
+        model=None,
+    ):
+        self.name = name
+        self.admin = admin
+        self.created = created
+        self.last_activity = last_activity
+        self.servers = servers or {}
+        self.groups = groups
+        self.model = model
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name!r} servers={list(self.servers)}>"
+
+
+# cull: whether to cull
+# reason: why to cull ('inactive' or 'age'), None if not culling
+# age, inactive: timedeltas, or None if unknown
+# recheck: seconds from now until culling could be due, None if it never will be
+Decision = namedtuple("Decision", ["cull", "reason", "age", "inactive", "recheck"])
+
+
+def seconds_until(limit, elapsed):
+    """Seconds from now until elapsed (a timedelta) reaches limit (in seconds)
+
+    None if there is no limit or elapsed is unknown,
+    or if the limit has been reached already without culling
+    (e.g. the cull arbiter declined): rechecking right away would decide
+    the same, so it's left to the next full scan.
+    """
+    if not limit or elapsed is None:
+        return None
+    seconds = limit - elapsed.total_seconds()
+    if seconds <= 0:
+        return None
+    return seconds
+
+
+def _earliest(*seconds):
+    seconds = [s for s in seconds if s is not None]
+    if not seconds:
+        return None
+    return min(seconds)
+
+
+def server_times(server, now):
+    """Return a server's age and time since last activity, as timedeltas
+
+    Either may be None if the Hub doesn't tell.
+    """
+    if server.started:
+        age = now - server.started
+    else:
+        # started may be undefined on jupyterhub < 0.9
+        age = None
+
+    # last_activity can be None in 0.9
+    if server.last_activity:
+        inactive = now - server.last_activity
+    else:
+        # no activity yet, use start date
+        # last_activity may be None with jupyterhub 0.9,
+        # which introduces the 'started' field which is never None
+        # for running servers
+        inactive = age
+    return age, inactive
+
+
+def user_times(user, now):
+    """Return a user's age and time since last activity, as timedeltas
+
+    Either may be None if the Hub doesn't tell.
+    """
+    if user.created:
+        age = now - user.created
+    else:
+        # created may be undefined on jupyterhub < 0.9
+        age = None
+
+    # last_activity can be None in 0.9
+    if user.last_activity:
+        inactive = now - user.last_activity
+    else:
+        # no activity yet, use creation date
+        # last_activity may be None with jupyterhub 0.9,
+        # which introduces the 'created' field which is never None
+        inactive = age
+    return age, inactive
+
+
+def decide_server(
+    server, now, *, inactive_limit, max_age=0, cull_result=True, cull_enabled=True
+):
+    """Decide whether to cull a ready server
+
+    cull_result is the cull arbiter's decision about the server,
+    cull_enabled whether servers of this type (default or named) may be culled
+    for inactivity.
+    Servers older than max_age are culled regardless.
+    """
+    age, inactive = server_times(server, now)
+    if inactive is not None and cull_result and cull_enabled:
+        return Decision(True, "inactive", age, inactive, None)
+
+    # only check started if max_age is specified
+    # so that we can still be compatible with jupyterhub 0.8
+    # which doesn't define the 'started' field
+    if max_age and age is not None and age.total_seconds() >= max_age:
+        return Decision(True, "age", age, inactive, None)
+
+    recheck = _earliest(
+        seconds_until(inactive_limit, inactive) if cull_enabled else None,
+        seconds_until(max_age, age),
+    )
+    return Decision(False, None, age, inactive, recheck)
+
+
+def decide_user(user, now, *, inactive_limit, max_age=0, cull_admin_users=True):
+    """Decide whether to cull a user with no running servers"""
+    age, inactive = user_times(user, now)
+    cull_enabled = cull_admin_users or not user.admin
+    if (
+        cull_enabled
+        and inactive is not None
+        and inactive.total_seconds() >= inactive_limit
+    ):
+        return Decision(True, "inactive", age, inactive, None)
+
+    # only check created if max_age is specified
+    # so that we can still be compatible with jupyterhub 0.8
+    # which doesn't define the 'created' field
+    if max_age and age is not None and age.total_seconds() >= max_age:
+        return Decision(True, "age", age, inactive, None)
+
+    recheck = _earliest(
+        seconds_until(inactive_limit, inactive) if cull_enabled else None,
+        seconds_until(max_age, age),
+    )
+    return Decision(False, None, age, inactive, recheck)
+
+
+def batch_candidates(
+    users, now, server_limits, *, cull_default_servers=True, cull_named_servers=True
+):
+    """Return the servers of users to ask a batch cull arbiter about
+
+    server_limits(user, server) returns a server's policy.Limits.
+    Servers that can't be culled for inactivity are left out:
+    pending or not ready ones, exempt ones, ones never active,
+    and ones of a type (default or named) not culled.
+
+    Returns the list of candidate dicts passed to cull_arbiter_batch.
+    """
+    candidates = []
+    for user in users:
+        for server_name, server in user.servers.items():
+            if not (cull_named_servers if server_name else cull_default_servers):
+                continue
+            if server.pending or not server.ready:
+                continue
+            limits = server_limits(user, server)
+            if limits.exempt:
+                continue
+            age, inactive = server_times(server, now)
+            if inactive is None:
+                continue
+            candidates.append(
+                {
+                    "user": user.model,
+                    "server_name": server_name,
+                    "server": server.model,
+                    "inactive": inactive,
+                    "inactive_limit": limits.timeout,
+                }
+            )
+    return candidates
+
+
+def cull_priority(decision, by="inactive", score=None):
+    """Return a key ordering servers to cull, lowest most urgent
+
+    by is what to cull first:
+
+    - 'inactive': servers inactive the longest
+    - 'age': the oldest servers
+    - 'score': servers with the highest score,
+      a number returned by the cull arbiter instead of True.
+      Falls back on inactivity for servers without a score.
+    """
+    if (
+        by == "score"
+        and isinstance(score, (int, float))
+        and not isinstance(score, bool)
+    ):
+        return -score
+    if by == "age":
+        elapsed = decision.age
+    else:
+        elapsed = decision.inactive
+    if elapsed is None:
+        return 0
+    return -elapsed.total_seconds()
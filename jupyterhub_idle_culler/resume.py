@@ -0,0 +1,65 @@
+"""Resume cull cycles that ran out of time where they left off
+
+When a cull cycle has a time budget and runs out of it, it stops listing
+users, and records the listing and offsets of the users it didn't list.
+The next cycle starts from there instead of from the first user.
+"""
+
+import json
+import logging
+import os
+
+
+class ResumePoint:
+    """Where the next cull cycle should start listing users
+
+    state is the listing's state filter ('inactive', 'ready',
+    or None for all users), offset the offset in it, and end the offset
+    to stop at, if the users after it have been checked already
+    (None for the end of the listing).
+    If path is given, the resume point is kept in that file,
+    so that it survives restarts.
+    """
+
+    def __init__(self, path=None, log=None):
+        self.path = path
+        self.log = log or logging.getLogger(__name__)
+        self.point = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf8") as f:
+                    point = json.load(f)
+                self.point = (point["state"], point["offset"], point.get("end"))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.log.warning(f"Ignoring invalid cycle state file {path}: {e}")
+
+    def get(self):
+        """Return (state, offset, end) to resume from, or None to start over"""
+        return self.point
+
+    def save(self, state, offset, end=None):
+        self.point = (state, offset, end)
+        self._write({"state": state, "offset": offset, "end": end})
+
+    def clear(self):
+        if self.point is None:
+            return
+        self.point = None
+        self._write(None)
+
+    def _write(self, data):
+        if not self.path:
+            return
+        try:
+            if data is None:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            # write to a temporary file first,
+            # so that the state file is never left half-written
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.log.warning(f"Failed to write cycle state file {self.path}: {e}")
@@ -0,0 +1,83 @@
+"""Rolling scans, checking a slice of the user list at a time
+
+Instead of listing and checking every user every cull_every seconds,
+a rolling scan checks a slice of the users every cull_every / slices seconds,
+so that the load on the Hub is spread evenly across the interval
+and every user is still checked about once per interval.
+RollingCursor keeps track of where in the user list(s) the scan is.
+"""
+
+import logging
+import math
+import time
+
+
+class RollingCursor:
+    """Where a rolling scan is in the user list(s) of each cull cycle
+
+    A cycle may go through more than one listing: users with inactive servers
+    (state filter 'inactive') then users with ready servers ('ready'),
+    or all users (None) on hubs without state filters.
+    The cursor is in one listing at a time, at an offset in it.
+    """
+
+    def __init__(self, slices, log=None):
+        self.slices = slices
+        self.log = log or logging.getLogger(__name__)
+        self.state = None
+        self.offset = 0
+        # listing: number of users in it, as of the last time it was listed
+        self.totals = {}
+        # number of completed passes over all listings
+        self.passes = 0
+        self._pass_start = time.monotonic()
+
+    def position(self, listings):
+        """Return the (listing, offset) of the next slice
+
+        listings are the state filters of the cycle's listings, in order.
+        Starts over if the cursor's listing isn't one of them
+        (e.g. the first time).
+        """
+        if self.state not in listings:
+            self.state = listings[0]
+            self.offset = 0
+        return self.state, self.offset
+
+    def slice_size(self, listings):
+        """How many users the next slice should have
+
+        0 if it's unknown yet, since no listing has been seen.
+        """
+        total = sum(self.totals.get(state, 0) for state in listings)
+        if not total:
+            return 0
+        return math.ceil(total / self.slices)
+
+    def advance(self, listings, listed, gone, total, end):
+        """Move past a slice
+
+        listed is the number of users listed in the slice,
+        gone how many of them are no longer in the listing
+        (e.g. their servers have been stopped),
+        so that the users after them, now at lower offsets, aren't skipped.
+        total is the number of users in the listing, if known,
+        end whether the slice reached the end of the listing.
+        """
+        if total is not None:
+            self.totals[self.state] = total
+        if not end:
+            self.offset += max(listed - gone, 0)
+            return
+        index = listings.index(self.state) + 1
+        self.offset = 0
+        if index < len(listings):
+            self.state = listings[index]
+            return
+        self.state = listings[0]
+        self.passes += 1
+        now = time.monotonic()
+        self.log.info(
+            f"Rolling scan pass {self.passes} done in {now - self._pass_start:.0f}s"
+        )
+        self._pass_start = now
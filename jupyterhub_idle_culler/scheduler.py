@@ -0,0 +1,60 @@
+"""Keep track of when users may next need to be culled"""
+
+import heapq
+
+
+class DeadlineScheduler:
+    """A min-heap of per-user deadlines
+
+    Each cull cycle knows, for every server it doesn't cull,
+    the earliest time it could become cullable
+    (e.g. when `timeout - inactive` seconds have passed).
+    Recording those deadlines allows rechecking only the users
+    that may actually need culling, instead of every user every time.
+
+    Only the earliest deadline for each user is kept.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # user name: deadline
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def clear(self):
+        """Forget all deadlines, e.g. before a full rescan"""
+        self._heap = []
+        self._deadlines = {}
+
+    def schedule(self, name, deadline):
+        """Schedule a recheck of a user at deadline (a datetime)
+
+        Does nothing if the user is already scheduled for an earlier recheck.
+        """
+        current = self._deadlines.get(name)
+        if current is not None and current <= deadline:
+            return
+        self._deadlines[name] = deadline
+        # outdated entries are left in the heap, and skipped when popped
+        heapq.heappush(self._heap, (deadline, name))
+
+    def next_deadline(self):
+        """Return the earliest deadline, or None if there are none"""
+        while self._heap:
+            deadline, name = self._heap[0]
+            if self._deadlines.get(name) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now):
+        """Remove and return the names of users with deadlines at or before now"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, name = heapq.heappop(self._heap)
+            if self._deadlines.get(name) == deadline:
+                del self._deadlines[name]
+                due.append(name)
+        return due
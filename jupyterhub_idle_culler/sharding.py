@@ -0,0 +1,55 @@
+"""Split users between several culler replicas
+
+Each replica still lists all users, but only checks and culls
+the users in its own shard.
+"""
+
+import os
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    # not on Windows
+    fcntl = None
+
+
+def shard_of(name, shard_count):
+    """Return the shard index of a user name
+
+    Uses crc32 rather than hash(),
+    which is randomized differently in each process.
+    """
+    return zlib.crc32(name.encode("utf8")) % shard_count
+
+
+def acquire_shard_lock(lock_dir, shard_count):
+    """Pick a shard index no other replica on this host is using
+
+    Takes an exclusive lock on `shard-{index}.lock` in lock_dir,
+    for the first index not already locked.
+    The lock is held as long as the returned file is open,
+    and released by the OS when the process exits.
+
+    Returns (shard index, lock file).
+    Raises RuntimeError if every shard is taken.
+    """
+    if fcntl is None:
+        raise RuntimeError("Shard lock files require fcntl, which is unavailable")
+    os.makedirs(lock_dir, exist_ok=True)
+    for index in range(shard_count):
+        path = os.path.join(lock_dir, f"shard-{index}.lock")
+        f = open(path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # held by another replica
+            f.close()
+            continue
+        # record who holds it, for humans
+        f.seek(0)
+        f.truncate()
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        return index, f
+    raise RuntimeError(f"All {shard_count} shards are locked in {lock_dir}")
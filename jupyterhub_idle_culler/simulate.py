@@ -0,0 +1,223 @@
+"""Simulate a cull cycle over a snapshot of the Hub's users, offline
+
+Loads the output of `GET /users`, decides what a cull cycle would do at a
+given time with the same decision functions as cull_idle,
+and reports how many servers and users would be culled or kept, and why.
+Nothing is sent to the Hub.
+
+Useful for tuning --timeout, --max-age and cull arbiter hooks,
+and for benchmarking the decision code.
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+
+from . import default_cull_arbiter, format_td, user_record
+from .policy import Limits
+from .records import batch_candidates, decide_server, decide_user, server_times
+from .utils import maybe_future
+
+
+def load_snapshot(path):
+    """Load user models from a snapshot of `GET /users` responses
+
+    The file may hold a JSON list of user models, or a page of them
+    (a dict with 'items', from the paginated API),
+    or be JSON lines, each line holding a user model, a list or a page.
+    """
+    with open(path, encoding="utf8") as f:
+        text = f.read()
+    try:
+        chunks = [json.loads(text)]
+    except json.JSONDecodeError:
+        # JSON lines
+        chunks = [json.loads(line) for line in text.splitlines() if line.strip()]
+    users = []
+    for chunk in chunks:
+        if isinstance(chunk, list):
+            users.extend(chunk)
+        elif "items" in chunk:
+            users.extend(chunk["items"])
+        else:
+            users.append(chunk)
+    return users
+
+
+async def simulate(
+    users,
+    now,
+    *,
+    inactive_limit,
+    max_age=0,
+    cull_users=False,
+    cull_admin_users=True,
+    cull_default_servers=True,
+    cull_named_servers=True,
+    cull_arbiter=default_cull_arbiter,
+    cull_arbiter_batch=None,
+    policy=None,
+    logger=None,
+):
+    """Decide what a cull cycle would do to users (models from the API) at now
+
+    Arguments are the same as cull_idle's.
+    Servers that would be culled are assumed to stop right away.
+
+    Returns a report dict with counts of servers and users culled and kept,
+    by rule:
+
+    - servers culled for 'timeout' (inactive longer than inactive_limit),
+      'max_age', or by the 'arbiter' before the timeout
+    - servers kept because they are 'active', the 'arbiter' said so,
+      they are 'not_ready' (pending), culling their type is 'disabled',
+      or they are 'exempt' by the cull policy
+    - users culled for 'timeout' or 'max_age'
+    - users kept because they are 'active', 'admin' (--cull-admin-users=false),
+      'exempt' by the cull policy, or have 'servers_running'
+
+    and how long loading the records and the decisions took.
+    """
+    logger = logger or logging.getLogger(__name__)
+    default_limits = Limits(inactive_limit, max_age, False)
+
+    def server_limits(user, server):
+        if policy is None:
+            return default_limits
+        return policy.for_server(user, server)
+
+    keep_models = (
+        cull_arbiter is not default_cull_arbiter or cull_arbiter_batch is not None
+    )
+    servers_culled = Counter()
+    servers_kept = Counter()
+    users_culled = Counter()
+    users_kept = Counter()
+
+    tic = time.perf_counter()
+    records = [user_record(user, keep_models) for user in users]
+    load_seconds = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    batch_decisions = {}
+    if cull_arbiter_batch is not None:
+        # the same candidates as cull_idle's
+        candidates = batch_candidates(
+            records,
+            now,
+            server_limits,
+            cull_default_servers=cull_default_servers,
+            cull_named_servers=cull_named_servers,
+        )
+        if candidates:
+            batch_decisions = await maybe_future(cull_arbiter_batch(candidates)) or {}
+
+    n_servers = 0
+    for user in records:
+        still_alive = 0
+        for server in user.servers.values():
+            n_servers += 1
+            log_name = f"{user.name}/{server.name}" if server.name else user.name
+            if server.pending or not server.ready:
+                servers_kept["not_ready"] += 1
+                still_alive += 1
+                continue
+            limits = server_limits(user, server)
+            if limits.exempt:
+                servers_kept["exempt"] += 1
+                still_alive += 1
+                continue
+            age, inactive = server_times(server, now)
+            cull_result = batch_decisions.get((user.name, server.name))
+            if cull_result is None:
+                cull_result = await maybe_future(
+                    cull_arbiter(
+                        inactive=inactive,
+                        inactive_limit=limits.timeout,
+                        server=server.model,
+                    )
+                )
+            cull_enabled = cull_named_servers if server.name else cull_default_servers
+            decision = decide_server(
+                server,
+                now,
+                inactive_limit=limits.timeout,
+                max_age=limits.max_age,
+                cull_result=cull_result,
+                cull_enabled=cull_enabled,
+            )
+            timed_out = (
+                inactive is not None and inactive.total_seconds() >= limits.timeout
+            )
+            if decision.cull:
+                if decision.reason == "age":
+                    rule = "max_age"
+                elif timed_out:
+                    rule = "timeout"
+                else:
+                    rule = "arbiter"
+                servers_culled[rule] += 1
+                logger.info(
+                    f"Would cull server {log_name} ({rule},"
+                    f" age: {format_td(decision.age)},"
+                    f" inactive for {format_td(decision.inactive)})"
+                )
+                continue
+            still_alive += 1
+            if not cull_enabled:
+                servers_kept["disabled"] += 1
+            elif timed_out:
+                servers_kept["arbiter"] += 1
+            else:
+                servers_kept["active"] += 1
+
+        if not cull_users:
+            continue
+        if still_alive:
+            users_kept["servers_running"] += 1
+            continue
+        limits = policy.for_user(user) if policy else default_limits
+        if limits.exempt:
+            users_kept["exempt"] += 1
+            continue
+        decision = decide_user(
+            user,
+            now,
+            inactive_limit=limits.timeout,
+            max_age=limits.max_age,
+            cull_admin_users=cull_admin_users,
+        )
+        if decision.cull:
+            rule = "max_age" if decision.reason == "age" else "timeout"
+            users_culled[rule] += 1
+            logger.info(
+                f"Would cull user {user.name} ({rule},"
+                f" age: {format_td(decision.age)},"
+                f" inactive for {format_td(decision.inactive)})"
+            )
+        elif (
+            user.admin
+            and decide_user(
+                user, now, inactive_limit=limits.timeout, max_age=limits.max_age
+            ).cull
+        ):
+            users_kept["admin"] += 1
+        else:
+            users_kept["active"] += 1
+    decision_seconds = time.perf_counter() - tic
+
+    return {
+        "now": now.isoformat(),
+        "users": len(records),
+        "servers": n_servers,
+        "servers_culled": dict(servers_culled),
+        "servers_kept": dict(servers_kept),
+        "users_culled": dict(users_culled),
+        "users_kept": dict(users_kept),
+        "load_seconds": load_seconds,
+        "decision_seconds": decision_seconds,
+        "users_per_second": (
+            len(records) / decision_seconds if decision_seconds else None
+        ),
+    }
@@ -0,0 +1,257 @@
+"""Trace where the time of each cull cycle goes
+
+A Tracer records spans (timed, nested operations, e.g. a request to the Hub
+within the handling of a user within a cull cycle),
+and exports them in the OpenTelemetry protocol's JSON encoding (OTLP/JSON),
+either as JSON lines in a local file
+or to an OpenTelemetry collector's OTLP/HTTP endpoint.
+
+This implements just what the culler needs, without depending on
+the OpenTelemetry SDK. Without an exporter, spans are not recorded at all.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import time
+
+from tornado.httpclient import HTTPRequest
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+# the span operations run in, inherited by the tasks they start
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# OTLP span kinds
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _attribute(key, value):
+    """Encode an attribute as an OTLP KeyValue"""
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        # int64 is encoded as a string in OTLP/JSON
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+class Span:
+    """A timed operation, used as a context manager
+
+    Spans started while another is active (in the same task,
+    or in a task it started) are its children, in the same trace.
+    """
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "kind",
+        "attributes",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "error",
+        "_token",
+    )
+
+    def __init__(self, tracer, name, attributes=None, kind="internal"):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.end_ns = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        """Mark the span as failed, with error (an exception)"""
+        self.error = error
+
+    def start(self):
+        """Start the span, making it the parent of spans started after it"""
+        parent = _current_span.get()
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_id = None
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self.span_id = os.urandom(8).hex()
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        return self
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        _current_span.reset(self._token)
+        self.tracer._finished.append(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.record_error(exc)
+        self.end()
+
+    def to_otlp(self):
+        """The span, as an OTLP/JSON Span"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": STATUS_ERROR, "message": str(self.error)}
+        else:
+            span["status"] = {"code": STATUS_OK}
+        return span
+
+
+class _NoopSpan:
+    """A span recording nothing, for tracers without an exporter"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def start(self):
+        return self
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Record spans, and export them after each cull cycle
+
+    exporter is a JsonLinesExporter or OtlpHttpExporter.
+    If None, spans are not recorded.
+    """
+
+    def __init__(self, exporter=None, service_name="jupyterhub-idle-culler", log=None):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.log = log or logging.getLogger(__name__)
+        self._finished = []
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def span(self, name, attributes=None, kind="internal"):
+        """Return a new span, to start with `with tracer.span(...):`"""
+        if self.exporter is None:
+            return _NOOP_SPAN
+        return Span(self, name, attributes, kind)
+
+    def flush(self):
+        """Return the spans finished so far as an OTLP/JSON trace request
+
+        They are then forgotten.
+        """
+        spans, self._finished = self._finished, []
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_attribute("service.name", self.service_name)]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __package__},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    async def export(self):
+        """Export the spans finished so far
+
+        Failures are logged, not raised: tracing must not stop culling.
+        """
+        if self.exporter is None or not self._finished:
+            return
+        payload = self.flush()
+        try:
+            await self.exporter.export(payload)
+        except Exception as e:
+            self.log.warning(f"Failed to export traces: {e}")
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+
+
+class JsonLinesExporter:
+    """Append traces to a file, one OTLP/JSON trace request per line
+
+    The format of the OpenTelemetry collector's file exporter,
+    which its otlpjsonfile receiver can read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf8")
+
+    async def export(self, payload):
+        self._file.write(json.dumps(payload, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class OtlpHttpExporter:
+    """Send traces to an OTLP/HTTP endpoint, e.g. http://collector:4318/v1/traces"""
+
+    def __init__(self, endpoint, request_timeout=10):
+        self.endpoint = endpoint
+        self.request_timeout = request_timeout
+        self._client = SimpleAsyncHTTPClient(force_instance=True)
+
+    async def export(self, payload):
+        await self._client.fetch(
+            HTTPRequest(
+                self.endpoint,
+                method="POST",
+                headers={"Content-Type": "application/json"},
+                body=json.dumps(payload, separators=(",", ":")),
+                request_timeout=self.request_timeout,
+            )
+        )
+
+    def close(self):
+        self._client.close()
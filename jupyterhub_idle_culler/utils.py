@@ -2,7 +2,11 @@
 
 import asyncio
 import concurrent.futures
+import functools
 import inspect
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from tornado import gen
 
 
 def maybe_future(obj):
@@ -34,3 +38,26 @@ def maybe_future(obj):
         f = asyncio.Future()
         f.set_result(obj)
         return f
+
+
+def is_async_callable(f):
+    """Return whether calling f is known to return an awaitable
+
+    Like inspect.iscoroutinefunction, but also recognizes partials,
+    callable objects with an `async def __call__` and tornado coroutines.
+    """
+    while isinstance(f, functools.partial):
+        f = f.func
+    if not (inspect.isfunction(f) or inspect.ismethod(f)):
+        f = getattr(f, "__call__", f)
+    return inspect.iscoroutinefunction(f) or gen.is_coroutine_function(f)
+
+
+def url_replace_params(url, **params):
+    """Return url with the given query parameters set, replacing existing values"""
+    parsed = urlparse(url)
+    query = [
+        (key, value) for key, value in parse_qsl(parsed.query) if key not in params
+    ]
+    query.extend((key, str(value)) for key, value in params.items())
+    return urlunparse(parsed._replace(query=urlencode(query)))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Benchmark a cull cycle against the in-process FakeHub
+
+Runs one `cull_idle` cycle per user count, each in a fresh subprocess
+so that peak RSS measurements don't leak between runs,
+and reports cycle wall time, requests made to the Hub and memory use.
+
+Usage:
+
+    python tests/benchmark.py [--users 1000 10000 100000] [--workers 10] ...
+
+Note that the fake Hub runs on the same event loop as the culler,
+so wall time includes serving the requests,
+and the baseline RSS includes the fake Hub's user models.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+here = Path(__file__).parent
+sys.path.insert(0, str(here))
+
+from fake_hub import FakeHub, synthetic_users  # noqa: E402
+
+from jupyterhub_idle_culler import cull_idle  # noqa: E402
+from jupyterhub_idle_culler.decode import BACKENDS, UserDecoder  # noqa: E402
+
+
+def max_rss():
+    """Peak resident set size of this process, in bytes"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS, kilobytes on Linux
+        return rss
+    return rss * 1024
+
+
+async def run_one(args, n_users):
+    now = datetime.now(timezone.utc)
+    hub = FakeHub(
+        synthetic_users(
+            n_users,
+            now=now,
+            running=args.running,
+            named_servers=args.named_servers,
+            max_inactive=2 * args.timeout,
+        ),
+        page_default_limit=args.page_size,
+        page_max_limit=max(args.page_size, 1000),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        slow_stop_rate=args.slow_stop_rate,
+    )
+    await hub.start()
+    baseline_rss = max_rss()
+
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+
+    tic = time.perf_counter()
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=args.timeout,
+        logger=logger,
+        cull_users=args.cull_users,
+        concurrency=args.concurrency,
+        api_page_size=args.page_size,
+        api_page_concurrency=args.page_concurrency,
+        workers=args.workers,
+        decoder=UserDecoder(args.json_decoder, compact=not args.full_models),
+    )
+    wall_time = time.perf_counter() - tic
+    await hub.stop()
+
+    return {
+        "users": n_users,
+        "wall_time": wall_time,
+        "requests": sum(hub.requests.values()),
+        "requests_by_route": {
+            f"{method} {route}": count
+            for (method, route), count in sorted(hub.requests.items())
+        },
+        "events": dict(hub.events),
+        "baseline_rss": baseline_rss,
+        "peak_rss": max_rss(),
+    }
+
+
+def format_result(result):
+    mb = 1024 * 1024
+    return (
+        f"{result['users']:>8} users"
+        f" {result['wall_time']:8.2f}s"
+        f" {result['requests']:>8} requests"
+        f" rss {result['baseline_rss'] / mb:7.1f}MB"
+        f" -> {result['peak_rss'] / mb:7.1f}MB"
+        f" (+{(result['peak_rss'] - result['baseline_rss']) / mb:.1f}MB)"
+        f" {result['events']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--timeout", type=int, default=600)
+    parser.add_argument("--running", type=float, default=0.5)
+    parser.add_argument("--named-servers", type=int, default=0)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--page-concurrency", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--cull-users", action="store_true")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--slow-stop-rate", type=float, default=0)
+    parser.add_argument("--json-decoder", choices=BACKENDS, default="json")
+    parser.add_argument(
+        "--full-models", action="store_true", help="Don't compact user models"
+    )
+    parser.add_argument("--json", action="store_true", help="Output JSON lines")
+    parser.add_argument("--one", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        # run in this process and report to the parent
+        result = asyncio.run(run_one(args, args.users[0]))
+        print(json.dumps(result))
+        return
+
+    for n_users in args.users:
+        argv = [a for a in sys.argv[1:]]
+        # replace the --users list with a single count
+        if "--users" in argv:
+            start = argv.index("--users")
+            end = start + 1
+            while end < len(argv) and not argv[end].startswith("--"):
+                end += 1
+            del argv[start:end]
+        out = subprocess.check_output(
+            [sys.executable, __file__, "--one", "--users", str(n_users)] + argv
+        )
+        result = json.loads(out.decode("utf8").splitlines()[-1])
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(format_result(result))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
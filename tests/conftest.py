@@ -12,6 +12,7 @@ from unittest import mock
 
 import psutil
 import pytest
+from fake_hub import FakeHub
 from tornado.httpclient import AsyncHTTPClient, HTTPClient
 
 import jupyterhub_idle_culler
@@ -146,3 +147,22 @@ def cull_idle(hub_url, cull_token):
     return partial(
         jupyterhub_idle_culler.cull_idle, hub_url + "/hub/api", api_token=cull_token
     )
+
+
+@pytest.fixture
+async def fake_hub():
+    """Returns a function to start an in-process FakeHub
+
+    Use instead of `hub` to test against many users without a real JupyterHub.
+    """
+    hubs = []
+
+    async def start_fake_hub(users=(), **kwargs):
+        hub = FakeHub(users, **kwargs)
+        await hub.start()
+        hubs.append(hub)
+        return hub
+
+    yield start_fake_hub
+    for hub in hubs:
+        await hub.stop()
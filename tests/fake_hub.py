@@ -0,0 +1,497 @@
+"""An in-process stand-in for the JupyterHub REST API
+
+Implements just enough of the API used by the idle culler
+to exercise `cull_idle` against very large numbers of users
+without starting a real JupyterHub:
+
+- GET /hub/api/
+- GET /hub/api/users (with `state` filter and pagination)
+- GET /hub/api/users/:name
+- DELETE /hub/api/users/:name
+- DELETE /hub/api/users/:name/server
+- DELETE /hub/api/users/:name/servers/:server_name
+
+Latency, errors and 202 "slow to stop" responses can be injected
+to see how the culler behaves when the Hub is struggling.
+"""
+
+import asyncio
+import json
+import random
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+
+from packaging.version import Version as V
+from tornado import web
+from tornado.httpserver import HTTPServer
+from tornado.httputil import url_concat
+from tornado.netutil import bind_sockets
+
+PAGINATION_MEDIA_TYPE = "application/jupyterhub-pagination+json"
+
+
+def isoformat(dt):
+    """Format a datetime the way JupyterHub does (UTC, with Z suffix)"""
+    return dt.astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+
+def make_server(name="", *, started, last_activity, state=None):
+    """Return the model of a ready server"""
+    return {
+        "name": name,
+        "last_activity": isoformat(last_activity) if last_activity else None,
+        "started": isoformat(started),
+        "pending": None,
+        "ready": True,
+        "stopped": False,
+        "url": f"/user/placeholder/{name}",
+        "user_options": {},
+        "state": state or {},
+    }
+
+
+def make_user(
+    name,
+    *,
+    created,
+    last_activity=None,
+    servers=None,
+    admin=False,
+    groups=(),
+):
+    """Return a user model"""
+    servers = servers or {}
+    for server_name, server in servers.items():
+        server["name"] = server_name
+        server["url"] = f"/user/{name}/{server_name}"
+    return {
+        "kind": "user",
+        "name": name,
+        "admin": admin,
+        "groups": list(groups),
+        "roles": ["user"],
+        "created": isoformat(created),
+        "last_activity": isoformat(last_activity) if last_activity else None,
+        "pending": None,
+        "server": f"/user/{name}/" if "" in servers else None,
+        "servers": servers,
+    }
+
+
+def synthetic_users(
+    n,
+    *,
+    now=None,
+    running=1.0,
+    named_servers=0,
+    max_inactive=3600,
+    max_age=86400,
+    admin=0.0,
+    profiles=(),
+    groups=(),
+    prefix="user-",
+    seed=0,
+):
+    """Generate n synthetic user models
+
+    - running: fraction of users with a running default server
+    - named_servers: number of running named servers per running user
+    - max_inactive: servers' last_activity is uniformly up to this many seconds ago
+    - max_age: users and servers are uniformly up to this many seconds old
+    - admin: fraction of users that are admins
+    - profiles: profile names, assigned round-robin as server state['profile_name']
+    - groups: group names, assigned round-robin to users
+
+    Generation is deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    for i in range(n):
+        created = now - timedelta(seconds=rng.uniform(0, max_age))
+        servers = {}
+        last_activity = None
+        if rng.random() < running:
+            server_names = [""] + [f"named-{j}" for j in range(named_servers)]
+            for server_name in server_names:
+                inactive = rng.uniform(0, max_inactive)
+                server_last_activity = now - timedelta(seconds=inactive)
+                started = server_last_activity - timedelta(
+                    seconds=rng.uniform(0, max_age)
+                )
+                state = {}
+                if profiles:
+                    state["profile_name"] = profiles[i % len(profiles)]
+                servers[server_name] = make_server(
+                    server_name,
+                    started=started,
+                    last_activity=server_last_activity,
+                    state=state,
+                )
+                if last_activity is None or server_last_activity > last_activity:
+                    last_activity = server_last_activity
+        user_groups = [groups[i % len(groups)]] if groups else []
+        yield make_user(
+            f"{prefix}{i}",
+            created=created,
+            last_activity=last_activity,
+            servers=servers,
+            admin=rng.random() < admin,
+            groups=user_groups,
+        )
+
+
+class _CountingHTTPServer(HTTPServer):
+    """HTTPServer counting the connections it accepts in fake_hub.connections"""
+
+    def handle_stream(self, stream, address):
+        self.fake_hub.connections += 1
+        return super().handle_stream(stream, address)
+
+
+class FakeHub:
+    """In-process fake of the JupyterHub REST API
+
+    Users are kept in memory in listing order.
+    `state=ready|active|inactive` filtered listings are kept as sorted indices,
+    updated as servers stop and users are deleted,
+    so that offset-based pagination is cheap even with 100k users
+    and behaves like the real Hub when users change between pages.
+
+    Failure injection:
+
+    - latency: seconds (or callable returning seconds) to wait before
+      responding to each request
+    - error_rate: fraction of requests answered with a 500 error
+    - slow_stop_rate: fraction of server stops answered with 202,
+      the server finishes stopping `stop_delay` seconds later
+    """
+
+    def __init__(
+        self,
+        users=(),
+        *,
+        version="5.0.0",
+        token=None,
+        page_default_limit=200,
+        page_max_limit=1000,
+        latency=0,
+        error_rate=0,
+        slow_stop_rate=0,
+        stop_delay=1,
+        seed=0,
+    ):
+        self.version = version
+        self.token = token
+        self.page_default_limit = page_default_limit
+        self.page_max_limit = page_max_limit
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slow_stop_rate = slow_stop_rate
+        self.stop_delay = stop_delay
+        self.random = random.Random(seed)
+
+        # name: user model
+        self.users = {}
+        # name: index in listing order
+        self._index = {}
+        self._names = []
+        # state: sorted list of indices
+        self._states = {"ready": [], "active": [], "inactive": []}
+        # name: set of states
+        self._user_states = {}
+
+        # (method, route): count
+        self.requests = Counter()
+        # what happened: count, e.g. 'stopped', 'removed', 'deleted', 'slow_stop'
+        self.events = Counter()
+        # number of connections accepted
+        self.connections = 0
+
+        self.url = None
+        self._server = None
+
+        self.add_users(users)
+
+    # bookkeeping
+
+    def add_users(self, users):
+        """Add user models"""
+        for user in users:
+            name = user["name"]
+            if name in self.users:
+                raise ValueError(f"Duplicate user {name}")
+            self._index[name] = len(self._names)
+            self._names.append(name)
+            self.users[name] = user
+            self._user_states[name] = set()
+            self._update_states(name)
+
+    def _compute_states(self, user):
+        servers = user["servers"].values()
+        if not servers:
+            return {"inactive"}
+        states = {"active"}
+        if any(server["ready"] for server in servers):
+            states.add("ready")
+        return states
+
+    def _update_states(self, name):
+        """Update the state-filtered listings after a change to a user"""
+        index = self._index[name]
+        old_states = self._user_states[name]
+        if name in self.users:
+            new_states = self._compute_states(self.users[name])
+        else:
+            new_states = set()
+        for state in old_states - new_states:
+            indices = self._states[state]
+            del indices[bisect_left(indices, index)]
+        for state in new_states - old_states:
+            insort(self._states[state], index)
+        self._user_states[name] = new_states
+
+    def running_servers(self):
+        """Return the number of servers that are running (ready)"""
+        return sum(
+            1
+            for user in self.users.values()
+            for server in user["servers"].values()
+            if server["ready"]
+        )
+
+    def list_users(self, state=None):
+        """Return the names of users in listing order, optionally filtered by state"""
+        if state is None:
+            return [name for name in self._names if name in self.users]
+        return [self._names[i] for i in self._states[state]]
+
+    def stop_server(self, name, server_name, remove=False):
+        """Stop (and maybe remove) a server
+
+        Returns the HTTP status for the stop request.
+        """
+        user = self.users[name]
+        server = user["servers"].get(server_name)
+        if server is None:
+            # not running, nothing to do
+            return 204
+        if server["pending"] == "stop":
+            return 202
+        if self.slow_stop_rate and self.random.random() < self.slow_stop_rate:
+            server["pending"] = "stop"
+            server["ready"] = False
+            self._update_states(name)
+            self.events["slow_stop"] += 1
+            loop = asyncio.get_running_loop()
+            loop.call_later(
+                self.stop_delay, self._finish_stop, name, server_name, remove
+            )
+            return 202
+        self._finish_stop(name, server_name, remove)
+        return 204
+
+    def _finish_stop(self, name, server_name, remove=False):
+        user = self.users.get(name)
+        if user is None:
+            return
+        if user["servers"].pop(server_name, None) is not None:
+            self.events["stopped"] += 1
+            if remove:
+                self.events["removed"] += 1
+        if server_name == "":
+            user["server"] = None
+        self._update_states(name)
+
+    def delete_user(self, name):
+        """Delete a user, stopping their servers first"""
+        user = self.users[name]
+        for server in user["servers"].values():
+            if server["pending"] == "stop":
+                return 400
+        for server_name in list(user["servers"]):
+            self._finish_stop(name, server_name)
+        del self.users[name]
+        self._update_states(name)
+        self.events["deleted"] += 1
+        return 204
+
+    # serving
+
+    def make_app(self):
+        return web.Application(
+            [
+                (r"/hub/api/?", RootHandler),
+                (r"/hub/api/users", UsersHandler),
+                (r"/hub/api/users/([^/]+)", UserHandler),
+                (r"/hub/api/users/([^/]+)/server", ServerHandler),
+                (r"/hub/api/users/([^/]+)/servers/([^/]*)", NamedServerHandler),
+            ],
+            fake_hub=self,
+        )
+
+    async def start(self, ip="127.0.0.1", port=0):
+        """Start serving on the current event loop
+
+        Sets self.url to the API url, e.g. http://127.0.0.1:12345/hub/api
+        """
+        sockets = bind_sockets(port, ip)
+        port = sockets[0].getsockname()[1]
+        self._server = _CountingHTTPServer(self.make_app())
+        self._server.fake_hub = self
+        self._server.add_sockets(sockets)
+        self.url = f"http://{ip}:{port}/hub/api"
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None
+
+
+class FakeHubHandler(web.RequestHandler):
+    route = None
+
+    @property
+    def hub(self):
+        return self.settings["fake_hub"]
+
+    @property
+    def hub_version(self):
+        return V(self.hub.version)
+
+    async def prepare(self):
+        hub = self.hub
+        hub.requests[(self.request.method, self.route)] += 1
+        if hub.token:
+            auth = self.request.headers.get("Authorization", "")
+            if auth != f"token {hub.token}":
+                raise web.HTTPError(403)
+        latency = hub.latency() if callable(hub.latency) else hub.latency
+        if latency:
+            await asyncio.sleep(latency)
+        if hub.error_rate and hub.random.random() < hub.error_rate:
+            hub.events["error"] += 1
+            raise web.HTTPError(500, "Injected error")
+
+    def find_user(self, name):
+        name = unquote(name)
+        if name not in self.hub.users:
+            raise web.HTTPError(404)
+        return name
+
+    def write_json(self, model):
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(model))
+
+
+class RootHandler(FakeHubHandler):
+    route = "/"
+
+    def get(self):
+        self.write_json({"version": self.hub.version})
+
+
+class UsersHandler(FakeHubHandler):
+    route = "/users"
+
+    def get(self):
+        hub = self.hub
+        state = self.get_argument("state", None)
+        if state and self.hub_version < V("1.3"):
+            # state filter not supported, ignored
+            state = None
+        if state and state not in {"ready", "active", "inactive"}:
+            raise web.HTTPError(400, f"Unrecognized state filter: {state!r}")
+
+        if self.hub_version < V("2"):
+            # no pagination
+            names = hub.list_users(state)
+            self.write_json([hub.users[name] for name in names])
+            return
+
+        paginated = PAGINATION_MEDIA_TYPE in self.request.headers.get("Accept", "")
+        default_limit = hub.page_default_limit if paginated else hub.page_max_limit
+        offset = abs(int(self.get_argument("offset", 0)))
+        limit = abs(int(self.get_argument("limit", default_limit)))
+        limit = max(1, min(limit, hub.page_max_limit))
+
+        if state is None:
+            names = hub.list_users()
+            total = len(names)
+            page = names[offset : offset + limit]
+        else:
+            indices = hub._states[state]
+            total = len(indices)
+            page = [hub._names[i] for i in indices[offset : offset + limit]]
+        items = [hub.users[name] for name in page]
+        if not paginated:
+            self.write_json(items)
+            return
+
+        next_offset = offset + limit
+        next_info = None
+        if next_offset < total:
+            args = {"offset": next_offset, "limit": limit}
+            if state:
+                args["state"] = state
+            next_info = {
+                "offset": next_offset,
+                "limit": limit,
+                "url": url_concat(f"{hub.url}/users", args),
+            }
+        self.write_json(
+            {
+                "items": items,
+                "_pagination": {
+                    "offset": offset,
+                    "limit": limit,
+                    "total": total,
+                    "next": next_info,
+                },
+            }
+        )
+
+
+class UserHandler(FakeHubHandler):
+    route = "/users/:name"
+
+    def get(self, name):
+        name = self.find_user(name)
+        self.write_json(self.hub.users[name])
+
+    def delete(self, name):
+        name = self.find_user(name)
+        status = self.hub.delete_user(name)
+        if status >= 400:
+            raise web.HTTPError(
+                status, f"{name}'s server is in the process of stopping"
+            )
+        self.set_status(status)
+        self.finish()
+
+
+class ServerHandler(FakeHubHandler):
+    route = "/users/:name/server"
+
+    def delete(self, name):
+        name = self.find_user(name)
+        self.set_status(self.hub.stop_server(name, ""))
+        self.finish()
+
+
+class NamedServerHandler(FakeHubHandler):
+    route = "/users/:name/servers/:server_name"
+
+    def delete(self, name, server_name):
+        name = self.find_user(name)
+        server_name = unquote(server_name)
+        remove = False
+        if self.request.body:
+            remove = json.loads(self.request.body).get("remove", False)
+        self.set_status(self.hub.stop_server(name, server_name, remove=remove))
+        self.finish()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from jupyterhub_idle_culler.audit import AuditLog
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+async def test_buffered(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    audit = AuditLog(path, buffer_size=3)
+    audit.record(
+        "cull",
+        "alice",
+        "",
+        rule="inactive",
+        inactive=timedelta(seconds=700),
+        age=timedelta(hours=1),
+    )
+    audit.record("stop", "alice", "", status=204)
+    # not written yet
+    assert path.read_text() == ""
+    audit.record("keep", "bob")
+    # buffer full, flushing in the background
+    await audit._pending_flush
+    records = read_records(path)
+    assert [r["action"] for r in records] == ["cull", "stop", "keep"]
+    assert records[0]["rule"] == "inactive"
+    assert records[0]["inactive"] == 700
+    assert records[0]["age"] == 3600
+    assert records[1]["status"] == 204
+    assert records[2]["server"] is None
+
+    audit.record("delete", "bob", status=204)
+    audit.close()
+    assert len(read_records(path)) == 4
+
+
+async def test_rotate(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    audit = AuditLog(path, max_bytes=500, backup_count=2)
+    for i in range(20):
+        audit.record("keep", f"user-{i}")
+        await audit.flush()
+    audit.close()
+    assert path.stat().st_size <= 500
+    assert (tmp_path / "audit.jsonl.1").exists()
+    assert (tmp_path / "audit.jsonl.2").exists()
+    assert not (tmp_path / "audit.jsonl.3").exists()
+    assert read_records(path)[-1]["user"] == "user-19"
+
+
+async def test_close_while_flushing(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    audit = AuditLog(path)
+    write = audit._write
+    writes = []
+
+    def slow_write(records):
+        writes.append(records)
+        # the first write takes a while
+        if len(writes) == 1:
+            time.sleep(0.2)
+        write(records)
+
+    audit._write = slow_write
+    audit.record("keep", "alice")
+    flush = asyncio.ensure_future(audit.flush())
+    # let the flush start writing
+    await asyncio.sleep(0.05)
+    audit.record("keep", "bob")
+    audit.close()
+    await flush
+    assert [r["user"] for r in read_records(path)] == ["alice", "bob"]
@@ -0,0 +1,78 @@
+import os
+from unittest import mock
+
+import pytest
+
+from jupyterhub_idle_culler.client import (
+    HTTPClientCache,
+    internal_cert_files,
+    make_http_client,
+)
+
+
+def test_client_cache_reloads_certs(tmp_path):
+    cert_files = internal_cert_files(str(tmp_path))
+    for path in cert_files:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write("not really a certificate")
+
+    with mock.patch(
+        "jupyterhub_idle_culler.client.make_http_client",
+        side_effect=lambda **kwargs: mock.Mock(),
+    ) as make_http_client:
+        cache = HTTPClientCache(ssl_enabled=True, internal_certs_location=str(tmp_path))
+        client = cache.get()
+        assert cache.get() is client
+        assert make_http_client.call_count == 1
+
+        # rotate the certificate
+        stat = os.stat(cert_files[1])
+        os.utime(cert_files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        new_client = cache.get()
+        assert new_client is not client
+        client.close.assert_called_once()
+        assert cache.get() is new_client
+        assert make_http_client.call_count == 2
+
+        cache.close()
+        new_client.close.assert_called_once()
+
+
+def test_client_cache_without_ssl():
+    with mock.patch(
+        "jupyterhub_idle_culler.client.make_http_client",
+        side_effect=lambda **kwargs: mock.Mock(),
+    ) as make_http_client:
+        cache = HTTPClientCache(ssl_enabled=False)
+        assert cache.get() is cache.get()
+        assert make_http_client.call_count == 1
+
+
+def test_warn_high_concurrency_without_pycurl(caplog):
+    with mock.patch("jupyterhub_idle_culler.client.pycurl", None), mock.patch(
+        "jupyterhub_idle_culler.client._curl_import_error",
+        ImportError("No module named 'pycurl'"),
+        create=True,
+    ):
+        make_http_client(max_clients=10).close()
+        assert "new connection" not in caplog.text
+        make_http_client(max_clients=50).close()
+        assert "up to 50 concurrent requests" in caplog.text
+
+
+def test_client_cache_certs_appear_later(tmp_path):
+    certipy = pytest.importorskip("certipy")
+    cache = HTTPClientCache(
+        ssl_enabled=True, internal_certs_location=str(tmp_path), curl=False
+    )
+    with pytest.raises(OSError):
+        cache.get()
+
+    # certificates created after the culler started
+    certs = certipy.Certipy(store_dir=str(tmp_path))
+    certs.create_ca("hub-ca")
+    certs.create_signed_pair("hub-internal", "hub-ca")
+    client = cache.get()
+    assert client is cache.get()
+    cache.close()
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from jupyterhub_idle_culler.concurrency import AdaptiveLimiter
+
+
+async def test_adaptive_limiter_limits():
+    limiter = AdaptiveLimiter(2, min_limit=1, max_limit=2)
+    await limiter.acquire()
+    await limiter.acquire()
+    third = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not third.done()
+    limiter.release(time.perf_counter(), 0.01)
+    await asyncio.wait_for(third, timeout=1)
+    assert limiter.in_flight == 2
+
+
+async def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(4, min_limit=2, max_limit=8, latency_target=1)
+    # about a round of successful requests raises the limit by one
+    for _ in range(5):
+        await limiter.acquire()
+        limiter.release(time.perf_counter(), 0.01)
+    assert limiter.limit == 5
+
+    # concurrent failures only decrease the limit once
+    start = time.perf_counter()
+    for _ in range(3):
+        await limiter.acquire()
+    for _ in range(3):
+        limiter.release(start, 0.01, overloaded=True)
+    assert limiter.limit == 2
+
+    # slow responses count as overloaded, but never go below the minimum
+    await limiter.acquire()
+    limiter.release(time.perf_counter(), 2)
+    assert limiter.limit == 2
+
+    for _ in range(100):
+        await limiter.acquire()
+        limiter.release(time.perf_counter(), 0.01)
+    assert limiter.limit == 8
@@ -0,0 +1,59 @@
+import asyncio
+
+from tornado.ioloop import PeriodicCallback
+
+from jupyterhub_idle_culler.cycles import CycleRunner
+
+
+def make_cull(duration):
+    calls = []
+
+    async def cull():
+        calls.append(None)
+        await asyncio.sleep(duration)
+
+    return cull, calls
+
+
+async def test_skip_overlapping_cycles():
+    cull, calls = make_cull(0.1)
+    runner = CycleRunner(cull, 0.01)
+    first = asyncio.ensure_future(runner.run())
+    await asyncio.sleep(0)
+    assert runner.running
+    # ticks while the cycle is running are skipped
+    await runner.run()
+    await runner.run()
+    await first
+    assert len(calls) == 1
+    assert not runner.running
+
+
+async def test_coalesce_overlapping_cycles():
+    cull, calls = make_cull(0.1)
+    runner = CycleRunner(cull, 0.01, overlap="coalesce")
+    first = asyncio.ensure_future(runner.run())
+    await asyncio.sleep(0)
+    # ticks while the cycle is running are coalesced into one more cycle
+    await runner.run()
+    await runner.run()
+    await first
+    assert len(calls) == 2
+
+
+async def test_cycle_errors_are_logged():
+    async def cull():
+        raise RuntimeError("oops")
+
+    runner = CycleRunner(cull, 1)
+    await runner.run()
+    assert not runner.running
+
+
+async def test_stretch_interval():
+    cull, calls = make_cull(0.1)
+    runner = CycleRunner(cull, 0.01, stretch_factor=20)
+    runner._periodic = PeriodicCallback(runner.run, 10)
+    await runner.run()
+    # 20 times the last cycle's duration
+    assert runner._periodic.callback_time >= 2000
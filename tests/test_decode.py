@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from jupyterhub_idle_culler.decode import BACKENDS, UserDecoder
+
+user = {
+    "kind": "user",
+    "name": "alice",
+    "admin": False,
+    "groups": ["a", "b"],
+    "roles": ["user"],
+    "created": "2024-01-01T00:00:00Z",
+    "last_activity": "2024-01-02T00:00:00Z",
+    "pending": None,
+    "server": "/user/alice/",
+    "servers": {
+        "": {
+            "name": "",
+            "last_activity": "2024-01-02T00:00:00Z",
+            "started": "2024-01-01T12:00:00Z",
+            "pending": None,
+            "ready": True,
+            "stopped": False,
+            "url": "/user/alice/",
+            "user_options": {"profile": "small"},
+            "state": {"pod_name": "jupyter-alice"},
+        },
+    },
+}
+
+compact_user = {
+    "name": "alice",
+    "admin": False,
+    "created": "2024-01-01T00:00:00Z",
+    "last_activity": "2024-01-02T00:00:00Z",
+    "pending": None,
+    "server": "/user/alice/",
+    "servers": {
+        "": {
+            "name": "",
+            "last_activity": "2024-01-02T00:00:00Z",
+            "started": "2024-01-01T12:00:00Z",
+            "pending": None,
+            "ready": True,
+            "stopped": False,
+            "url": "/user/alice/",
+        },
+    },
+}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    return request.param
+
+
+def test_decode_user(backend):
+    body = json.dumps(user).encode("utf8")
+    assert UserDecoder(backend, compact=False).decode_user(body) == user
+    assert UserDecoder(backend).decode_user(body) == compact_user
+
+
+def test_decode_users(backend):
+    decoder = UserDecoder(backend)
+    pagination = {"offset": 0, "limit": 1, "total": 2, "next": None}
+    body = json.dumps({"items": [user], "_pagination": pagination}).encode("utf8")
+    assert decoder.decode_users(body) == {
+        "items": [compact_user],
+        "_pagination": pagination,
+    }
+    # pre-2.0 user lists aren't paginated
+    body = json.dumps([user, user]).encode("utf8")
+    assert decoder.decode_users(body) == [compact_user, compact_user]
+
+
+def test_decode_extra_server_fields(backend):
+    decoder = UserDecoder(backend, extra_server_fields=["state"])
+    decoded = decoder.decode_user(json.dumps(user).encode("utf8"))
+    assert decoded["servers"][""]["state"] == {"pod_name": "jupyter-alice"}
+    assert "user_options" not in decoded["servers"][""]
+
+
+def test_decode_extra_user_fields(backend):
+    decoder = UserDecoder(backend, extra_user_fields=["groups"])
+    decoded = decoder.decode_user(json.dumps(user).encode("utf8"))
+    assert decoded["groups"] == user["groups"]
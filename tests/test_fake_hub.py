@@ -0,0 +1,905 @@
+"""Tests running cull_idle against the in-process FakeHub"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from unittest import mock
+
+import pytest
+from fake_hub import synthetic_users
+from tornado.httpclient import HTTPClientError
+from tornado.log import app_log
+
+from jupyterhub_idle_culler import (
+    IdleCuller,
+    cull_idle,
+    default_cull_arbiter,
+    make_http_client,
+    parse_date,
+)
+from jupyterhub_idle_culler.audit import AuditLog
+from jupyterhub_idle_culler.concurrency import AdaptiveLimiter
+from jupyterhub_idle_culler.decode import UserDecoder
+from jupyterhub_idle_culler.policy import CullPolicy
+from jupyterhub_idle_culler.ratelimit import TokenBucket
+from jupyterhub_idle_culler.recording import ApiRecorder, ApiReplay
+from jupyterhub_idle_culler.resume import ResumePoint
+from jupyterhub_idle_culler.rolling import RollingCursor
+from jupyterhub_idle_culler.scheduler import DeadlineScheduler
+from jupyterhub_idle_culler.tracing import Tracer
+
+
+def count_idle_servers(hub, inactive_limit, now):
+    idle = 0
+    for user in hub.users.values():
+        for server in user["servers"].values():
+            if (now - parse_date(server["last_activity"])).total_seconds() >= (
+                inactive_limit
+            ):
+                idle += 1
+    return idle
+
+
+@pytest.mark.parametrize(
+    "version, workers",
+    [
+        ("5.0.0", 0),
+        ("5.0.0", 4),
+        # no pagination
+        ("1.5.0", 0),
+        # no pagination or state filter
+        ("1.0.0", 4),
+    ],
+)
+async def test_cull_idle(fake_hub, version, workers):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(120, now=now, running=0.8, max_inactive=1200),
+        version=version,
+        page_default_limit=25,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    running = hub.running_servers()
+    assert 0 < idle < running
+
+    await cull_idle(
+        hub.url, "token", inactive_limit=600, logger=app_log, workers=workers
+    )
+    assert hub.events["stopped"] == idle
+    assert hub.running_servers() == running - idle
+    if version == "5.0.0":
+        # one page in flight ahead of the one being handled
+        assert hub.requests[("GET", "/users")] >= 96 // 25
+
+
+async def test_cull_users(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(50, now=now, running=0.5, max_inactive=1200, max_age=1200),
+        page_default_limit=10,
+    )
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        cull_users=True,
+        workers=4,
+    )
+    assert hub.events["deleted"] > 0
+    assert hub.events["deleted"] + len(hub.users) == 50
+
+
+async def test_slow_to_stop(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(10, now=now, running=1, max_inactive=60),
+        slow_stop_rate=1,
+        stop_delay=60,
+    )
+    # time travel into the future, everyone should be culled
+    with mock.patch(
+        "jupyterhub_idle_culler.utcnow", lambda: now + timedelta(seconds=600)
+    ):
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=300,
+            logger=app_log,
+            cull_users=True,
+        )
+    # every server is stopping, so no user has been deleted
+    assert hub.events["slow_stop"] == 10
+    assert hub.events["deleted"] == 0
+    assert len(hub.list_users("active")) == 10
+    assert hub.list_users("ready") == []
+
+
+async def test_metrics(fake_hub):
+    prometheus_client = pytest.importorskip("prometheus_client")
+    from tornado.httpclient import AsyncHTTPClient
+    from tornado.httpserver import HTTPServer
+    from tornado.netutil import bind_sockets
+
+    from jupyterhub_idle_culler.metrics import make_metrics_app
+
+    def sample(name, **labels):
+        return (
+            prometheus_client.REGISTRY.get_sample_value(
+                f"jupyterhub_idle_culler_{name}", labels
+            )
+            or 0
+        )
+
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(30, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    users_before = sample("users_scanned_total")
+    culled_before = sample("servers_culled_total", server_type="default")
+    pages_before = sample(
+        "hub_request_duration_seconds_count",
+        method="GET",
+        endpoint="/users",
+        code="200",
+    )
+    await cull_idle(hub.url, "token", inactive_limit=600, logger=app_log)
+
+    assert sample("users_scanned_total") - users_before == 30
+    assert sample("servers_culled_total", server_type="default") - culled_before == idle
+    assert (
+        sample(
+            "hub_request_duration_seconds_count",
+            method="GET",
+            endpoint="/users",
+            code="200",
+        )
+        - pages_before
+        == 3
+    )
+    assert sample("cycle_errors") == 0
+
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    server = HTTPServer(make_metrics_app())
+    server.add_sockets(sockets)
+    try:
+        resp = await AsyncHTTPClient().fetch(f"http://127.0.0.1:{port}/metrics")
+    finally:
+        server.stop()
+    assert b"jupyterhub_idle_culler_cycle_duration_seconds" in resp.body
+
+
+async def test_deadline_rechecks(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(20, now=now, running=1, max_inactive=300),
+        page_default_limit=10,
+    )
+    scheduler = DeadlineScheduler()
+    # full scan, nobody is idle yet
+    await cull_idle(
+        hub.url, "token", inactive_limit=600, logger=app_log, scheduler=scheduler
+    )
+    assert hub.events["stopped"] == 0
+    assert len(scheduler) == 20
+    # every server becomes cullable within 600 seconds
+    first = scheduler.next_deadline()
+    assert now + timedelta(seconds=300) <= first <= now + timedelta(seconds=600)
+
+    later = now + timedelta(seconds=450)
+    due = scheduler.pop_due(later)
+    assert 0 < len(due) < 20
+    with mock.patch("jupyterhub_idle_culler.utcnow", lambda: later):
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            scheduler=scheduler,
+            user_names=due,
+        )
+    # only the due users were fetched, and they were all culled
+    assert hub.requests[("GET", "/users/:name")] == len(due)
+    assert hub.events["stopped"] == len(due)
+    assert len(scheduler) == 20 - len(due)
+
+
+async def test_deadline_arbiter_declines(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(20, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+    )
+    assert count_idle_servers(hub, 600, now)
+    app = IdleCuller(full_scan_every=3600)
+    cull = app._make_deadline_cull(
+        partial(
+            cull_idle,
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_arbiter=lambda **kwargs: False,
+        )
+    )
+    # full scan, then a tick
+    await cull()
+    await cull()
+    assert hub.events["stopped"] == 0
+    # servers the arbiter kept past the timeout wait for the next full scan,
+    # instead of being rechecked every tick
+    assert hub.requests[("GET", "/users/:name")] == 0
+
+
+async def test_deadline_recheck_errors(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(20, now=now, running=1, max_inactive=300),
+        page_default_limit=10,
+    )
+    scheduler = DeadlineScheduler()
+    await cull_idle(
+        hub.url, "token", inactive_limit=600, logger=app_log, scheduler=scheduler
+    )
+    later = now + timedelta(seconds=450)
+    due = scheduler.pop_due(later)
+    assert due
+    with mock.patch("jupyterhub_idle_culler.utcnow", lambda: later), mock.patch.object(
+        hub, "stop_server", lambda *args, **kwargs: 500
+    ):
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            scheduler=scheduler,
+            user_names=due,
+        )
+    assert hub.events["stopped"] == 0
+    # users whose recheck failed are due again right away
+    assert sorted(scheduler.pop_due(later)) == sorted(due)
+
+
+async def test_adaptive_concurrency(fake_hub):
+    hub = await fake_hub(
+        synthetic_users(200, running=1, max_inactive=1200),
+        page_default_limit=10,
+        error_rate=1,
+    )
+    limiter = AdaptiveLimiter(10, min_limit=2, max_limit=20)
+    cull = partial(
+        cull_idle,
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        limiter=limiter,
+        workers=10,
+    )
+    with pytest.raises(HTTPClientError):
+        await cull()
+    assert hub.events["error"]
+    assert limiter.limit < 10
+    assert limiter.in_flight == 0
+
+    # the limit recovers once the Hub copes again
+    hub.error_rate = 0
+    await cull()
+    assert hub.events["stopped"]
+    assert limiter.limit >= 10
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("workers", [0, 4])
+async def test_api_page_concurrency(fake_hub, workers):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(95, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        api_page_concurrency=4,
+        workers=workers,
+    )
+    assert hub.requests[("GET", "/users")] == 10
+    assert hub.events["stopped"] == idle
+
+
+async def test_follow_up_slow_to_stop(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(10, now=now, running=1, max_inactive=60),
+        slow_stop_rate=1,
+        stop_delay=0.2,
+    )
+    with mock.patch(
+        "jupyterhub_idle_culler.utcnow", lambda: now + timedelta(seconds=600)
+    ), mock.patch("jupyterhub_idle_culler.SLOW_STOP_POLL_MIN_INTERVAL", 0.1):
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=300,
+            logger=app_log,
+            cull_users=True,
+            slow_stop_timeout=10,
+        )
+    # servers were slow to stop, but users were culled in the same cycle
+    assert hub.events["slow_stop"] == 10
+    assert hub.events["stopped"] == 10
+    assert hub.events["deleted"] == 10
+    assert hub.requests[("GET", "/users/:name")] >= 10
+
+
+@pytest.mark.parametrize("workers", [0, 4])
+async def test_cull_arbiter_batch(fake_hub, workers):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(60, now=now, running=1, max_inactive=60),
+        page_default_limit=20,
+    )
+    batches = []
+
+    async def cull_arbiter_batch(candidates):
+        batches.append(candidates)
+        # decide only about even-numbered users
+        return {
+            (c["user"]["name"], c["server_name"]): True
+            for c in candidates
+            if int(c["user"]["name"].rsplit("-", 1)[1]) % 2 == 0
+        }
+
+    cull_arbiter = mock.Mock(return_value=False)
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        workers=workers,
+        cull_arbiter=cull_arbiter,
+        cull_arbiter_batch=cull_arbiter_batch,
+    )
+    # one call per page
+    assert [len(candidates) for candidates in batches] == [20, 20, 20]
+    assert hub.events["stopped"] == 30
+    # servers without a batch decision use the per-server arbiter
+    assert cull_arbiter.call_count == 30
+
+
+@pytest.mark.parametrize("executor_class", [ThreadPoolExecutor, ProcessPoolExecutor])
+async def test_arbiter_executor(fake_hub, executor_class):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(20, now=now, running=1, max_inactive=1200))
+    idle = count_idle_servers(hub, 600, now)
+    with executor_class(2) as executor:
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_arbiter=default_cull_arbiter,
+            arbiter_executor=executor,
+        )
+    assert hub.events["stopped"] == idle
+
+
+class AsyncKeepArbiter:
+    """An async cull arbiter that isn't a coroutine function"""
+
+    async def __call__(self, **kwargs):
+        await asyncio.sleep(0)
+        return False
+
+
+def returns_coroutine_arbiter(**kwargs):
+    return AsyncKeepArbiter()(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "cull_arbiter", [AsyncKeepArbiter(), returns_coroutine_arbiter]
+)
+async def test_arbiter_executor_async(fake_hub, cull_arbiter):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(20, now=now, running=1, max_inactive=1200))
+    assert count_idle_servers(hub, 600, now)
+    with ThreadPoolExecutor(2) as executor:
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_arbiter=cull_arbiter,
+            arbiter_executor=executor,
+        )
+    # the arbiter's decisions are awaited, not taken as truthy coroutines
+    assert hub.events["stopped"] == 0
+
+
+def slow_cull_arbiter(**kwargs):
+    time.sleep(0.5)
+    return False
+
+
+@pytest.mark.parametrize("timeout_cull", [True, False])
+async def test_arbiter_timeout(fake_hub, timeout_cull):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(10, now=now, running=1, max_inactive=60))
+    with ThreadPoolExecutor(10) as executor:
+        tic = time.perf_counter()
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_arbiter=slow_cull_arbiter,
+            arbiter_executor=executor,
+            arbiter_timeout=0.1,
+            arbiter_timeout_cull=timeout_cull,
+            workers=10,
+        )
+        # arbiters ran concurrently, and weren't waited for
+        assert time.perf_counter() - tic < 0.5
+    assert hub.events["stopped"] == (10 if timeout_cull else 0)
+
+
+async def test_persistent_client(fake_hub):
+    pytest.importorskip("pycurl")
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(100, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    client = make_http_client(max_clients=5, curl=True)
+    try:
+        for _ in range(2):
+            await cull_idle(
+                hub.url,
+                "token",
+                inactive_limit=600,
+                logger=app_log,
+                concurrency=5,
+                client=client,
+            )
+    finally:
+        client.close()
+    assert hub.events["stopped"] == idle
+    # connections are kept alive across requests and cycles
+    assert sum(hub.requests.values()) > idle
+    assert hub.connections <= 5
+
+
+@pytest.mark.parametrize("backend", ["msgspec", "orjson", "json"])
+async def test_compact_user_models(fake_hub, backend):
+    if backend != "json":
+        pytest.importorskip(backend)
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(30, now=now, running=1, max_inactive=1200))
+    idle = count_idle_servers(hub, 600, now)
+    servers = []
+
+    def cull_arbiter(server, **kwargs):
+        servers.append(server)
+        return default_cull_arbiter(server=server, **kwargs)
+
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        cull_arbiter=cull_arbiter,
+        decoder=UserDecoder(backend, extra_server_fields=["state"]),
+    )
+    assert hub.events["stopped"] == idle
+    assert len(servers) == 30
+    for server in servers:
+        assert "state" in server
+        assert "user_options" not in server
+
+
+async def test_shards(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(60, now=now, running=1, max_inactive=1200))
+    idle = count_idle_servers(hub, 600, now)
+    stopped = []
+    for shard_index in range(3):
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            shard_count=3,
+            shard_index=shard_index,
+        )
+        stopped.append(hub.events["stopped"] - sum(stopped))
+    # each shard culls some of the idle servers, and together all of them
+    assert all(stopped)
+    assert sum(stopped) == idle
+
+
+async def test_cycle_budgets(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(20, now=now, running=1, max_inactive=60))
+    with mock.patch(
+        "jupyterhub_idle_culler.utcnow", lambda: now + timedelta(seconds=600)
+    ):
+        for stopped in (8, 16, 20):
+            await cull_idle(
+                hub.url,
+                "token",
+                inactive_limit=300,
+                logger=app_log,
+                cull_users=True,
+                cycle_budgets={"stop": 8, "delete": 3},
+                rate_limits={"stop": TokenBucket(1000)},
+            )
+            # the rest is deferred to the next cycle
+            assert hub.events["stopped"] == stopped
+    # at most 3 user deletions per cycle
+    assert hub.events["deleted"] == 9
+
+
+@pytest.mark.parametrize("workers", [0, 4])
+async def test_cull_priority(fake_hub, workers):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(40, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+    )
+    idle = {
+        name: now - parse_date(user["servers"][""]["last_activity"])
+        for name, user in hub.users.items()
+    }
+    most_idle = sorted(idle, key=idle.get, reverse=True)[:5]
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        workers=workers,
+        cycle_budgets={"stop": 5},
+        cull_priority_by="inactive",
+    )
+    assert hub.events["stopped"] == 5
+    still_running = {name for name, user in hub.users.items() if user["servers"]}
+    assert still_running.isdisjoint(most_idle)
+    assert len(still_running) == 35
+
+
+async def test_cull_priority_score(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(20, now=now, running=1, max_inactive=60))
+
+    def cull_arbiter(inactive, inactive_limit, server):
+        # higher numbered users first
+        return int(server["url"].strip("/").rsplit("-", 1)[1]) + 1
+
+    with mock.patch(
+        "jupyterhub_idle_culler.utcnow", lambda: now + timedelta(seconds=600)
+    ):
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=300,
+            logger=app_log,
+            cull_arbiter=cull_arbiter,
+            cycle_budgets={"stop": 5},
+            cull_priority_by="score",
+        )
+    still_running = {name for name, user in hub.users.items() if user["servers"]}
+    assert still_running == {f"user-{i}" for i in range(15)}
+
+
+async def test_record_replay(fake_hub, tmp_path):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(50, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+        latency=0.01,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    path = tmp_path / "recording.jsonl"
+    recorder = ApiRecorder(path)
+    client = make_http_client(max_clients=10, curl=False)
+    try:
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_users=True,
+            client=recorder.wrap(client),
+        )
+    finally:
+        client.close()
+        recorder.close()
+    assert hub.events["stopped"] == idle
+    assert "token" not in path.read_text()
+
+    replay = ApiReplay(path, latency_scale=0)
+    assert len(replay) == 1
+    assert replay.url == hub.url
+    client = replay.client(0)
+    # replayed later, as of the time it was recorded
+    await cull_idle(
+        replay.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        cull_users=True,
+        client=client,
+        now=replay.now(0),
+    )
+    assert client.unmatched == 0
+    deletes = sum(
+        n for (method, url), n in client.requests.items() if method == "DELETE"
+    )
+    assert deletes == idle + hub.events["deleted"]
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_replay_shuts_down_arbiter_executor(tmp_path, executor):
+    path = tmp_path / "recording.jsonl"
+    path.write_text("")
+    app = IdleCuller(replay_api=str(path), arbiter_executor=executor)
+    app.start()
+    # shut down, no longer taking work
+    with pytest.raises(RuntimeError):
+        app._arbiter_executor.submit(print)
+
+
+def test_start_without_certs(tmp_path):
+    path = tmp_path / "recording.jsonl"
+    path.write_text("")
+    app = IdleCuller(
+        replay_api=str(path),
+        ssl_enabled=True,
+        internal_certs_location=str(tmp_path / "internal-ssl"),
+    )
+    with mock.patch("jupyterhub_idle_culler.client.pycurl", None), mock.patch(
+        "jupyterhub_idle_culler.client._curl_import_error",
+        ImportError("No module named 'pycurl'"),
+        create=True,
+    ):
+        # certificates that aren't there yet are loaded by later cycles
+        app.start()
+
+
+async def test_tracing(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(30, now=now, running=1, max_inactive=1200),
+        page_default_limit=10,
+    )
+    idle = count_idle_servers(hub, 600, now)
+
+    class ListExporter:
+        payloads = []
+
+        async def export(self, payload):
+            self.payloads.append(payload)
+
+    tracer = Tracer(ListExporter())
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        workers=4,
+        tracer=tracer,
+    )
+    spans = tracer.flush()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span["name"], []).append(span)
+    (cycle,) = by_name["cull_cycle"]
+    assert all(span["traceId"] == cycle["traceId"] for span in spans)
+    assert len(by_name["GET /"]) == 1
+    assert by_name["GET /"][0]["parentSpanId"] == cycle["spanId"]
+    assert len(by_name["GET /users"]) == hub.requests[("GET", "/users")]
+    assert len(by_name["handle_user"]) == 30
+    assert len(by_name["cull_arbiter"]) == 30
+    assert len(by_name["stop_server"]) == idle
+    handle_user_ids = {span["spanId"] for span in by_name["handle_user"]}
+    stop_server_ids = {span["spanId"] for span in by_name["stop_server"]}
+    assert {span["parentSpanId"] for span in by_name["stop_server"]} <= (
+        handle_user_ids
+    )
+    deletes = by_name["DELETE /users/:name/server"]
+    assert len(deletes) == idle
+    assert {span["parentSpanId"] for span in deletes} == stop_server_ids
+    attributes = {a["key"]: a["value"] for a in deletes[0]["attributes"]}
+    assert attributes["http.response.status_code"] == {"intValue": "204"}
+    assert "culler.wait_seconds" in attributes
+
+
+async def test_audit_log(fake_hub, tmp_path):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(synthetic_users(30, now=now, running=1, max_inactive=1200))
+    idle = count_idle_servers(hub, 600, now)
+    path = tmp_path / "audit.jsonl"
+    audit = AuditLog(path, buffer_size=10)
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=600,
+        logger=app_log,
+        cull_users=True,
+        workers=4,
+        audit=audit,
+    )
+    audit.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    actions = {}
+    for record in records:
+        actions.setdefault(record["action"], []).append(record)
+    assert len(actions["stop"]) == idle
+    assert {record["status"] for record in actions["stop"]} == {204}
+    assert len(actions["delete"]) == hub.events["deleted"]
+    server_decisions = [r for r in records if r["server"] is not None]
+    assert len([r for r in server_decisions if r["action"] == "cull"]) == idle
+    assert len([r for r in server_decisions if r["action"] == "keep"]) == 30 - idle
+    for record in server_decisions:
+        if record["action"] == "cull":
+            assert record["rule"] == "inactive"
+            assert record["inactive"] >= 600
+
+
+async def test_cull_policy(fake_hub):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(
+            40,
+            now=now,
+            running=1,
+            max_inactive=1200,
+            profiles=["gpu", "cpu"],
+            groups=["staff", "students"],
+        )
+    )
+    policy = CullPolicy(
+        [
+            {"groups": ["staff"], "exempt": True},
+            {"profiles": ["gpu"], "timeout": 300},
+        ],
+        timeout=900,
+    )
+    expected = set()
+    for user in hub.users.values():
+        if "staff" in user["groups"]:
+            continue
+        server = user["servers"][""]
+        timeout = 300 if server["state"]["profile_name"] == "gpu" else 900
+        inactive = now - parse_date(server["last_activity"])
+        if inactive.total_seconds() >= timeout:
+            expected.add(user["name"])
+    assert expected
+
+    await cull_idle(
+        hub.url,
+        "token",
+        inactive_limit=900,
+        logger=app_log,
+        decoder=UserDecoder(
+            extra_user_fields=["groups"], extra_server_fields=["state"]
+        ),
+        policy=policy,
+    )
+    stopped = {name for name, user in hub.users.items() if not user["servers"].get("")}
+    assert stopped == expected
+
+
+@pytest.mark.parametrize(
+    "version, cull_users", [("5.0.0", False), ("5.0.0", True), ("1.5.0", False)]
+)
+async def test_rolling_scan(fake_hub, version, cull_users):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(100, now=now, running=1, max_inactive=1200),
+        version=version,
+        page_default_limit=7,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    cursor = RollingCursor(5)
+    ticks = 0
+    while not cursor.passes:
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_users=cull_users,
+            cursor=cursor,
+        )
+        ticks += 1
+        assert ticks <= 10
+        if ticks == 1:
+            # the first slice is a single page (or slice, without pagination),
+            # to see how many users there are
+            assert hub.events["stopped"] <= 20
+    # every user checked once per pass, in slices of about 20 users
+    assert hub.events["stopped"] == idle
+    assert 5 <= ticks <= 8
+    if version == "5.0.0" and not cull_users:
+        assert hub.requests[("GET", "/users")] == ticks
+
+
+@pytest.mark.parametrize("cull_users, workers", [(False, 0), (True, 0), (False, 4)])
+async def test_cycle_time_budget(fake_hub, tmp_path, cull_users, workers):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(100, now=now, running=0.8, max_inactive=1200),
+        page_default_limit=7,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    state_file = tmp_path / "cycle-state.json"
+    cycles = 0
+    while True:
+        # a new ResumePoint each cycle, as after a restart
+        resume = ResumePoint(str(state_file))
+        # out of time as soon as the first page arrives
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            cull_users=cull_users,
+            workers=workers,
+            time_budget=1e-6,
+            resume=resume,
+        )
+        cycles += 1
+        assert cycles <= 30
+        if cycles == 1:
+            assert hub.requests[("GET", "/users")] == 1
+            assert hub.events["stopped"] <= 7
+        if resume.get() is None:
+            break
+    # every user checked once, a page per cycle
+    assert not state_file.exists()
+    assert hub.events["stopped"] == idle
+    assert cycles == hub.requests[("GET", "/users")]
+
+
+@pytest.mark.parametrize("time_budget", [1000, 0.1])
+async def test_cycle_time_budget_streaming(fake_hub, time_budget):
+    now = datetime.now(timezone.utc)
+    hub = await fake_hub(
+        synthetic_users(200, now=now, running=0.8, max_inactive=1200),
+        page_default_limit=10,
+        latency=0.02,
+    )
+    idle = count_idle_servers(hub, 600, now)
+    resume = ResumePoint()
+    cycles = 0
+    while True:
+        await cull_idle(
+            hub.url,
+            "token",
+            inactive_limit=600,
+            logger=app_log,
+            workers=4,
+            time_budget=time_budget,
+            resume=resume,
+        )
+        cycles += 1
+        assert cycles <= 30
+        point = resume.get()
+        if point is None:
+            break
+        # pages are fetched from the end, the users left are in the middle
+        assert point[2] is not None
+    if time_budget == 1000:
+        assert cycles == 1
+    # culling while listing users didn't make any get skipped
+    assert hub.events["stopped"] == idle
@@ -1,11 +1,12 @@
 import sys
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from subprocess import check_output
 from unittest import mock
 
+import pytest
 from tornado.log import app_log
 
-from jupyterhub_idle_culler import utcnow
+from jupyterhub_idle_culler import parse_date, utcnow
 
 
 async def test_alive(hub_url, hub, admin_request):
@@ -72,3 +73,57 @@ async def test_async_custom_cull_arbiter(cull_idle, start_users, admin_request):
 
 def test_help():
     check_output([sys.executable, "-m", "jupyterhub_idle_culler", "--help"])
+
+
+async def test_cull_idle_workers(cull_idle, start_users, admin_request):
+    assert await count_active_users(admin_request) == 0
+    await start_users(3)
+    assert await count_active_users(admin_request) == 3
+    await cull_idle(inactive_limit=300, logger=app_log, workers=2)
+    # no change
+    assert await count_active_users(admin_request) == 3
+
+    # time travel into the future, everyone should be culled
+    # by the streaming workers, even with users culled
+    # while later pages are still to be fetched
+    with mock.patch(
+        "jupyterhub_idle_culler.utcnow", lambda: utcnow() + timedelta(seconds=600)
+    ):
+        await cull_idle(inactive_limit=300, logger=app_log, workers=2, api_page_size=1)
+    assert await count_active_users(admin_request) == 0
+
+
+@pytest.mark.parametrize(
+    "date_string, expected",
+    [
+        (
+            "2024-01-02T03:04:05.678901Z",
+            datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+        ),
+        ("2024-01-02T03:04:05Z", datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)),
+        (
+            "2024-01-02T03:04:05.678901+00:00",
+            datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+        ),
+        (
+            "2024-01-02T05:04:05+02:00",
+            datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        ),
+        # naive, assumed utc
+        (
+            "2024-01-02T03:04:05.678",
+            datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc),
+        ),
+        # not ISO 8601, parsed by dateutil
+        (
+            "Jan 2 2024 03:04:05 UTC",
+            datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        ),
+    ],
+)
+def test_parse_date(date_string, expected):
+    dt = parse_date(date_string)
+    assert dt == expected
+    assert dt.tzinfo is not None
+    # cached
+    assert parse_date(date_string) is dt
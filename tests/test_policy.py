@@ -0,0 +1,87 @@
+import pytest
+
+from jupyterhub_idle_culler.policy import CullPolicy, Limits
+from jupyterhub_idle_culler.records import ServerRecord, UserRecord
+
+rules = [
+    {"groups": ["staff"], "exempt": True},
+    {"users": ["alice"], "user_pattern": "student-.*", "timeout": 1800},
+    {"profiles": ["gpu"], "timeout": 900, "max_age": 3600},
+    {"servers": ["scratch"], "timeout": 60},
+]
+
+
+def user(name, groups=(), **servers):
+    return UserRecord(
+        name,
+        groups=groups,
+        servers={
+            server_name: ServerRecord(server_name, profile=profile)
+            for server_name, profile in servers.items()
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "record, server_name, limits",
+    [
+        # no rule matches
+        (user("bob", default=None), "default", Limits(600, 0, False)),
+        (user("bob", ["staff"], default=None), "default", Limits(600, 0, True)),
+        (
+            user("bob", ["other", "staff"], default="gpu"),
+            "default",
+            Limits(600, 0, True),
+        ),
+        (user("alice", default="gpu"), "default", Limits(1800, 0, False)),
+        (user("student-1", default=None), "default", Limits(1800, 0, False)),
+        # patterns match whole names
+        (user("not-student-1", default=None), "default", Limits(600, 0, False)),
+        (user("bob", default="gpu"), "default", Limits(900, 3600, False)),
+        (user("bob", default="cpu"), "default", Limits(600, 0, False)),
+        (user("bob", scratch=None), "scratch", Limits(60, 0, False)),
+        (user("bob", scratch="gpu"), "scratch", Limits(900, 3600, False)),
+    ],
+)
+def test_for_server(record, server_name, limits):
+    policy = CullPolicy(rules, timeout=600)
+    assert policy.for_server(record, record.servers[server_name]) == limits
+
+
+@pytest.mark.parametrize(
+    "record, limits",
+    [
+        # rules matching servers or profiles don't apply to users
+        (user("bob"), Limits(10, 0, False)),
+        (user("bob", ["staff"]), Limits(600, 0, True)),
+        (user("student-2"), Limits(1800, 0, False)),
+    ],
+)
+def test_for_user(record, limits):
+    policy = CullPolicy(rules + [{"timeout": 10}], timeout=600)
+    assert policy.for_user(record) == limits
+
+
+def test_uses():
+    policy = CullPolicy(rules, timeout=600)
+    assert policy.uses_groups
+    assert policy.uses_profiles
+    policy = CullPolicy([{"users": ["alice"], "exempt": True}], timeout=600)
+    assert not policy.uses_groups
+    assert not policy.uses_profiles
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"group": ["staff"]},
+        {"groups": "staff"},
+        {"users": "alice"},
+        {"user_pattern": "("},
+        {"user_pattern": 5},
+        {"user_pattern": ["alice"]},
+    ],
+)
+def test_invalid(rule):
+    with pytest.raises(ValueError):
+        CullPolicy([rule], timeout=600)
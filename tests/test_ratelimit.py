@@ -0,0 +1,16 @@
+import asyncio
+import time
+
+from jupyterhub_idle_culler.ratelimit import TokenBucket
+
+
+async def test_token_bucket():
+    bucket = TokenBucket(20, burst=5)
+    tic = time.perf_counter()
+    # the burst is immediate
+    for _ in range(5):
+        await bucket.acquire()
+    assert time.perf_counter() - tic < 0.05
+    # then 20 per second
+    await asyncio.gather(*(bucket.acquire() for _ in range(5)))
+    assert 0.2 <= time.perf_counter() - tic < 0.5
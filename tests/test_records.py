@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from jupyterhub_idle_culler import user_record
+from jupyterhub_idle_culler.records import (
+    ServerRecord,
+    UserRecord,
+    cull_priority,
+    decide_server,
+    decide_user,
+)
+
+now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def ago(seconds):
+    return now - timedelta(seconds=seconds)
+
+
+@pytest.mark.parametrize(
+    "server, kwargs, cull, reason, recheck",
+    [
+        (
+            ServerRecord(started=ago(100), last_activity=ago(50)),
+            {},
+            False,
+            None,
+            550,
+        ),
+        (
+            ServerRecord(started=ago(1000), last_activity=ago(700)),
+            {"cull_result": True},
+            True,
+            "inactive",
+            None,
+        ),
+        # the arbiter says no, no recheck before the next full scan
+        (
+            ServerRecord(started=ago(1000), last_activity=ago(700)),
+            {"cull_result": False},
+            False,
+            None,
+            None,
+        ),
+        # ... unless max_age will be reached
+        (
+            ServerRecord(started=ago(1000), last_activity=ago(700)),
+            {"cull_result": False, "max_age": 1200},
+            False,
+            None,
+            200,
+        ),
+        # no activity yet, use start date
+        (
+            ServerRecord(started=ago(700)),
+            {"cull_result": True},
+            True,
+            "inactive",
+            None,
+        ),
+        # culling this type of server is disabled, but max age applies
+        (
+            ServerRecord(started=ago(1000), last_activity=ago(700)),
+            {"cull_enabled": False, "max_age": 1200},
+            False,
+            None,
+            200,
+        ),
+        (
+            ServerRecord(started=ago(1300), last_activity=ago(10)),
+            {"cull_result": False, "max_age": 1200},
+            True,
+            "age",
+            None,
+        ),
+    ],
+)
+def test_decide_server(server, kwargs, cull, reason, recheck):
+    kwargs.setdefault("cull_result", False)
+    decision = decide_server(server, now, inactive_limit=600, **kwargs)
+    assert decision.cull == cull
+    assert decision.reason == reason
+    assert decision.recheck == recheck
+
+
+@pytest.mark.parametrize(
+    "user, kwargs, cull, reason, recheck",
+    [
+        (
+            UserRecord("a", created=ago(1000), last_activity=ago(100)),
+            {},
+            False,
+            None,
+            500,
+        ),
+        (
+            UserRecord("a", created=ago(1000), last_activity=ago(700)),
+            {},
+            True,
+            "inactive",
+            None,
+        ),
+        (
+            UserRecord("a", admin=True, created=ago(1000), last_activity=ago(700)),
+            {"cull_admin_users": False},
+            False,
+            None,
+            None,
+        ),
+        (
+            UserRecord("a", created=ago(1300), last_activity=ago(10)),
+            {"max_age": 1200},
+            True,
+            "age",
+            None,
+        ),
+        # no activity, use creation date
+        (UserRecord("a", created=ago(300)), {}, False, None, 300),
+    ],
+)
+def test_decide_user(user, kwargs, cull, reason, recheck):
+    decision = decide_user(user, now, inactive_limit=600, **kwargs)
+    assert decision.cull == cull
+    assert decision.reason == reason
+    assert decision.recheck == recheck
+
+
+def test_user_record():
+    model = {
+        "name": "alice",
+        "admin": True,
+        "created": "2024-01-01T00:00:00Z",
+        "last_activity": None,
+        "servers": {
+            "": {
+                "name": "",
+                "pending": None,
+                "ready": True,
+                "url": "/user/alice/",
+                "started": "2024-01-01T00:00:00.000000Z",
+                "last_activity": "2024-01-01T01:00:00.000000Z",
+            },
+        },
+    }
+    user = user_record(model)
+    assert user.name == "alice"
+    assert user.admin
+    assert user.created == now
+    assert user.last_activity is None
+    assert user.model is None
+    server = user.servers[""]
+    assert server.ready
+    assert server.started == now
+    assert server.last_activity == now + timedelta(hours=1)
+    assert server.model is None
+
+    user = user_record(model, keep_model=True)
+    assert user.model is model
+    assert user.servers[""].model is model["servers"][""]
+
+
+def test_user_record_pre_09():
+    # jupyterhub < 0.9 without named servers has no 'servers' model
+    user = user_record(
+        {
+            "name": "bob",
+            "admin": False,
+            "last_activity": "2024-01-01T00:00:00Z",
+            "pending": None,
+            "server": "/user/bob/",
+        }
+    )
+    assert list(user.servers) == [""]
+    server = user.servers[""]
+    assert server.ready
+    assert server.started is None
+    assert server.last_activity == now
+
+
+def test_cull_priority():
+    older = decide_server(
+        ServerRecord(started=ago(2000), last_activity=ago(700)), now, inactive_limit=600
+    )
+    idler = decide_server(
+        ServerRecord(started=ago(1000), last_activity=ago(900)), now, inactive_limit=600
+    )
+    assert cull_priority(idler, "inactive") < cull_priority(older, "inactive")
+    assert cull_priority(older, "age") < cull_priority(idler, "age")
+    assert cull_priority(older, "score", 2) < cull_priority(idler, "score", 1)
+    # True isn't a score
+    assert cull_priority(idler, "score", True) == cull_priority(idler, "inactive")
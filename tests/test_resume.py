@@ -0,0 +1,30 @@
+from jupyterhub_idle_culler.resume import ResumePoint
+
+
+def test_resume_point_memory():
+    resume = ResumePoint()
+    assert resume.get() is None
+    resume.save("ready", 40)
+    assert resume.get() == ("ready", 40, None)
+    resume.clear()
+    assert resume.get() is None
+
+
+def test_resume_point_file(tmp_path):
+    path = str(tmp_path / "state.json")
+    resume = ResumePoint(path)
+    resume.save(None, 20, 60)
+    # survives restarts
+    assert ResumePoint(path).get() == (None, 20, 60)
+    resume.clear()
+    assert ResumePoint(path).get() is None
+    assert not (tmp_path / "state.json").exists()
+
+
+def test_resume_point_invalid_file(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("{not json")
+    resume = ResumePoint(str(path))
+    assert resume.get() is None
+    resume.save("inactive", 5)
+    assert ResumePoint(str(path)).get() == ("inactive", 5, None)
@@ -0,0 +1,30 @@
+from jupyterhub_idle_culler.rolling import RollingCursor
+
+listings = ["inactive", "ready"]
+
+
+def test_rolling_cursor():
+    cursor = RollingCursor(4)
+    assert cursor.position(listings) == ("inactive", 0)
+    # unknown until listed
+    assert cursor.slice_size(listings) == 0
+    cursor.advance(listings, listed=2, gone=0, total=2, end=True)
+    assert cursor.position(listings) == ("ready", 0)
+    cursor.advance(listings, listed=5, gone=0, total=10, end=False)
+    assert cursor.slice_size(listings) == 3
+    assert cursor.position(listings) == ("ready", 5)
+    # users culled in a slice no longer shift the next one
+    cursor.advance(listings, listed=3, gone=2, total=8, end=False)
+    assert cursor.position(listings) == ("ready", 6)
+    cursor.advance(listings, listed=2, gone=0, total=8, end=True)
+    assert cursor.passes == 1
+    assert cursor.position(listings) == ("inactive", 0)
+
+
+def test_listings_change():
+    cursor = RollingCursor(4)
+    cursor.position(listings)
+    cursor.advance(listings, listed=2, gone=0, total=10, end=False)
+    # e.g. the Hub was downgraded to a version without state filters
+    assert cursor.position([None]) == (None, 0)
+    assert cursor.slice_size([None]) == 0
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta, timezone
+
+from jupyterhub_idle_culler.scheduler import DeadlineScheduler
+
+
+def test_deadline_scheduler():
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    scheduler = DeadlineScheduler()
+    assert scheduler.next_deadline() is None
+    scheduler.schedule("a", now + timedelta(seconds=30))
+    scheduler.schedule("b", now + timedelta(seconds=10))
+    # later deadlines don't replace earlier ones
+    scheduler.schedule("b", now + timedelta(seconds=60))
+    # earlier ones do
+    scheduler.schedule("a", now + timedelta(seconds=5))
+    assert len(scheduler) == 2
+    assert scheduler.next_deadline() == now + timedelta(seconds=5)
+
+    assert scheduler.pop_due(now) == []
+    assert scheduler.pop_due(now + timedelta(seconds=10)) == ["a", "b"]
+    assert len(scheduler) == 0
+    assert scheduler.next_deadline() is None
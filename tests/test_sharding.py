@@ -0,0 +1,26 @@
+import pytest
+
+from jupyterhub_idle_culler.sharding import acquire_shard_lock, shard_of
+
+
+def test_shard_of():
+    names = [f"user-{i}" for i in range(1000)]
+    shards = [shard_of(name, 4) for name in names]
+    assert set(shards) == {0, 1, 2, 3}
+    # stable across processes, unlike hash()
+    assert shard_of("alice", 4) == 3
+    assert shard_of("bob", 4) == 0
+
+
+def test_acquire_shard_lock(tmp_path):
+    locks = [acquire_shard_lock(str(tmp_path), 3) for _ in range(3)]
+    assert [index for index, f in locks] == [0, 1, 2]
+    with pytest.raises(RuntimeError):
+        acquire_shard_lock(str(tmp_path), 3)
+
+    # released locks can be taken again
+    locks[1][1].close()
+    index, f = acquire_shard_lock(str(tmp_path), 3)
+    assert index == 1
+    for _, f in locks:
+        f.close()
@@ -0,0 +1,111 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from jupyterhub_idle_culler.simulate import load_snapshot, simulate
+
+now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def ago(seconds):
+    return (now - timedelta(seconds=seconds)).isoformat()
+
+
+def user_model(name, *, admin=False, created=2000, last_activity=None, servers=()):
+    return {
+        "name": name,
+        "admin": admin,
+        "created": ago(created),
+        "last_activity": ago(last_activity) if last_activity else None,
+        "servers": {
+            server_name: {
+                "name": server_name,
+                "ready": True,
+                "pending": None,
+                "started": ago(started),
+                "last_activity": ago(inactive),
+            }
+            for server_name, started, inactive in servers
+        },
+    }
+
+
+users = [
+    user_model("active", last_activity=10, servers=[("", 1000, 10)]),
+    user_model("idle", last_activity=700, servers=[("", 1000, 700)]),
+    user_model("old", last_activity=10, servers=[("", 5000, 10)]),
+    user_model("gone", last_activity=700),
+    user_model("admin", admin=True, last_activity=700),
+]
+
+
+@pytest.mark.parametrize("layout", ["list", "page", "lines"])
+def test_load_snapshot(tmp_path, layout):
+    path = tmp_path / "users.json"
+    if layout == "list":
+        path.write_text(json.dumps(users))
+    elif layout == "page":
+        path.write_text(json.dumps({"items": users, "_pagination": {}}))
+    else:
+        path.write_text("\n".join(json.dumps(user) for user in users) + "\n")
+    assert [user["name"] for user in load_snapshot(path)] == [
+        user["name"] for user in users
+    ]
+
+
+async def test_simulate():
+    report = await simulate(
+        users,
+        now,
+        inactive_limit=600,
+        max_age=3600,
+        cull_users=True,
+        cull_admin_users=False,
+    )
+    assert report["users"] == 5
+    assert report["servers"] == 3
+    assert report["servers_culled"] == {"timeout": 1, "max_age": 1}
+    assert report["servers_kept"] == {"active": 1}
+    assert report["users_culled"] == {"timeout": 2}
+    assert report["users_kept"] == {"servers_running": 1, "active": 1, "admin": 1}
+    assert report["decision_seconds"] >= 0
+
+
+async def test_simulate_arbiter():
+    async def cull_arbiter(*, inactive, inactive_limit, server, **kwargs):
+        # cull only servers with a profile, regardless of the timeout
+        return server["user_options"].get("profile") == "gpu"
+
+    snapshot = [
+        user_model("gpu", servers=[("", 1000, 10)]),
+        user_model("cpu", servers=[("", 1000, 700)]),
+    ]
+    snapshot[0]["servers"][""]["user_options"] = {"profile": "gpu"}
+    snapshot[1]["servers"][""]["user_options"] = {}
+    report = await simulate(
+        snapshot, now, inactive_limit=600, cull_arbiter=cull_arbiter
+    )
+    assert report["servers_culled"] == {"arbiter": 1}
+    assert report["servers_kept"] == {"arbiter": 1}
+
+
+async def test_simulate_batch_candidates():
+    batches = []
+
+    def cull_arbiter_batch(candidates):
+        batches.append(candidates)
+        return {}
+
+    snapshot = [user_model("both", servers=[("", 1000, 700), ("lab", 1000, 700)])]
+    report = await simulate(
+        snapshot,
+        now,
+        inactive_limit=600,
+        cull_named_servers=False,
+        cull_arbiter_batch=cull_arbiter_batch,
+    )
+    # named servers aren't culled, so the batch hook isn't asked about them
+    assert [candidate["server_name"] for candidate in batches[0]] == [""]
+    assert report["servers_culled"] == {"timeout": 1}
+    assert report["servers_kept"] == {"disabled": 1}
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+from jupyterhub_idle_culler.tracing import JsonLinesExporter, Tracer
+
+
+class ListExporter:
+    def __init__(self):
+        self.payloads = []
+
+    async def export(self, payload):
+        self.payloads.append(payload)
+
+    def close(self):
+        pass
+
+
+def spans_of(payload):
+    return payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+
+async def test_nested_spans():
+    tracer = Tracer(ListExporter())
+
+    async def child(name):
+        with tracer.span("child", {"name": name, "n": 1}):
+            await asyncio.sleep(0)
+
+    with tracer.span("root") as root:
+        await asyncio.gather(child("a"), child("b"))
+    with pytest.raises(ValueError):
+        with tracer.span("failing"):
+            raise ValueError("oops")
+
+    spans = {span["name"]: span for span in spans_of(tracer.flush())}
+    assert set(spans) == {"root", "child", "failing"}
+    assert "parentSpanId" not in spans["root"]
+    assert spans["child"]["parentSpanId"] == root.span_id
+    assert spans["child"]["traceId"] == root.trace_id
+    assert {"key": "n", "value": {"intValue": "1"}} in spans["child"]["attributes"]
+    # a new trace
+    assert spans["failing"]["traceId"] != root.trace_id
+    assert spans["failing"]["status"] == {"code": 2, "message": "oops"}
+    assert spans["root"]["status"] == {"code": 1}
+    assert int(spans["root"]["endTimeUnixNano"]) >= int(
+        spans["root"]["startTimeUnixNano"]
+    )
+    # flushed
+    assert spans_of(tracer.flush()) == []
+
+
+async def test_disabled():
+    tracer = Tracer()
+    with tracer.span("root") as span:
+        span.set_attribute("a", 1)
+    assert spans_of(tracer.flush()) == []
+
+
+async def test_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(JsonLinesExporter(path))
+    for _ in range(2):
+        with tracer.span("cull_cycle"):
+            pass
+        await tracer.export()
+    # nothing to export
+    await tracer.export()
+    tracer.close()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert [span["name"] for span in spans_of(lines[0])] == ["cull_cycle"]
+
+
+async def test_export_failure(caplog):
+    class FailingExporter(ListExporter):
+        async def export(self, payload):
+            raise OSError("collector down")
+
+    tracer = Tracer(FailingExporter())
+    with tracer.span("cull_cycle"):
+        pass
+    await tracer.export()
+    assert "collector down" in caplog.text